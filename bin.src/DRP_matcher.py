@@ -2,17 +2,18 @@
 import warnings
 from collections import namedtuple
 import numpy as np
+import healpy
 import matplotlib.pyplot as plt
 import lsst.afw.geom as afw_geom
 import lsst.afw.table as afw_table
 import lsst.daf.persistence as dp
 import GCRCatalogs
+from desc.simulation_tools.match_summary import ra_offset
+from desc.simulation_tools.sky_matcher import SkyMatcher
 with warnings.catch_warnings():
     warnings.filterwarnings('ignore')
     from desc.sims.GCRCatSimInterface import FieldRotator
 
-plt.ion()
-
 Coldef = namedtuple('Coldef', 'name type doc'.split())
 
 def mag_cols(bands):
@@ -26,163 +27,285 @@ def make_SourceCatalog(new_cols):
         schema.addField(coldef.name, type=coldef.type, doc=coldef.doc)
     return afw_table.SourceCatalog(schema)
 
+def fill_SourceCatalog(catalog, columns):
+    """
+    Fill a catalog in bulk from numpy arrays, replacing its contents.
+
+    Parameters
+    ----------
+    catalog: lsst.afw.table.SourceCatalog
+        Catalog made by make_SourceCatalog.
+    columns: dict
+        numpy arrays of equal length keyed by column name.  Angles,
+        i.e., coord_ra and coord_dec, are in radians.
+
+    Returns
+    -------
+    lsst.afw.table.SourceCatalog: The filled catalog.
+    """
+    nrows = len(next(iter(columns.values()))) if columns else 0
+    catalog.resize(nrows)
+    # The resized catalog is contiguous, so its columns are writable
+    # numpy views.
+    for name, values in columns.items():
+        catalog[name][:] = values
+    return catalog
+
 class PatchSelector:
     protoDC2_ra = 55.064
     protoDC2_dec = -29.783
     field_rotator = FieldRotator(0, 0, protoDC2_ra, protoDC2_dec)
-    def __init__(self, butler, tract, patch_index):
-        # Get the patch boundaries.
-        skymap = butler.get('deepCoadd_skyMap')
-        tractInfo = skymap[tract]
-        wcs = tractInfo.getWcs()
-        patchInfo = tractInfo.getPatchInfo(patch_index)
-        patchBox = afw_geom.Box2D(patchInfo.getOuterBBox())
-        patch_corners = patchBox.getCorners()
-        ra_values, dec_values = [], []
-        for corner in patch_corners:
-            ra, dec = wcs.pixelToSky(corner)
-            ra_values.append(ra.asDegrees())
-            dec_values.append(dec.asDegrees())
-        self.ra_range = min(ra_values), max(ra_values)
-        self.dec_range = min(dec_values), max(dec_values)
+    inverse_rotator = FieldRotator(protoDC2_ra, protoDC2_dec, 0, 0)
+    healpix_nside = 32
+    def __init__(self, butler, tract, patch_index, skymap_index=None,
+                 margin=0):
+        if skymap_index is not None:
+            # Get the patch boundaries from the precomputed index.
+            self.ra_range, self.dec_range = skymap_index.bbox(
+                tract, '{},{}'.format(*patch_index))
+        else:
+            # Get the patch boundaries.
+            skymap = butler.get('deepCoadd_skyMap')
+            tractInfo = skymap[tract]
+            wcs = tractInfo.getWcs()
+            patchInfo = tractInfo.getPatchInfo(patch_index)
+            patchBox = afw_geom.Box2D(patchInfo.getOuterBBox())
+            patch_corners = patchBox.getCorners()
+            ra_values, dec_values = [], []
+            for corner in patch_corners:
+                ra, dec = wcs.pixelToSky(corner)
+                ra_values.append(ra.asDegrees())
+                dec_values.append(dec.asDegrees())
+            self.ra_range = min(ra_values), max(ra_values)
+            self.dec_range = min(dec_values), max(dec_values)
+        if margin > 0:
+            # Pad the patch boundaries by margin degrees so that objects
+            # just outside the patch are available for matching.
+            cos_dec = np.cos(np.radians(np.mean(self.dec_range)))
+            self.ra_range = (self.ra_range[0] - margin/cos_dec,
+                             self.ra_range[1] + margin/cos_dec)
+            self.dec_range = (self.dec_range[0] - margin,
+                              self.dec_range[1] + margin)
+        self._set_source_bounds()
+
+    def _set_source_bounds(self, npts=10, margin=1e-3):
+        """
+        Map the patch bounds back to the unrotated catalog coordinates
+        by sampling points along the box edges and applying the inverse
+        field rotation.
+        """
+        t = np.linspace(0, 1, npts)
+        ra0, ra1 = self.ra_range
+        dec0, dec1 = self.dec_range
+        ra = np.concatenate((ra0 + (ra1 - ra0)*t, np.full(npts, ra1),
+                             ra1 - (ra1 - ra0)*t, np.full(npts, ra0)))
+        dec = np.concatenate((np.full(npts, dec0), dec0 + (dec1 - dec0)*t,
+                              np.full(npts, dec1), dec1 - (dec1 - dec0)*t))
+        src_ra, src_dec = self.inverse_rotator.transform(ra, dec)
+        # The rotated patch lies near ra=0, so work with ra offsets
+        # wrapped to [-180, 180) about the center.
+        self.src_ra_center = np.mean(src_ra)
+        dra = (src_ra - self.src_ra_center + 180.) % 360. - 180.
+        self.src_dra_range = dra.min() - margin, dra.max() + margin
+        self.src_dec_range = src_dec.min() - margin, src_dec.max() + margin
+        corners = [0, npts, 2*npts, 3*npts]
+        self.src_corners = src_ra[corners], src_dec[corners]
+
+    def _in_source_bounds(self, ra, dec):
+        dra = (ra - self.src_ra_center + 180.) % 360. - 180.
+        return ((dra > self.src_dra_range[0]) & (dra < self.src_dra_range[1])
+                & (dec > self.src_dec_range[0])
+                & (dec < self.src_dec_range[1]))
+
+    def healpixels(self):
+        """
+        Return the ring-ordered healpixels at healpix_nside that
+        overlap the patch in the unrotated catalog coordinates.
+        """
+        vertices = healpy.ang2vec(*self.src_corners, lonlat=True)
+        return healpy.query_polygon(self.healpix_nside, vertices,
+                                    inclusive=True)
+
+    def native_filters(self, gc):
+        """
+        Return the GCR native filters that restrict the reads to the
+        healpixels overlapping the patch, or None if the catalog is not
+        partitioned by healpixel.
+        """
+        if 'healpix_pixel' not in gc.native_filter_quantities:
+            return None
+        pixels = set(self.healpixels())
+        return [(lambda pixel: pixel in pixels, 'healpix_pixel')]
 
     def __call__(self, gc, band, max_mag):
-        # Retrieve the desired columns and filter on magnitude values.
-        bandname = 'mag_true_{}_lsst'.format(band)
-        filter_ = '{} < {}'.format(bandname, max_mag)
-        print(filter_)
-        gc_cols = gc.get_quantities(['galaxy_id', 'ra_true', 'dec_true',
-                                     bandname], filters=[filter_])
-        print(len(gc_cols[bandname]))
+        return self.catalogs(gc, (band,), max_mag)[band]
+
+    def catalogs(self, gc, bands, max_mag):
+        """
+        Return a dict, keyed by band, of SourceCatalogs of the galaxies
+        in the patch with magnitudes < max_mag in that band, reading the
+        galaxy catalog once for all of the bands.
+        """
+        # Retrieve the desired columns, reading only the healpixels
+        # overlapping the patch, and filter on the patch bounds in the
+        # unrotated coordinates and, for a single band, on magnitude.
+        bandnames = {band: 'mag_true_{}_lsst'.format(band) for band in bands}
+        filters = [(self._in_source_bounds, 'ra_true', 'dec_true')]
+        if len(bands) == 1:
+            filters.append('{} < {}'.format(bandnames[bands[0]], max_mag))
+        gc_cols = gc.get_quantities(['galaxy_id', 'ra_true', 'dec_true']
+                                    + list(bandnames.values()),
+                                    filters=filters,
+                                    native_filters=self.native_filters(gc))
         # Rotate to the Run1.2p field.
         gc_ra_rot, gc_dec_rot \
             = self.field_rotator.transform(gc_cols['ra_true'],
                                            gc_cols['dec_true'])
 
         # Select the galaxies within the patch.
-        index = np.where((gc_ra_rot > self.ra_range[0]) &
-                         (gc_ra_rot < self.ra_range[1]) &
-                         (gc_dec_rot > self.dec_range[0]) &
-                         (gc_dec_rot < self.dec_range[1]))
-        galaxy_id = gc_cols['galaxy_id'][index]
-        gc_ra = gc_ra_rot[index]
-        gc_dec = gc_dec_rot[index]
-        gc_mag = gc_cols[bandname][index]
-        print(len(galaxy_id))
-
-        # Create a SourceCatalog with the galaxy_ids, coordinates, magnitudes
-        galaxy_catalog = make_SourceCatalog(mag_cols((band,)))
-        for id_, ra, dec, mag in zip(galaxy_id, gc_ra, gc_dec, gc_mag):
-            record = galaxy_catalog.addNew()
-            record.set('id', id_)
-            record.set('coord_ra', afw_geom.Angle(ra, afw_geom.degrees))
-            record.set('coord_dec', afw_geom.Angle(dec, afw_geom.degrees))
-            record.set('mag_{}'.format(band), mag)
-        return galaxy_catalog
-
-# Create a data butler for the repo.
-repo = '/global/projecta/projectdirs/lsst/global/in2p3/Run1.1-test2/output'
-butler = dp.Butler(repo)
-
-# Pick filter, tract, and patch.
-filter_ = 'u'
-mag_max = 24.5
-#tract = 4850
-#tract = 5063
-tract = 4638
-patch_index = 2, 2
-patch_id = '{},{}'.format(*patch_index)
-
-# Create function to down-select galaxy catalog entries to lie within
-# a tract/patch.
-patch_selector = PatchSelector(butler, tract, patch_index)
-
-# Get the DRP catalog for a selected tract and patch
-dataId = dict(tract=tract, patch=patch_id, filter=filter_)
-coadd_catalog = butler.get('deepCoadd_meas', dataId=dataId)
-coadd_calexp = butler.get('deepCoadd', dataId=dataId)
-calib = coadd_calexp.getCalib()
-
-# Select primary (deblended) DRP galaxies with mag < mag_max.
-ext = coadd_catalog.get('base_ClassificationExtendedness_value')
-model_flag = coadd_catalog.get('modelfit_CModel_flag')
-model_flux = coadd_catalog.get('modelfit_CModel_flux')
-is_primary = coadd_catalog.get('detect_isPrimary')
-cat_temp = coadd_catalog.subset((ext == 1) &
-                                (model_flag == False) &
-                                (model_flux > 0) &
-                                (is_primary == True))
-mag = calib.getMagnitude(cat_temp['modelfit_CModel_flux'])
-cat_temp = cat_temp.subset(mag < mag_max)
-
-drp_catalog = make_SourceCatalog(mag_cols((filter_,)))
-for record in cat_temp:
-    new_rec = drp_catalog.addNew()
-    for name in 'id coord_ra coord_dec parent'.split():
-        new_rec.set(name, record[name])
-    new_rec.set('mag_{}'.format(filter_),
-                calib.getMagnitude(record['modelfit_CModel_flux']))
-
-# Read in the galaxy catalog data.
-with warnings.catch_warnings():
-    warnings.filterwarnings('ignore')
-    gc = GCRCatalogs.load_catalog('proto-dc2_v2.1.2_test')
-
-# Create a SourceCatalog from the gc data, restricting to the
-# tract/patch being considered.
-galaxy_catalog = patch_selector(gc, band=filter_, max_mag=mag_max)
-
-# Find positional matches within 100 milliarcseconds.
-radius = afw_geom.Angle(0.1, afw_geom.arcseconds)
-matches = afw_table.matchRaDec(drp_catalog, galaxy_catalog, radius)
-
-# Compare magnitudes for matched objects.
-drp_mag = np.zeros(len(matches), dtype=np.float)
-gc_mag = np.zeros(len(matches), dtype=np.float)
-sep = np.zeros(len(matches), dtype=np.float)
-# Arrays for a quiver plot.
-u = np.zeros(len(matches), dtype=np.float)
-v = np.zeros(len(matches), dtype=np.float)
-for i, match in enumerate(matches):
-    drp_mag[i] = match.first['mag_{}'.format(filter_)]
-    gc_mag[i] = match.second['mag_{}'.format(filter_)]
-    sep[i] = np.degrees(match.distance)*3600.*1000.
-    u[i] = match.first['coord_ra'] - match.second['coord_ra']
-    v[i] = match.first['coord_dec'] - match.second['coord_dec']
-
-title = 'Run1.1p, filter={}, tract={}, patch={}'.format(filter_, tract,
-                                                        patch_id)
-plt.rcParams['figure.figsize'] = 8, 8
-fig = plt.figure()
-frame_axes = fig.add_subplot(111, frameon=False)
-frame_axes.set_title(title)
-frame_axes.get_xaxis().set_ticks([])
-frame_axes.get_yaxis().set_ticks([])
-
-# Histogram of match separations.
-fig.add_subplot(2, 2, 1)
-plt.hist(sep, range=(0, 100), histtype='step', bins=40)
-plt.xlabel('separation (marcsec)')
-plt.ylabel('entries / bin')
-
-# Quiver plot of (DRP - galaxy_catalog) positions on the sky.
-fig.add_subplot(2, 2, 2)
-plt.quiver(np.degrees(drp_catalog['coord_ra']),
-           np.degrees(drp_catalog['coord_dec']),
-           u, v)
-plt.xlabel('RA (deg)')
-plt.ylabel('Dec (deg)')
-
-# Difference in magnitudes vs mag_gc.
-fig.add_subplot(2, 2, 3)
-plt.errorbar(gc_mag, gc_mag - drp_mag, fmt='.')
-plt.xlabel('{}_gc'.format(filter_))
-plt.ylabel('{0}_gc - {0}_drp'.format(filter_))
-
-# Difference in magnitudes vs separation.
-fig.add_subplot(2, 2, 4)
-plt.errorbar(sep, gc_mag - drp_mag, fmt='.')
-plt.xlabel('separation (marcsec)')
-plt.ylabel('{0}_gc - {0}_drp'.format(filter_))
-
-plt.tight_layout()
+        in_patch = ((gc_ra_rot > self.ra_range[0]) &
+                    (gc_ra_rot < self.ra_range[1]) &
+                    (gc_dec_rot > self.dec_range[0]) &
+                    (gc_dec_rot < self.dec_range[1]))
+
+        # Create SourceCatalogs with the galaxy_ids, coordinates, and
+        # magnitudes.
+        galaxy_catalogs = dict()
+        for band, bandname in bandnames.items():
+            index = np.where(in_patch & (gc_cols[bandname] < max_mag))
+            galaxy_catalog = make_SourceCatalog(mag_cols((band,)))
+            galaxy_catalogs[band] = fill_SourceCatalog(galaxy_catalog, {
+                'id': gc_cols['galaxy_id'][index],
+                'coord_ra': np.radians(gc_ra_rot[index]),
+                'coord_dec': np.radians(gc_dec_rot[index]),
+                'mag_{}'.format(band): gc_cols[bandname][index]})
+        return galaxy_catalogs
+
+def drp_galaxy_catalog(butler, tract, patch_id, filter_, mag_max):
+    """
+    Return a SourceCatalog of the primary (deblended) DRP galaxies with
+    cModel magnitude < mag_max for a tract and patch.
+    """
+    dataId = dict(tract=tract, patch=patch_id, filter=filter_)
+    coadd_catalog = butler.get('deepCoadd_meas', dataId=dataId)
+    coadd_calexp = butler.get('deepCoadd', dataId=dataId)
+    calib = coadd_calexp.getCalib()
+
+    ext = coadd_catalog.get('base_ClassificationExtendedness_value')
+    model_flag = coadd_catalog.get('modelfit_CModel_flag')
+    model_flux = coadd_catalog.get('modelfit_CModel_flux')
+    is_primary = coadd_catalog.get('detect_isPrimary')
+    cat_temp = coadd_catalog.subset((ext == 1) &
+                                    (model_flag == False) &
+                                    (model_flux > 0) &
+                                    (is_primary == True))
+    mag = calib.getMagnitude(cat_temp['modelfit_CModel_flux'])
+    # Deep copy the subset so that its columns are contiguous arrays.
+    cat_temp = cat_temp.subset(mag < mag_max).copy(deep=True)
+
+    drp_catalog = make_SourceCatalog(mag_cols((filter_,)))
+    columns = {name: cat_temp[name]
+               for name in 'id coord_ra coord_dec parent'.split()}
+    columns['mag_{}'.format(filter_)] = mag[mag < mag_max]
+    return fill_SourceCatalog(drp_catalog, columns)
+
+def match_catalogs(drp_catalog, galaxy_catalog, filter_, radius_mas=100.):
+    """
+    Find the nearest galaxy catalog match within radius_mas
+    milliarcseconds of each DRP object, and return the matched ids,
+    magnitudes, separations (mas), DRP positions (radians), and the
+    (DRP - galaxy catalog) position offsets (radians) as numpy arrays.
+    The RA offsets are wrapped to [-pi, pi).
+    """
+    mag_name = 'mag_{}'.format(filter_)
+    matcher = SkyMatcher(galaxy_catalog['coord_ra'],
+                         galaxy_catalog['coord_dec'])
+    drp_ra, drp_dec = drp_catalog['coord_ra'], drp_catalog['coord_dec']
+    src_index, ref_index, sep \
+        = matcher.nearest(drp_ra, drp_dec,
+                          max_sep=np.radians(radius_mas/1000./3600.))
+    ra, dec = drp_ra[src_index], drp_dec[src_index]
+    return dict(drp_id=drp_catalog['id'][src_index],
+                gc_id=galaxy_catalog['id'][ref_index],
+                drp_mag=drp_catalog[mag_name][src_index],
+                gc_mag=galaxy_catalog[mag_name][ref_index],
+                sep=np.degrees(sep)*3600.*1000., ra=ra, dec=dec,
+                u=ra_offset(ra, galaxy_catalog['coord_ra'][ref_index]),
+                v=dec - galaxy_catalog['coord_dec'][ref_index])
+
+def plot_matches(matched, filter_, title):
+    """Plot the separations, offsets, and magnitude differences."""
+    drp_mag, gc_mag, sep = matched['drp_mag'], matched['gc_mag'], \
+                           matched['sep']
+    plt.rcParams['figure.figsize'] = 8, 8
+    fig = plt.figure()
+    frame_axes = fig.add_subplot(111, frameon=False)
+    frame_axes.set_title(title)
+    frame_axes.get_xaxis().set_ticks([])
+    frame_axes.get_yaxis().set_ticks([])
+
+    # Histogram of match separations.
+    fig.add_subplot(2, 2, 1)
+    plt.hist(sep, range=(0, 100), histtype='step', bins=40)
+    plt.xlabel('separation (marcsec)')
+    plt.ylabel('entries / bin')
+
+    # Quiver plot of (DRP - galaxy_catalog) positions on the sky.
+    fig.add_subplot(2, 2, 2)
+    plt.quiver(np.degrees(matched['ra']), np.degrees(matched['dec']),
+               matched['u'], matched['v'])
+    plt.xlabel('RA (deg)')
+    plt.ylabel('Dec (deg)')
+
+    # Difference in magnitudes vs mag_gc.
+    fig.add_subplot(2, 2, 3)
+    plt.errorbar(gc_mag, gc_mag - drp_mag, fmt='.')
+    plt.xlabel('{}_gc'.format(filter_))
+    plt.ylabel('{0}_gc - {0}_drp'.format(filter_))
+
+    # Difference in magnitudes vs separation.
+    fig.add_subplot(2, 2, 4)
+    plt.errorbar(sep, gc_mag - drp_mag, fmt='.')
+    plt.xlabel('separation (marcsec)')
+    plt.ylabel('{0}_gc - {0}_drp'.format(filter_))
+
+    plt.tight_layout()
+    return fig
+
+if __name__ == '__main__':
+    plt.ion()
+
+    # Create a data butler for the repo.
+    repo = '/global/projecta/projectdirs/lsst/global/in2p3/Run1.1-test2/output'
+    butler = dp.Butler(repo)
+
+    # Pick filter, tract, and patch.
+    filter_ = 'u'
+    mag_max = 24.5
+    #tract = 4850
+    #tract = 5063
+    tract = 4638
+    patch_index = 2, 2
+    patch_id = '{},{}'.format(*patch_index)
+
+    # Create function to down-select galaxy catalog entries to lie within
+    # a tract/patch.
+    patch_selector = PatchSelector(butler, tract, patch_index)
+
+    # Get the DRP catalog for a selected tract and patch
+    drp_catalog = drp_galaxy_catalog(butler, tract, patch_id, filter_,
+                                     mag_max)
+
+    # Read in the galaxy catalog data.
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore')
+        gc = GCRCatalogs.load_catalog('proto-dc2_v2.1.2_test')
+
+    # Create a SourceCatalog from the gc data, restricting to the
+    # tract/patch being considered.
+    galaxy_catalog = patch_selector(gc, band=filter_, max_mag=mag_max)
+
+    matched = match_catalogs(drp_catalog, galaxy_catalog, filter_)
+    title = 'Run1.1p, filter={}, tract={}, patch={}'.format(filter_, tract,
+                                                            patch_id)
+    plot_matches(matched, filter_, title)
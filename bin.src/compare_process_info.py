@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Compare the per-object cpu time and the peak memory of sets of imSim
+runs to a baseline run, using ProcessTracker process-info logs.  The
+exit status is 1 if any significant regression is found.
+"""
+import sys
+import argparse
+from desc.simulation_tools.perf_compare import load_run, compare_runs, \
+    text_report, html_report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare imSim runs "
+                                     "using their process-info logs.")
+    parser.add_argument('--run', type=str, nargs='+', action='append',
+                        required=True, metavar=('LABEL', 'FILE'),
+                        help='run label followed by its process-info files. '
+                        'The first --run is the baseline.')
+    parser.add_argument('--align', type=str, default='id',
+                        choices=('id', 'galsimtype'),
+                        help='match objects by id or compare the per-type '
+                        'distributions [id]')
+    parser.add_argument('--threshold', type=float, default=0.05,
+                        help='fractional increase that counts as a '
+                        'regression [0.05]')
+    parser.add_argument('--nboot', type=int, default=1000,
+                        help='number of bootstrap samples [1000]')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='random number seed')
+    parser.add_argument('--html', type=str, default=None,
+                        help='output html report file')
+    args = parser.parse_args()
+
+    if len(args.run) < 2 or any(len(x) < 2 for x in args.run):
+        parser.error('at least two --run LABEL FILE [FILE ...] are required')
+
+    baseline = load_run(args.run[0][1:])
+    comparisons = []
+    for run in args.run[1:]:
+        comparisons.extend(compare_runs(baseline, load_run(run[1:]),
+                                        label=run[0], align=args.align,
+                                        threshold=args.threshold,
+                                        nboot=args.nboot, seed=args.seed))
+    print('baseline:', args.run[0][0])
+    print(text_report(comparisons))
+    if args.html is not None:
+        with open(args.html, 'w') as output:
+            output.write(html_report(comparisons))
+
+    if any(x.regression for x in comparisons):
+        sys.exit(1)
@@ -1,20 +1,33 @@
 #!/usr/bin/env python
-import os
-import glob
+import fnmatch
+import argparse
+from desc.simulation_tools.eimage_inventory import EimageInventory
 
-phosim_root_path = '/global/projecta/projectdirs/lsst/production/DC2'
-stream_paths = glob.glob(os.path.join(phosim_root_path, 'DC2-R1-2p*'))
+parser = argparse.ArgumentParser(description="Count the simulated "
+                                 "sensor-visits in the DC2 production.")
+parser.add_argument('--root_dir', type=str,
+                    default='/global/projecta/projectdirs/lsst/production/DC2',
+                    help='root directory of the DC2 production')
+parser.add_argument('--dataset_pattern', type=str, default='DC2-R1-2p*',
+                    help='glob pattern for the dataset directories '
+                    '[DC2-R1-2p*]')
+parser.add_argument('--inventory', type=str,
+                    default='eimage_inventory.sqlite',
+                    help='eimage inventory db file [eimage_inventory.sqlite]')
+args = parser.parse_args()
+
+inventory = EimageInventory(args.inventory)
+inventory.refresh(args.root_dir, args.dataset_pattern)
+counts = inventory.visit_counts()
+datasets = sorted(x for x in set(counts.dataset)
+                  if fnmatch.fnmatch(x, args.dataset_pattern))
 
 num_sensors = 0
-for folder in stream_paths:
-    print(os.path.basename(folder))
-    visit_dirs = sorted(glob.glob(os.path.join(folder, 'output', '*')))
-    for visit_dir in visit_dirs:
-        eimages = glob.glob(os.path.join(visit_dir, 'lsst_e*'))
-        if eimages:
-            obsHistID = os.path.basename(eimages[0]).split('_')[2]
-            print(os.path.basename(visit_dir), obsHistID, len(eimages))
-            num_sensors += len(eimages)
+for dataset in datasets:
+    print(dataset)
+    for row in counts[counts.dataset == dataset]:
+        print(row.stream, row.visit, row.num_sensors)
+        num_sensors += row.num_sensors
     print()
 
 print("total # sensor-visits simulated:", num_sensors)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Export coadd catalogs from a data repo to a Parquet dataset partitioned
+by tract and patch, and by band for per-filter data products,
+processing the patches in parallel.
+"""
+import os
+import argparse
+import multiprocessing
+import lsst.daf.persistence as dp
+from desc.simulation_tools.parquet_export import arrow_schema, \
+    write_patch_catalog
+from load_catalog_tables import get_patch_ids, get_tract_ids
+
+# Butlers created in the pool worker processes, keyed by repo.
+_butlers = dict()
+
+class ExportPatch:
+    """Callback function class for exporting a patch catalog to Parquet
+    via the multiprocessing module.
+    """
+    def __init__(self, repo, data_product, root, band=None):
+        self.repo = repo
+        self.data_product = data_product
+        self.root = root
+        self.band = band
+        self._schema = None
+
+    def __call__(self, tract, patch):
+        if self.repo not in _butlers:
+            # Create the butler once per worker process.
+            _butlers[self.repo] = dp.Butler(self.repo)
+        dataId = dict(tract=tract, patch=patch)
+        if self.band is not None:
+            dataId['filter'] = self.band
+        try:
+            catalog = _butlers[self.repo].get(self.data_product, dataId=dataId)
+        except RuntimeError:
+            return 0
+        if self._schema is None:
+            self._schema = arrow_schema(catalog.getSchema())
+        write_patch_catalog(catalog, self.root, tract, patch,
+                            band=self.band, schema=self._schema)
+        return len(catalog)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export coadd catalogs "
+                                     "to a partitioned Parquet dataset.")
+    parser.add_argument('repo', type=str, help='data repo')
+    parser.add_argument('outdir', type=str, help='root of the Parquet dataset')
+    parser.add_argument('--data_product', type=str, default='deepCoadd_ref',
+                        help='catalog data product [deepCoadd_ref]')
+    parser.add_argument('--filter', type=str, default=None,
+                        help='band for per-filter data products, e.g., '
+                        'deepCoadd_meas')
+    parser.add_argument('--tracts', type=int, nargs='+', default=None,
+                        help='tracts to export.  If omitted, export all '
+                        'tracts in deepCoadd-results/merged.')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of parallel processes')
+    parser.add_argument('--skymap_index', type=str, default=None,
+                        help='skymap index file from make_skymap_index.py')
+    args = parser.parse_args()
+
+    tract_ids = args.tracts if args.tracts is not None \
+                else get_tract_ids(args.repo)
+    patch_ids = get_patch_ids(dp.Butler(args.repo),
+                              skymap_index=args.skymap_index)
+
+    export_patch = ExportPatch(args.repo, args.data_product, args.outdir,
+                               band=args.filter)
+    results = []
+    with multiprocessing.Pool(processes=args.processes) as pool:
+        for tract in tract_ids:
+            for patch in patch_ids[tract]:
+                results.append((tract, patch,
+                                pool.apply_async(export_patch,
+                                                 (tract, patch))))
+        pool.close()
+        pool.join()
+        nrows = 0
+        for tract, patch, res in results:
+            nrows += res.get()
+    print("wrote", nrows, "rows to", os.path.abspath(args.outdir))
@@ -8,37 +8,32 @@ the transfer area.
 
 import os
 import glob
-import sqlite3
 import numpy as np
-from lsst.sims.utils import _angularSeparation
+from desc.simulation_tools.eimage_inventory import EimageInventory
+from desc.simulation_tools.opsim_pointings import OpsimPointings
+from desc.simulation_tools.visit_index import VisitIndex
 
-def opsim_db_visit_coords(opsim_db='/global/projecta/projectdirs/lsst/groups/SSim/DC2/minion_1016_desc_dithered_v4.db', box_size=5,
-                          ra0=55.064, dec0=-28.783):
-    # Extent of search region + fov radius (2.1 deg).
-    half_box_size = np.radians(box_size/2. + 2.1)
-    ra0, dec0 = np.radians((55.064, -28.783))
-    ra_min, ra_max = ra0 - half_box_size, ra0 + half_box_size
-    delta_dec = half_box_size/np.cos(dec0)
-    dec_min, dec_max = dec0 - delta_dec, dec0 + delta_dec
-    conn = sqlite3.connect(opsim_db)
-    query = """select obsHistID, descDitheredRa, descDitheredDec from summary
-where descDitheredRa > {} and descDitheredRa < {} and
-descDitheredDec > {} and descDitheredDec < {}""".format(ra_min, ra_max, dec_min, dec_max)
-    curs = conn.execute(query)
-    coords = {entry[0]: entry[1:3] for entry in curs}
-    return coords
+def opsim_visit_index(obsHistIDs, opsim_db='/global/projecta/projectdirs/lsst/groups/SSim/DC2/minion_1016_desc_dithered_v4.db',
+                      cache_file='opsim_pointings.npz'):
+    """
+    Return a VisitIndex of the dithered pointings of the requested
+    visits, reading any that are not in the cache file from the OpSim
+    db in a single query.
+    """
+    pointings = OpsimPointings(opsim_db, cache_file=cache_file)
+    if pointings.load(obsHistIDs) > 0 and cache_file is not None:
+        pointings.save()
+    return VisitIndex(pointings)
 
-def find_visits(stream_path):
-    obsHistIDs, num_sensors, streams = [], [], []
-    visit_dirs = sorted(glob.glob(os.path.join(stream_path, 'output', '*')))
-    for visit_dir in visit_dirs:
-        eimages = glob.glob(os.path.join(visit_dir, 'lsst_e*'))
-        if eimages:
-            obsHistID = int(os.path.basename(eimages[0]).split('_')[2])
-            obsHistIDs.append(obsHistID)
-            num_sensors.append(len(eimages))
-            streams.append(os.path.basename(visit_dir))
-    return np.array(obsHistIDs), np.array(num_sensors), np.array(streams)
+def find_visits(stream_path, inventory):
+    """
+    Return the obsHistIDs, number of sensors, and stream subdirectory
+    names of the visits simulated in stream_path, from the eimage
+    inventory.
+    """
+    counts = inventory.visit_counts(dataset=os.path.basename(stream_path))
+    return (np.array(counts.visit), np.array(counts.num_sensors),
+            np.array(counts.stream))
 
 
 if __name__ == '__main__':
@@ -47,10 +42,15 @@ if __name__ == '__main__':
     phosim_root_path = '/global/projecta/projectdirs/lsst/production/DC2'
     stream_paths = glob.glob(os.path.join(phosim_root_path,
                                           'DC2-R1-2p-WFD*'))
+    inventory = EimageInventory('eimage_inventory.sqlite')
+    inventory.refresh(phosim_root_path, 'DC2-R1-2p-WFD*')
 
 #    transfer_area = '/global/projecta/projectdirs/lsst/global/DC2'
     transfer_area = '.'
-    coords = opsim_db_visit_coords(box_size=6)
+    visits = {stream_path: find_visits(stream_path, inventory)
+              for stream_path in stream_paths}
+    visit_index = opsim_visit_index(np.concatenate(
+        [x[0] for x in visits.values()] + [np.zeros(0, dtype=int)]))
     for stream_path in stream_paths:
         print(stream_path)
 
@@ -59,11 +59,8 @@ if __name__ == '__main__':
         outdir = os.path.join(transfer_area, os.path.basename(stream_path))
         os.makedirs(outdir, exist_ok=True)
 
-        obsHistIDs, num_sensors, streams = find_visits(stream_path)
-        offsets = []
-        for obsHistID in obsHistIDs:
-            offsets.append(_angularSeparation(ra0, dec0, *coords[obsHistID]))
-        offsets = np.array(offsets)
+        obsHistIDs, num_sensors, streams = visits[stream_path]
+        offsets = visit_index.separations(ra0, dec0, obsHistIDs)
         index = np.argsort(offsets)
         icount = 0
         for obsHistID, stream, offset, nsensors \
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Fit the per-object imSim cost model to a set of process-info logs and
+predict the cpu time, wall time, and peak memory for a new instance
+catalog.
+"""
+import argparse
+from desc.simulation_tools.cost_model import read_process_info, \
+    fit_zero_point, CostModel
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fit the imSim per-object "
+                                     "cost model to ProcessTracker logs.")
+    parser.add_argument('process_info_files', type=str, nargs='+',
+                        help='process-info log files')
+    parser.add_argument('--instcat', type=str, default=None,
+                        help='instance catalog for which to predict costs')
+    parser.add_argument('--zero_point', type=float, default=None,
+                        help='magNorm zero point for computing ADU values')
+    parser.add_argument('--training_instcat', type=str, default=None,
+                        help='instance catalog used for the first log file; '
+                        'used to fit the zero point if --zero_point is not '
+                        'given')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='number of processes. If None, then the number '
+                        'that fits in --memory_budget is used.')
+    parser.add_argument('--memory_budget', type=float, default=96.,
+                        help='memory available on a node (GB) [96]')
+    parser.add_argument('--max_processes', type=int, default=68,
+                        help='maximum number of processes [68]')
+    args = parser.parse_args()
+
+    process_info_list = [read_process_info(x) for x in args.process_info_files]
+    cost_model = CostModel().fit(process_info_list)
+    print(cost_model.report())
+
+    if args.instcat is not None:
+        zero_point = args.zero_point
+        if zero_point is None:
+            if args.training_instcat is None:
+                raise RuntimeError('--zero_point or --training_instcat '
+                                   'is required to make a prediction')
+            zero_point = fit_zero_point(process_info_list[0],
+                                        args.training_instcat)
+        processes = args.processes
+        if processes is None:
+            processes = cost_model.suggest_processes(args.memory_budget,
+                                                     args.max_processes)
+        prediction = cost_model.predict_instcat(args.instcat, zero_point,
+                                                processes=processes)
+        print()
+        print('zero point:', zero_point)
+        print('processes:', prediction.processes)
+        print('total cpu time: %.1f s' % prediction.cpu_time)
+        print('wall time: %.1f s' % prediction.wall_time)
+        print('peak memory: %.2f GB' % prediction.peak_memory)
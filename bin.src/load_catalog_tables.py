@@ -2,10 +2,12 @@
 from __future__ import print_function
 import os
 import glob
-import shutil
 import numpy as np
 import pandas as pd
 import lsst.daf.persistence as dp
+from desc.simulation_tools.catalog_loader import CatalogLoader, \
+    SqliteBackend, PservBackend
+from desc.simulation_tools.skymap_index import SkyMapIndex
 
 def create_sql_schema(catalog, outfile, table_name):
     """
@@ -74,7 +76,7 @@ def write_csv_file(catalog, tract, patch, outfile=None):
         df.to_csv(outfile, index=False, columns=columns)
     return df
 
-def get_patch_ids(butler):
+def get_patch_ids(butler, skymap_index=None):
     """
     Get the patch ids from the SkyMap object.
 
@@ -82,11 +84,16 @@ def get_patch_ids(butler):
     ----------
     butler: lsst.daf.persistence.Butler
         Data butler for the desired data repo.
+    skymap_index: str [None]
+        Filename of a SkyMapIndex written by make_skymap_index.py.  If
+        given, the patch ids are read from it instead of the skymap.
 
     Returns
     -------
     dict: A dictionary of patch IDs, keyed by tract ID.
     """
+    if skymap_index is not None:
+        return SkyMapIndex.read(skymap_index).patch_ids()
     skymap = butler.get('deepCoadd_skyMap')
     patch_ids = dict()
     for tract in skymap:
@@ -110,58 +117,113 @@ def get_tract_ids(repo):
     return [int(os.path.basename(x)) for x in
             glob.glob(os.path.join(repo, 'deepCoadd-results', 'merged', '*'))]
 
-if __name__ == '__main__':
-    import desc.pserv
-    dry_run = True
-    dry_run = False
-
-    db_info = dict(host='nerscdb04.nersc.gov',
-                   database='DESC_DC1_Level_2')
-    conn = desc.pserv.DbConnection(**db_info)
-
-    data_product = 'deepCoadd_ref'
-    dataId = dict()
-    band = 'merged'
-    schema_script = 'coadd_%s_catalog_schema.sql' % band
-    table_name = 'CoaddObject_Run1_1p'
-
-    csv_archive = 'csv_archive_Run1.1p'
-    if not os.path.isdir(csv_archive):
-        os.mkdir(csv_archive)
-
-    repo = 'Run1.1_output'
+def load_catalogs(butler, backend, tract_ids, patch_ids, table_name,
+                  schema_script, data_product='deepCoadd_ref', nmax=None,
+                  verify=False, defer_index=True):
+    """
+    Load the catalogs for a set of patches into a db table, skipping
+    patches already recorded as loaded in the manifest table.
 
-    tract_ids = get_tract_ids(repo)
-    butler = dp.Butler(repo)
-    patch_ids = get_patch_ids(butler)
+    Parameters
+    ----------
+    butler: lsst.daf.persistence.Butler
+        Data butler for the desired data repo.
+    backend: desc.simulation_tools.catalog_loader.DbBackend
+        Database backend.
+    tract_ids: list
+        Tract IDs to load.
+    patch_ids: dict
+        Patch IDs keyed by tract ID, as returned by get_patch_ids.
+    table_name: str
+        Name of the db table.
+    schema_script: str
+        Filename of the create table script.  It will be written by
+        create_sql_schema if it does not exist.
+    data_product: str ['deepCoadd_ref']
+        Catalog data product.
+    nmax: int [None]
+        Maximum number of patches to load.  If None, load all patches.
+    verify: bool [False]
+        If True, read the catalogs for patches already loaded and
+        reload them if their checksums have changed.
+    defer_index: bool [True]
+        If True, build the primary key index after loading.
 
-    nmax = 200
+    Returns
+    -------
+    int: The number of patches loaded.
+    """
+    loader = None
     n = 0
     for tract_id in tract_ids:
-        dataId['tract'] = tract_id
         for patch_id in patch_ids[tract_id]:
-            if n >= nmax:
+            if nmax is not None and n >= nmax:
                 break
-            dataId['patch'] = patch_id
-            csv_file \
-                = 'coadd_catalog_{}_{}_{}.csv'.format(band, tract_id, patch_id)
-            if os.path.isfile(os.path.join(csv_archive, csv_file)):
+            if (loader is not None and not verify
+                    and loader.is_loaded(tract_id, patch_id)):
                 continue
-
             try:
-                catalog = butler.get(data_product, dataId=dataId)
+                catalog = butler.get(data_product,
+                                     dataId=dict(tract=tract_id,
+                                                 patch=patch_id))
             except RuntimeError as eobj:
                 continue
+            if loader is None:
+                if not os.path.isfile(schema_script):
+                    create_sql_schema(catalog, schema_script, table_name)
+                loader = CatalogLoader(backend, table_name, schema_script,
+                                       defer_index=defer_index)
+            df = write_csv_file(catalog, tract_id, patch_id)
+            if loader.load(df, tract_id, patch_id):
+                print("loaded tract {}, patch {}: {} rows"
+                      .format(tract_id, patch_id, len(df)))
+                n += 1
+    if loader is not None:
+        loader.finalize()
+    return n
 
-            if not os.path.isfile(schema_script):
-                create_sql_schema(catalog, schema_script, table_name)
-                conn.run_script(schema_script, dry_run=dry_run)
-
-            df = write_csv_file(catalog, tract_id, patch_id, outfile=csv_file)
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Load coadd catalogs "
+                                     "into a db table.")
+    parser.add_argument('--repo', type=str, default='Run1.1_output',
+                        help='data repo [Run1.1_output]')
+    parser.add_argument('--backend', type=str, default='pserv',
+                        choices=('pserv', 'sqlite'), help='db backend')
+    parser.add_argument('--db_file', type=str, default='coadd_catalogs.db',
+                        help='SQLite db file for the sqlite backend')
+    parser.add_argument('--table_name', type=str,
+                        default='CoaddObject_Run1_1p', help='db table name')
+    parser.add_argument('--data_product', type=str, default='deepCoadd_ref',
+                        help='catalog data product [deepCoadd_ref]')
+    parser.add_argument('--nmax', type=int, default=200,
+                        help='maximum number of patches to load [200]')
+    parser.add_argument('--verify', default=False, action='store_true',
+                        help='reload loaded patches whose contents changed')
+    parser.add_argument('--skymap_index', type=str, default=None,
+                        help='skymap index file from make_skymap_index.py')
+    args = parser.parse_args()
 
-            print("loading %s" % csv_file)
-            if not dry_run:
-                conn.load_csv(table_name, csv_file)
-                shutil.move(csv_file, csv_archive)
+    band = 'merged'
+    schema_script = 'coadd_%s_catalog_schema.sql' % band
 
-            n += 1
+    if args.backend == 'sqlite':
+        backend = SqliteBackend(args.db_file)
+        defer_index = True
+    else:
+        import desc.pserv
+        db_info = dict(host='nerscdb04.nersc.gov',
+                       database='DESC_DC1_Level_2')
+        backend = PservBackend(desc.pserv.DbConnection(**db_info))
+        # The existing MySQL tables are created with their primary keys.
+        defer_index = False
+
+    tract_ids = get_tract_ids(args.repo)
+    butler = dp.Butler(args.repo)
+    patch_ids = get_patch_ids(butler, skymap_index=args.skymap_index)
+
+    load_catalogs(butler, backend, tract_ids, patch_ids, args.table_name,
+                  schema_script, data_product=args.data_product,
+                  nmax=args.nmax, verify=args.verify,
+                  defer_index=defer_index)
+    backend.close()
@@ -2,10 +2,20 @@
 """
 Script to make sky flats from eimage and calexp data.
 """
+import os
 import sys
+import json
+import time
 import argparse
+import multiprocessing
+import numpy as np
+import lsst.afw.image as afw_image
 import lsst.afw.math as afw_math
 import lsst.daf.persistence as dp
+from desc.simulation_tools.chunked_stacker import ChunkedStacker
+from desc.simulation_tools.prefetch import prefetch_map
+from desc.simulation_tools.sky_flat_accumulator import SkyFlatAccumulator
+from desc.simulation_tools.task_accounting import TaskAccountant
 
 def get_stats_control(exposure, exclude=('EDGE',)):
     """
@@ -19,8 +29,49 @@ def get_stats_control(exposure, exclude=('EDGE',)):
     stats_ctrl.setAndMask(bits)
     return stats_ctrl
 
+class FrameLoader:
+    """
+    Callback function class that reads an eimage, applies the calexp
+    mask, and computes the frame statistics, for running in the
+    prefetch threads.
+    """
+    def __init__(self, butler):
+        self.butler = butler
+
+    def __call__(self, dataref):
+        """
+        Returns
+        -------
+        (lsst.afw.image.MaskedImage, lsst.afw.math.StatisticsControl,
+         float, float): The masked image, the statistics control, and
+            the image median and clipped variance, or None if the
+            calexp is missing.
+        """
+        eimage = self.butler.get('eimage', dataref.dataId)
+        try:
+            # Add the calexp mask to the eimage exposure so that
+            # sources and other non-background features can be masked.
+            eimage.setMask(dataref.get().getMask())
+        except dp.NoResults as eobj:
+            # NoResults error from the butler.  Skip this exposure, but
+            # print a message reporting the error.
+            print(dataref.dataId, eobj)
+            return None
+        mi = eimage.getMaskedImage()
+        stats_ctrl = get_stats_control(eimage)
+        # Compute statistics on each image.
+        stats = afw_math.makeStatistics(mi, afw_math.MEDIAN | afw_math.VARIANCECLIP, stats_ctrl)
+        return (mi, stats_ctrl, stats.getValue(afw_math.MEDIAN),
+                stats.getValue(afw_math.VARIANCECLIP))
+
+# Mapping of afw_math stack statistics to the ChunkedStacker statistics.
+STACK_STATISTICS = {afw_math.MEAN: 'mean',
+                    afw_math.MEDIAN: 'median',
+                    afw_math.MEANCLIP: 'meanclip'}
+
 def make_sky_flat(butler, dataId, sky_flat_stat=afw_math.MEANCLIP,
-                  nframes=None):
+                  nframes=None, memory_budget=2*1024**3, scratch_dir=None,
+                  prefetch_depth=4, frame_stats=None):
     """
     Make a sky flat from eimages, appylying the calexp masks to avoid
     including counts from detected sources, cosmic rays, and other
@@ -33,13 +84,27 @@ def make_sky_flat(butler, dataId, sky_flat_stat=afw_math.MEANCLIP,
     dataId: dict specifying the band and sensor, e.g.,
         dict(raft='2,2', sensor='1,1', filter='r')
     sky_flat_stat: lsst.afw.math._statistics.Property [MEANCLIP]
-        Statistics property to apply to the stacked images.
-    med_range: tuple(float, float) [None]
-        If not None, this is the acceptance range for the median pixel
-        value of the eimages.
+        Statistics property to apply to the stacked images, one of
+        MEAN, MEDIAN, or MEANCLIP.
     nframes: int [None]
         If not None, only the first nframes of calexps will be included
         in the image stack.
+    memory_budget: int [2*1024**3]
+        Approximate upper bound in bytes on the memory used for
+        stacking.  The normalized frames are written to memory-mapped
+        scratch files and stacked in blocks of rows that fit in this
+        budget.
+    scratch_dir: str [None]
+        Directory for the scratch files.  If None, the system default
+        temporary directory is used.
+    prefetch_depth: int [4]
+        Number of eimage/calexp-mask pairs to read and compute
+        statistics for in background threads while the current frame
+        is being stacked.  Each pending frame holds a full
+        MaskedImage in memory.
+    frame_stats: list [None]
+        If not None, the (visit, median, clipped variance) of each
+        included frame are appended to this list.
 
     Returns
     -------
@@ -53,55 +118,63 @@ def make_sky_flat(butler, dataId, sky_flat_stat=afw_math.MEANCLIP,
         # Process all of the data.
         nframes = len(datarefs)
 
-    # Compile a list of eimages to include in the sky flat.
-    images = []
+    # Write the masked eimages to the stacker scratch area, while the
+    # next frames are read in the prefetch threads.
     medians = []
     stats_ctrl = None
-    for i, dataref in enumerate(datarefs[:nframes]):
-        sys.stdout.write("%s  %s  " % (i, nframes))
-        eimage = butler.get('eimage', dataref.dataId)
-        try:
-            # Add the calexp mask to the eimage exposure so that
-            # sources and other non-background features can be masked.
-            eimage.setMask(dataref.get().getMask())
-            mi = eimage.getMaskedImage()
-            if stats_ctrl is None:
-                stats_ctrl = get_stats_control(eimage)
-            # Compute statistics on each image.
-            stats = afw_math.makeStatistics(mi, afw_math.MEDIAN | afw_math.VARIANCECLIP, stats_ctrl)
-            image_median = stats.getValue(afw_math.MEDIAN)
-            image_variance = stats.getValue(afw_math.VARIANCECLIP)
-            images.append(mi)
+    stacker = None
+    try:
+        frames = prefetch_map(FrameLoader(butler), datarefs[:nframes],
+                              depth=prefetch_depth)
+        for i, frame in enumerate(frames):
+            if frame is None:
+                continue
+            mi, stats_ctrl, image_median, image_variance = frame
+            # Subtract the image median so that unmasked areas do
+            # not introduce structure in the final stacked image,
+            # and divide by it so that the frames have a common
+            # normalization and vignetting can be adequately
+            # captured given a range of sky levels.
+            image_array = mi.getImage().getArray()
+            if stacker is None:
+                stacker = ChunkedStacker(image_array.shape,
+                                         scratch_dir=scratch_dir)
+            stacker.add((image_array - image_median)/image_median,
+                        mask=(mi.getMask().getArray()
+                              & stats_ctrl.getAndMask()) != 0)
             medians.append(image_median)
-            sys.stdout.write("%s  %s" % (image_median, image_variance))
-        except dp.NoResults as eobj:
-            # NoResults error from the butler.  Skip this exposure, but
-            # print a message reporting the error.
-            print(dataref.dataId, eobj)
-        sys.stdout.write("\n")
-        sys.stdout.flush()
+            if frame_stats is not None:
+                frame_stats.append((datarefs[i].dataId['visit'],
+                                    image_median, image_variance))
+            print(i, nframes, image_median, image_variance)
+            sys.stdout.flush()
 
-    # Subtract the image medians so that unmasked areas do not
-    # introduce structure in the final stacked image, and scale the
-    # range of pixel values to a common normalization so that
-    # vignetting can be adequately captured given a range of sky
-    # levels.
-    median_sky_level \
-        = afw_math.makeStatistics(medians, afw_math.MEDIAN).getValue()
-    for median, mi in zip(medians, images):
-        mi -= median
-        mi *= median_sky_level/median
+        if stacker is None:
+            raise RuntimeError('no usable frames for {}'.format(dataId))
 
-    # Make the sky flat from the zeroed and scaled images
-    sky_flat = afw_math.statisticsStack(images, sky_flat_stat, stats_ctrl)
+        # Stack the zeroed and scaled images.
+        stacked, counts = stacker.stack(STACK_STATISTICS[sky_flat_stat],
+                                        memory_budget=memory_budget)
+    finally:
+        if stacker is not None:
+            stacker.close()
 
     # Compute the stacked sky level by applying the same estimator to the
     # list of image medians.
     sky_level = afw_math.makeStatistics(medians, sky_flat_stat).getValue()
 
     # Unscale and de-zero the sky flat image.
-    sky_flat /= median_sky_level/sky_level
-    sky_flat += sky_level
+    return sky_flat_image(sky_level*(1. + stacked), counts)
+
+def sky_flat_image(flat, counts):
+    """
+    Make a MaskedImage from a sky flat array, flagging the pixels that
+    were masked in every frame as NO_DATA, and print its statistics.
+    """
+    sky_flat = afw_image.MaskedImageF(
+        afw_image.ImageF(np.ascontiguousarray(flat, dtype=np.float32)))
+    no_data = sky_flat.getMask().getPlaneBitMask('NO_DATA')
+    sky_flat.getMask().getArray()[counts == 0] = no_data
 
     # Check stacked image statistics.
     stats = afw_math.makeStatistics(sky_flat,
@@ -111,9 +184,209 @@ def make_sky_flat(butler, dataId, sky_flat_stat=afw_math.MEANCLIP,
 
     return sky_flat
 
+def update_sky_flat(butler, dataId, state_dir, sky_flat_stat=afw_math.MEANCLIP,
+                    remove_visits=(), prefetch_depth=4, **state_kwds):
+    """
+    Fold the frames that are not yet in a persistent SkyFlatAccumulator
+    state into it, and make a sky flat from the updated state.  Only
+    the new frames, and any frames being removed, are read.
+
+    Parameters
+    ----------
+    butler: lsst.daf.persistence.Butler
+        Butler to the data repository containing the calexps and eimages.
+    dataId: dict specifying the band and sensor, e.g.,
+        dict(raft='2,2', sensor='1,1', filter='r')
+    state_dir: str
+        Directory of the accumulator state for this sensor and band.
+    sky_flat_stat: lsst.afw.math._statistics.Property [MEANCLIP]
+        Statistics property to apply, one of MEAN, MEDIAN, or MEANCLIP.
+    remove_visits: sequence [()]
+        Visits to remove from the state.
+    prefetch_depth: int [4]
+        Number of frames to read ahead.
+    state_kwds: dict
+        Keyword arguments, e.g., nbins, for creating a new
+        SkyFlatAccumulator state.
+
+    Returns
+    -------
+    lsst.afw.image.MaskedImage: A masked image containing the sky flat.
+    """
+    datarefs = {str(x.dataId['visit']): x
+                for x in butler.subset('calexp', **dataId)}
+    accumulator = None
+    if os.path.isfile(os.path.join(state_dir, 'provenance.json')):
+        accumulator = SkyFlatAccumulator(state_dir)
+    if remove_visits and accumulator is None:
+        raise RuntimeError('cannot remove visits: no accumulator state in '
+                           + state_dir)
+    for visit in remove_visits:
+        frame = FrameLoader(butler)(datarefs[str(visit)])
+        mi, stats_ctrl = frame[:2]
+        accumulator.remove_frame(str(visit), mi.getImage().getArray(),
+                                 mask=(mi.getMask().getArray()
+                                       & stats_ctrl.getAndMask()) != 0)
+        datarefs.pop(str(visit))
+    new_visits = [visit for visit in datarefs
+                  if accumulator is None or visit not in accumulator]
+    frames = prefetch_map(FrameLoader(butler),
+                          [datarefs[x] for x in new_visits],
+                          depth=prefetch_depth)
+    for visit, frame in zip(new_visits, frames):
+        if frame is None:
+            continue
+        mi, stats_ctrl, image_median, image_variance = frame
+        image_array = mi.getImage().getArray()
+        if accumulator is None:
+            accumulator = SkyFlatAccumulator(state_dir,
+                                             shape=image_array.shape,
+                                             **state_kwds)
+        accumulator.add_frame(visit, image_array, image_median,
+                              mask=(mi.getMask().getArray()
+                                    & stats_ctrl.getAndMask()) != 0,
+                              variance=image_variance)
+        print(visit, image_median, image_variance)
+        sys.stdout.flush()
+    if accumulator is None:
+        raise RuntimeError('no usable frames for {} and no accumulator '
+                           'state in {}'.format(dataId, state_dir))
+    accumulator.save()
+    print(len(accumulator.frame_ids), "frames in", state_dir)
+    print(np.count_nonzero(accumulator.out_of_range()),
+          "pixels with values outside r_range",
+          tuple(accumulator.provenance['r_range']))
+
+    flat, counts = accumulator.flat(STACK_STATISTICS[sky_flat_stat])
+    return sky_flat_image(flat, counts)
+
+# Approximate size in bytes of an eimage MaskedImageF (image, mask, and
+# variance planes) for an LSST sensor.
+FRAME_BYTES = 12*4072*4000
+
+def sky_flat_filename(raft, sensor, filter_, outdir='.'):
+    """Default output filename, e.g., sky_flat_fr_R22_S11.fits."""
+    return os.path.join(outdir, 'sky_flat_f%s_R%s_S%s.fits'
+                        % (filter_, raft[::2], sensor[::2]))
+
+def manifest_filename(outfile):
+    return os.path.splitext(outfile)[0] + '_manifest.json'
+
+def sensor_filter_combinations(butler, filters=None):
+    """
+    Return the sorted (raft, sensor, filter) combinations that have
+    calexps in the data repository.
+    """
+    combos = set(tuple(x) for x in
+                 butler.queryMetadata('calexp', ['raft', 'sensor', 'filter']))
+    return sorted(x for x in combos if filters is None or x[2] in filters)
+
+def is_current(outfile, visits):
+    """
+    Check if a sky flat exists and was made from the same set of
+    candidate visits according to its manifest.
+    """
+    manifest_file = manifest_filename(outfile)
+    if not (os.path.isfile(outfile) and os.path.isfile(manifest_file)):
+        return False
+    with open(manifest_file) as fd:
+        manifest = json.load(fd)
+    return sorted(manifest['visits']) == sorted(visits)
+
+class SkyFlatTask:
+    """
+    Callback function class for making the sky flat for a raft, sensor,
+    and filter, and writing its manifest, via the multiprocessing module.
+    """
+    def __init__(self, repo, outdir, sky_flat_stat=afw_math.MEANCLIP,
+                 memory_budget=2*1024**3, scratch_dir=None, prefetch_depth=4,
+                 force=False):
+        self.repo = repo
+        self.outdir = outdir
+        self.sky_flat_stat = sky_flat_stat
+        self.memory_budget = memory_budget
+        self.scratch_dir = scratch_dir
+        self.prefetch_depth = prefetch_depth
+        self.force = force
+
+    def __call__(self, raft, sensor, filter_):
+        butler = dp.Butler(self.repo)
+        dataId = dict(raft=raft, sensor=sensor, filter=filter_)
+        visits = sorted(int(x.dataId['visit'])
+                        for x in butler.subset('calexp', **dataId))
+        outfile = sky_flat_filename(raft, sensor, filter_, self.outdir)
+        if not self.force and is_current(outfile, visits):
+            return dict(outfile=outfile, status='current')
+        tstart = time.time()
+        frame_stats = []
+        sky_flat = make_sky_flat(butler, dataId,
+                                 sky_flat_stat=self.sky_flat_stat,
+                                 memory_budget=self.memory_budget,
+                                 scratch_dir=self.scratch_dir,
+                                 prefetch_depth=self.prefetch_depth,
+                                 frame_stats=frame_stats)
+        sky_flat.writeFits(outfile)
+        stats = afw_math.makeStatistics(sky_flat, afw_math.VARIANCECLIP
+                                        | afw_math.MEANCLIP)
+        manifest = dict(raft=raft, sensor=sensor, filter=filter_,
+                        repo=self.repo, outfile=outfile, visits=visits,
+                        frames=[dict(visit=int(visit), median=median,
+                                     variance=variance)
+                                for visit, median, variance in frame_stats],
+                        meanclip=stats.getValue(afw_math.MEANCLIP),
+                        varianceclip=stats.getValue(afw_math.VARIANCECLIP),
+                        memory_budget=self.memory_budget,
+                        prefetch_depth=self.prefetch_depth,
+                        wall_time=time.time() - tstart,
+                        created=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        manifest_file = manifest_filename(outfile)
+        with open(manifest_file + '.tmp', 'w') as output:
+            json.dump(manifest, output, indent=2)
+        os.replace(manifest_file + '.tmp', manifest_file)
+        return dict(outfile=outfile, status='made', nframes=len(frame_stats))
+
+def make_sky_flats(repo, outdir, filters=None, processes=1,
+                   memory_cap=16*1024**3, memory_budget=2*1024**3,
+                   prefetch_depth=4, scratch_dir=None, force=False,
+                   task_table=None):
+    """
+    Make the sky flats for all of the raft, sensor, and filter
+    combinations in a data repository, running them in a process pool.
+    The number of processes is reduced if needed so that the estimated
+    memory use of the concurrent jobs, i.e., the stacking budget plus
+    the prefetched frames for each, is within memory_cap.  Flats whose
+    outputs are current, according to their manifests, are skipped.
+
+    Returns
+    -------
+    list of dict: The status of each sky flat.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    combos = sensor_filter_combinations(dp.Butler(repo), filters=filters)
+    job_bytes = memory_budget + (prefetch_depth + 2)*FRAME_BYTES
+    processes = max(1, min(processes, memory_cap//job_bytes))
+    print("making", len(combos), "sky flats with", processes, "processes")
+    sky_flat_task = SkyFlatTask(repo, outdir, memory_budget=memory_budget,
+                                scratch_dir=scratch_dir,
+                                prefetch_depth=prefetch_depth, force=force)
+    accountant = TaskAccountant()
+    # Use a new worker process for each flat so that the memory of the
+    # frames is returned to the system.
+    with multiprocessing.Pool(processes=processes,
+                              maxtasksperchild=1) as pool:
+        for raft, sensor, filter_ in combos:
+            accountant.apply_async(pool, sky_flat_task, (raft, sensor, filter_),
+                                   task_id='%s_%s_%s' % (raft, sensor, filter_))
+        pool.close()
+        pool.join()
+        results = accountant.get()
+    print(accountant.report())
+    if task_table is not None:
+        accountant.write(task_table)
+    return results
+
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
-    import lsst.afw.image as afw_image
     import lsst.afw.display as afw_display
     import lsst.log
     # Silence the CameraMapper warnings about metadata.
@@ -129,15 +402,66 @@ if __name__ == '__main__':
                         help='output FITS filename [sky_flat_fb_Rxx_Sxx.fits]')
     parser.add_argument('--nframes', type=int, default=None,
                         help='maximum number of frames to process')
+    parser.add_argument('--memory_budget', type=float, default=2.,
+                        help='memory budget for stacking in GB [2]')
+    parser.add_argument('--scratch_dir', type=str, default=None,
+                        help='directory for the stacking scratch files')
+    parser.add_argument('--prefetch_depth', type=int, default=4,
+                        help='number of frames to read ahead [4]')
+    parser.add_argument('--state_dir', type=str, default=None,
+                        help='directory of a persistent accumulator state.  '
+                        'If given, only frames not already in the state '
+                        'are read.')
+    parser.add_argument('--remove_visits', type=int, nargs='+', default=(),
+                        help='visits to remove from the accumulator state')
+    parser.add_argument('--r_range', type=float, nargs=2, default=(0.5, 1.5),
+                        help='range of pixel/median covered by the histogram '
+                        'of a new accumulator state [0.5 1.5]')
+    parser.add_argument('--nbins', type=int, default=64,
+                        help='number of histogram bins of a new accumulator '
+                        'state [64]')
+    parser.add_argument('--batch', action='store_true', default=False,
+                        help='make the sky flats for all raft, sensor, '
+                        'and filter combinations in the repo')
+    parser.add_argument('--outdir', type=str, default='.',
+                        help='output directory for batch mode [.]')
+    parser.add_argument('--filters', type=str, default=None,
+                        help='filters to process in batch mode, e.g., ugr')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of parallel processes in batch mode [1]')
+    parser.add_argument('--memory_cap', type=float, default=16.,
+                        help='total memory cap in GB for batch mode [16]')
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='remake sky flats whose outputs are current')
     args = parser.parse_args()
 
+    if args.batch:
+        make_sky_flats(args.repo, args.outdir, filters=args.filters,
+                       processes=args.processes,
+                       memory_cap=int(args.memory_cap*1024**3),
+                       memory_budget=int(args.memory_budget*1024**3),
+                       prefetch_depth=args.prefetch_depth,
+                       scratch_dir=args.scratch_dir, force=args.force,
+                       task_table=os.path.join(args.outdir,
+                                               'sky_flat_tasks.txt'))
+        sys.exit(0)
+
     butler = dp.Butler(args.repo)
     dataId = dict(raft=args.raft, sensor=args.sensor, filter=args.filter)
 
-    sky_flat = make_sky_flat(butler, dataId, nframes=args.nframes)
+    if args.state_dir is not None:
+        sky_flat = update_sky_flat(butler, dataId, args.state_dir,
+                                   remove_visits=args.remove_visits,
+                                   prefetch_depth=args.prefetch_depth,
+                                   nbins=args.nbins,
+                                   r_range=tuple(args.r_range))
+    else:
+        sky_flat = make_sky_flat(butler, dataId, nframes=args.nframes,
+                                 memory_budget=int(args.memory_budget*1024**3),
+                                 scratch_dir=args.scratch_dir,
+                                 prefetch_depth=args.prefetch_depth)
 
     outfile = args.outfile
     if outfile is None:
-        outfile = 'sky_flat_f%s_R%s_S%s.fits' % (args.filter, args.raft[::2],
-                                                 args.sensor[::2])
+        outfile = sky_flat_filename(args.raft, args.sensor, args.filter)
     sky_flat.writeFits(outfile)
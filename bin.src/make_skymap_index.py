@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+"""
+Build the persisted tract/patch footprint index for a data repo's skymap.
+"""
+import argparse
+import lsst.daf.persistence as dp
+from desc.simulation_tools.skymap_index import SkyMapIndex
+from load_catalog_tables import get_tract_ids
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build a tract/patch "
+                                     "footprint index from a skymap.")
+    parser.add_argument('repo', type=str, help='data repo')
+    parser.add_argument('outfile', type=str, help='output .npz file')
+    parser.add_argument('--tracts', type=int, nargs='+', default=None,
+                        help='tracts to include.  If omitted, include all '
+                        'tracts in the skymap.')
+    parser.add_argument('--merged_tracts_only', default=False,
+                        action='store_true',
+                        help='include only the tracts in '
+                        'deepCoadd-results/merged')
+    args = parser.parse_args()
+
+    tracts = args.tracts
+    if args.merged_tracts_only:
+        tracts = get_tract_ids(args.repo)
+    skymap = dp.Butler(args.repo).get('deepCoadd_skyMap')
+    skymap_index = SkyMapIndex.build(skymap, tracts=tracts)
+    skymap_index.write(args.outfile)
+    print("wrote {} patches in {} tracts to {}"
+          .format(len(skymap_index), len(skymap_index.tract_ids()),
+                  args.outfile))
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Match DRP coadd galaxies to a GCR truth catalog for every patch and
+band of a set of tracts, running the patches in parallel, and write
+the matched pairs and per-patch summary statistics to Parquet datasets
+partitioned by band, tract, and patch, which can be read back with
+parquet_export.read_catalog.
+"""
+import os
+import warnings
+import argparse
+import multiprocessing
+import numpy as np
+import pyarrow as pa
+import lsst.daf.persistence as dp
+import GCRCatalogs
+from desc.simulation_tools.match_summary import summary_stats
+from desc.simulation_tools.parquet_export import write_patch_table
+from desc.simulation_tools.skymap_index import SkyMapIndex
+from desc.simulation_tools.task_accounting import TaskAccountant
+from DRP_matcher import PatchSelector, drp_galaxy_catalog, match_catalogs
+from load_catalog_tables import get_tract_ids
+
+# Butlers, truth catalogs, and skymap indexes created in the pool
+# worker processes, keyed by repo, catalog name, and filename.
+_butlers = dict()
+_truth_catalogs = dict()
+_skymap_indexes = dict()
+
+class MatchPatch:
+    """Callback function class for matching the DRP and truth catalogs
+    for a tract and patch in each band via the multiprocessing module.
+    The truth catalog is read once per patch for all of the bands.
+    """
+    def __init__(self, repo, truth_catalog, skymap_index, outdir,
+                 bands='ugrizy', mag_max=24.5, radius_mas=100., margin=1.):
+        self.repo = repo
+        self.truth_catalog = truth_catalog
+        self.skymap_index = skymap_index
+        self.outdir = outdir
+        self.bands = bands
+        self.mag_max = mag_max
+        self.radius_mas = radius_mas
+        self.margin = margin
+
+    def _resources(self):
+        if self.repo not in _butlers:
+            _butlers[self.repo] = dp.Butler(self.repo)
+        if self.truth_catalog not in _truth_catalogs:
+            with warnings.catch_warnings():
+                warnings.filterwarnings('ignore')
+                _truth_catalogs[self.truth_catalog] \
+                    = GCRCatalogs.load_catalog(self.truth_catalog)
+        if self.skymap_index not in _skymap_indexes:
+            _skymap_indexes[self.skymap_index] \
+                = SkyMapIndex.read(self.skymap_index)
+        return (_butlers[self.repo], _truth_catalogs[self.truth_catalog],
+                _skymap_indexes[self.skymap_index])
+
+    def __call__(self, tract, patch):
+        butler, gc, skymap_index = self._resources()
+        drp_catalogs = dict()
+        for band in self.bands:
+            try:
+                drp_catalogs[band] = drp_galaxy_catalog(butler, tract, patch,
+                                                        band, self.mag_max)
+            except RuntimeError:
+                # No coadd data for this patch and band.
+                pass
+        if not drp_catalogs:
+            return []
+        patch_index = tuple(int(x) for x in patch.split(','))
+        patch_selector = PatchSelector(butler, tract, patch_index,
+                                       skymap_index=skymap_index,
+                                       margin=self.margin/3600.)
+        galaxy_catalogs = patch_selector.catalogs(gc, sorted(drp_catalogs),
+                                                  self.mag_max)
+        return [self.match_band(tract, patch, band, drp_catalogs[band],
+                                galaxy_catalogs[band], skymap_index)
+                for band in sorted(drp_catalogs)]
+
+    def match_band(self, tract, patch, band, drp_catalog, galaxy_catalog,
+                   skymap_index):
+        """Match the catalogs for one band and write the outputs."""
+        matched = match_catalogs(drp_catalog, galaxy_catalog, band,
+                                 radius_mas=self.radius_mas)
+
+        # Keep only the matches with DRP positions in the inner region
+        # of this patch, so that pairs in the overlaps between patches
+        # are reported once.
+        ipt, ipatch = skymap_index.containing(np.degrees(matched['ra']),
+                                              np.degrees(matched['dec']),
+                                              inner=True)
+        keep = np.zeros(len(matched['ra']), dtype=bool)
+        keep[ipt[ipatch == skymap_index.find(tract, patch)]] = True
+        matched = {key: values[keep] for key, values in matched.items()}
+        matched['dra'] = np.degrees(matched['u']*np.cos(matched['dec'])) \
+                         *3600.*1000.
+        matched['ddec'] = np.degrees(matched['v'])*3600.*1000.
+        matched['dmag'] = matched['gc_mag'] - matched['drp_mag']
+
+        pairs = pa.Table.from_pydict(
+            {'drp_id': matched['drp_id'], 'truth_id': matched['gc_id'],
+             'ra': np.degrees(matched['ra']),
+             'dec': np.degrees(matched['dec']),
+             'sep_mas': matched['sep'], 'dra_mas': matched['dra'],
+             'ddec_mas': matched['ddec'], 'drp_mag': matched['drp_mag'],
+             'truth_mag': matched['gc_mag']})
+        write_patch_table(pairs, os.path.join(self.outdir, 'matches'),
+                          tract, patch, band=band)
+        stats = summary_stats(matched, len(drp_catalog), len(galaxy_catalog))
+        write_patch_table(pa.Table.from_pydict({key: [value] for key, value
+                                                in stats.items()}),
+                          os.path.join(self.outdir, 'summary'), tract, patch,
+                          band=band)
+        return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('repo', type=str, help='data repo')
+    parser.add_argument('outdir', type=str,
+                        help='root directory of the Parquet output')
+    parser.add_argument('skymap_index', type=str,
+                        help='skymap index file from make_skymap_index.py')
+    parser.add_argument('--truth_catalog', type=str,
+                        default='proto-dc2_v2.1.2_test',
+                        help='GCR truth catalog [proto-dc2_v2.1.2_test]')
+    parser.add_argument('--bands', type=str, default='ugrizy',
+                        help='bands to process [ugrizy]')
+    parser.add_argument('--tracts', type=int, nargs='+', default=None,
+                        help='tracts to process.  If omitted, process all '
+                        'tracts in deepCoadd-results/merged.')
+    parser.add_argument('--mag_max', type=float, default=24.5,
+                        help='magnitude limit for both catalogs [24.5]')
+    parser.add_argument('--radius', type=float, default=100.,
+                        help='match radius in milliarcseconds [100]')
+    parser.add_argument('--margin', type=float, default=1.,
+                        help='truth catalog margin around each patch in '
+                        'arcseconds [1]')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='number of parallel processes [1]')
+    args = parser.parse_args()
+
+    skymap_index = SkyMapIndex.read(args.skymap_index)
+    tract_ids = args.tracts if args.tracts is not None \
+                else get_tract_ids(args.repo)
+    patch_ids = skymap_index.patch_ids()
+
+    match_patch = MatchPatch(args.repo, args.truth_catalog, args.skymap_index,
+                             args.outdir, bands=args.bands,
+                             mag_max=args.mag_max,
+                             radius_mas=args.radius, margin=args.margin)
+    accountant = TaskAccountant()
+    with multiprocessing.Pool(processes=args.processes) as pool:
+        for tract in tract_ids:
+            for patch in patch_ids[tract]:
+                accountant.apply_async(pool, match_patch, (tract, patch),
+                                       task_id='%d_%s' % (tract, patch))
+        pool.close()
+        pool.join()
+        results = [x for patch_results in accountant.get()
+                   for x in patch_results]
+    print(len(results), "patch-bands matched,",
+          sum(x['num_matched'] for x in results), "matched pairs")
+    print(accountant.report())
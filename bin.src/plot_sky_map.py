@@ -3,65 +3,89 @@ import glob
 import sys
 import pickle
 import os
+import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib.path import Path
-import matplotlib.patches as patches
+from matplotlib.collections import PolyCollection
 import lsst.afw.geom as afwGeom
 import lsst.afw.image as afwImage
 import lsst.daf.persistence as dafPersist
+from desc.simulation_tools.skymap_index import pixel_to_sky, patch_corners
 
 plt.ion()
 
-def makePatch(vertexList, wcs):
-    """Return a path in sky coords from vertex list in pixel coords"""
-    skyPatchList = [wcs.pixelToSky(pos).getPosition(afwGeom.degrees)
-                    for pos in vertexList]
-    verts = [(coord[0], coord[1]) for coord in skyPatchList]
-    verts.append((0,0))
-    codes = [Path.MOVETO,
-             Path.LINETO,
-             Path.LINETO,
-             Path.LINETO,
-             Path.CLOSEPOLY,
-             ]
-    return Path(verts, codes)
-
-def plotSkyMap(skyMap, tract=0, title=None, ax=None):
+class ZoomLabels:
+    """
+    Text labels that are drawn only for the positions within the
+    current view and only when there are at most max_labels of a given
+    kind in view, so that full-survey sky maps stay interactive.  The
+    labels are updated when the axes limits change.
+    """
+    def __init__(self, ax, max_labels=200):
+        self.ax = ax
+        self.max_labels = max_labels
+        self.layers = dict()
+        ax.callbacks.connect('xlim_changed', self.update)
+        ax.callbacks.connect('ylim_changed', self.update)
+
+    def add(self, kind, x, y, labels, **kwds):
+        """
+        Add labels of a given kind, e.g., 'tract' or 'patch'.  The
+        keywords are passed to ax.text.
+        """
+        layer = self.layers.setdefault(kind, dict(x=[], y=[], labels=[],
+                                                  kwds=kwds, texts=[]))
+        for key, values in (('x', x), ('y', y), ('labels', labels)):
+            layer[key] = np.concatenate((layer[key], values))
+        self.update()
+
+    def update(self, ax=None):
+        xmin, xmax = sorted(self.ax.get_xlim())
+        ymin, ymax = sorted(self.ax.get_ylim())
+        for layer in self.layers.values():
+            for text in layer['texts']:
+                text.remove()
+            layer['texts'] = []
+            in_view = np.where((layer['x'] >= xmin) & (layer['x'] <= xmax)
+                               & (layer['y'] >= ymin)
+                               & (layer['y'] <= ymax))[0]
+            if len(in_view) > self.max_labels:
+                continue
+            layer['texts'] = [self.ax.text(layer['x'][i], layer['y'][i],
+                                           layer['labels'][i], ha='center',
+                                           va='center', **layer['kwds'])
+                              for i in in_view]
+
+def plotSkyMap(skyMap, tract=0, title=None, ax=None, max_labels=200):
     if title is None:
         title = 'tract {}'.format(tract)
     tractInfo = skyMap[tract]
     tractBox = afwGeom.Box2D(tractInfo.getBBox())
-    tractPosList = tractBox.getCorners()
     wcs = tractInfo.getWcs()
-    xNum, yNum = tractInfo.getNumPatches()
 
     if ax is None:
         fig = plt.figure(figsize=(12,8))
         ax = fig.add_subplot(111)
+    if not hasattr(ax, 'zoom_labels'):
+        ax.zoom_labels = ZoomLabels(ax, max_labels=max_labels)
+
+    # Tract corners and center, converted in one call.
+    corners = list(tractBox.getCorners()) + [tractBox.getCenter()]
+    tract_ra, tract_dec = pixel_to_sky(wcs, [x.getX() for x in corners],
+                                       [x.getY() for x in corners])
+
+    # Outlines of all of the patches as a single collection.
+    indexes, ra, dec = patch_corners(tractInfo, outer=True)
+    # Keep the patch polygons on the same side of RA=0 as the tract.
+    ra = tract_ra[-1] + (ra - tract_ra[-1] + 180.) % 360. - 180.
+    ax.add_collection(PolyCollection(np.dstack((ra, dec)), alpha=0.1, lw=1))
+
+    ax.zoom_labels.add('tract', tract_ra[-1:], tract_dec[-1:],
+                       ['%d' % tract], size=16, color='blue')
+    ax.zoom_labels.add('patch', ra.mean(axis=1), dec.mean(axis=1),
+                       ['%d,%d' % x for x in indexes], size=6)
 
-    tract_center = wcs.pixelToSky(tractBox.getCenter())\
-                      .getPosition(afwGeom.degrees)
-    ax.text(tract_center[0], tract_center[1], '%d' % tract, size=16,
-            ha="center", va="center", color='blue')
-    for x in range(xNum):
-        for y in range(yNum):
-            patchInfo = tractInfo.getPatchInfo([x, y])
-            patchBox = afwGeom.Box2D(patchInfo.getOuterBBox())
-            pixelPatchList = patchBox.getCorners()
-            path = makePatch(pixelPatchList, wcs)
-            patch = patches.PathPatch(path, alpha=0.1, lw=1)
-            ax.add_patch(patch)
-            center = wcs.pixelToSky(patchBox.getCenter())\
-                        .getPosition(afwGeom.degrees)
-            ax.text(center[0], center[1], '%d,%d'%(x,y), size=6,
-                    ha="center", va="center")
-
-    skyPosList = [wcs.pixelToSky(pos).getPosition(afwGeom.degrees)
-                  for pos in tractPosList]
-    ax.set_xlim(max(coord[0] for coord in skyPosList) + 1,
-                min(coord[0] for coord in skyPosList) - 1)
-    ax.set_ylim(min(coord[1] for coord in skyPosList) - 1,
-                max(coord[1] for coord in skyPosList) + 1)
+    ax.set_xlim(max(tract_ra[:-1]) + 1, min(tract_ra[:-1]) - 1)
+    ax.set_ylim(min(tract_dec[:-1]) - 1, max(tract_dec[:-1]) + 1)
     ax.grid(ls=':',color='gray')
     ax.set_xlabel("RA (deg.)")
     ax.set_ylabel("Dec (deg.)")
@@ -85,9 +109,9 @@ if __name__ == '__main__':
     repo = 'Run1.1_output'
     butler = dafPersist.Butler(repo)
     tracts = sorted([int(os.path.basename(x)) for x in glob.glob(os.path.join(repo, 'deepCoadd-results', 'merged', '*'))])
+    skyMap = butler.get('deepCoadd_skyMap')
     ax = None
     for tract in tracts:
-        skyMap = butler.get('deepCoadd_skyMap')
         ax = plotSkyMap(skyMap, tract=tract, title='', ax=ax)
     plot_protoDC2_region(ax)
     ax.set_xlim(60.5, 50)
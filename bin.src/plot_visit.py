@@ -1,47 +1,76 @@
 #!/usr/bin/env python
 import os
-import glob
 import argparse
 import numpy as np
-import sqlite3
-import astropy.io.fits as fits
 import matplotlib.pyplot as plt
 from matplotlib.colors import LogNorm
+from matplotlib.collections import PolyCollection
 
 import lsst.sims.utils
-from lsst.sims.utils import _getRotSkyPos as getRotSkyPos
 import lsst.sims.coordUtils
 from lsst.afw.cameraGeom import SCIENCE
 from lsst.sims.GalSimInterface import LSSTCameraWrapper
-from lsst.sims.catUtils.utils import ObservationMetaDataGenerator
+from desc.simulation_tools.eimage_inventory import EimageInventory
+from desc.simulation_tools.opsim_pointings import OpsimPointings
 
 plt.ion()
 
 class ChipPlotter(object):
+    """
+    Plot the footprints of the simulated sensors for a visit.  The
+    corners of all of the science sensors are computed for a pointing
+    with a single vectorized camera transform and cached by obsHistID.
+    """
+    _camera = None
+    _corner_cache = dict()
     def __init__(self, obs_md):
         self.obs_md = obs_md
-        self.camera = LSSTCameraWrapper().camera
-    def _get_corners(self, chip_name):
-        corners = lsst.sims.coordUtils.getCornerRaDec(chip_name, self.camera,
-                                                      self.obs_md)
-        ra, dec = [], []
-        for i in [0, 1, 3, 2, 0]:
-            ra.append(corners[i][0])
-            dec.append(corners[i][1])
-        return ra, dec
-    def plot_chips(self, phosim_output_dir, color='black'):
-        eimages = glob.glob(os.path.join(phosim_output_dir, 'lsst_e*'))
-        ra, dec = [], []
-        for i, eimage_file in enumerate(eimages):
-            fits_data = fits.open(eimage_file)
-            chipid = fits_data[0].header['CHIPID']
-            chipname = 'R:{},{} S:{},{}'.format(chipid[1], chipid[2],
-                                                chipid[5], chipid[6])
-            if i == 0:
-                plt.errorbar(*self._get_corners(chipname), fmt='-', color=color,
-                             label='simulated sensors')
-            else:
-                plt.errorbar(*self._get_corners(chipname), fmt='-', color=color)
+    @property
+    def camera(self):
+        if ChipPlotter._camera is None:
+            ChipPlotter._camera = LSSTCameraWrapper().camera
+        return ChipPlotter._camera
+    def chip_corners(self):
+        """
+        Return a dict of (4, 2) arrays of the (ra, dec) corners, in
+        drawing order, of the science sensors keyed by chip name.
+        """
+        obsHistID = self.obs_md.OpsimMetaData['obsHistID']
+        if obsHistID not in self._corner_cache:
+            chip_names, xpix, ypix = [], [], []
+            for det in self.camera:
+                if det.getType() != SCIENCE:
+                    continue
+                bbox = det.getBBox()
+                # Corners in drawing order around the sensor.
+                for x, y in ((bbox.getMinX(), bbox.getMinY()),
+                             (bbox.getMinX(), bbox.getMaxY()),
+                             (bbox.getMaxX(), bbox.getMaxY()),
+                             (bbox.getMaxX(), bbox.getMinY())):
+                    chip_names.append(det.getName())
+                    xpix.append(x)
+                    ypix.append(y)
+            ra, dec = lsst.sims.coordUtils.raDecFromPixelCoords(
+                np.array(xpix, dtype=float), np.array(ypix, dtype=float),
+                np.array(chip_names), camera=self.camera,
+                obs_metadata=self.obs_md)
+            corners = np.column_stack((ra, dec)).reshape(-1, 4, 2)
+            self._corner_cache[obsHistID] \
+                = dict(zip(chip_names[::4], corners))
+        return self._corner_cache[obsHistID]
+    def plot_chips(self, phosim_output_dir, inventory, color='black'):
+        eimages = inventory.query(stream_dir=os.path.abspath(phosim_output_dir))
+        corners = self.chip_corners()
+        chip_names = ['R:{},{} S:{},{}'.format(raft[1], raft[2],
+                                               sensor[1], sensor[2])
+                      for raft, sensor in zip(eimages.raft, eimages.sensor)]
+        collection = PolyCollection([corners[x] for x in chip_names],
+                                    facecolors='none', edgecolors=color,
+                                    label='simulated sensors')
+        axes = plt.gca()
+        axes.add_collection(collection)
+        axes.autoscale_view()
+        return collection
 
 
 def plot_Run1_1p_regions():
@@ -63,29 +92,22 @@ def plot_Run1_1p_regions():
     plt.axis(axis)
 
 class OpsimdbInterface(object):
-    def __init__(self, opsim_db='/global/projecta/projectdirs/lsst/groups/SSim/DC2/minion_1016_desc_dithered_v4.db'):
-        self.conn = sqlite3.connect(opsim_db)
-        self.obs_gen = ObservationMetaDataGenerator(database=opsim_db,
-                                                    driver='sqlite')
-        self._cache = dict()
+    """
+    Interface to the dithered pointings in an OpSim db, backed by an
+    OpsimPointings instance that reads the pointings in bulk and
+    persists them to an optional cache file.
+    """
+    def __init__(self, opsim_db='/global/projecta/projectdirs/lsst/groups/SSim/DC2/minion_1016_desc_dithered_v4.db',
+                 cache_file=None):
+        self.pointings = OpsimPointings(opsim_db, cache_file=cache_file)
+    def load(self, obsHistIDs=None, id_range=None):
+        """Read the pointings for a list or range of visits in bulk."""
+        nread = self.pointings.load(obsHistIDs=obsHistIDs, id_range=id_range)
+        if nread > 0 and self.pointings.cache_file is not None:
+            self.pointings.save()
+        return nread
     def get_obs_md(self, obsHistID):
-        if obsHistID not in self._cache:
-            self._cache[obsHistID] = self._get_obs_md(obsHistID)
-        return self._cache[obsHistID]
-    def _get_obs_md(self, obsHistID):
-        curs = self.conn.execute('select descDitheredRA, descDitheredDec, descDitheredRotTelPos from Summary where obsHistID={}'.format(obsHistID))
-        data = [x for x in curs][0]
-        ra, dec = [x*180./np.pi for x in data[:2]]
-        rottelpos = data[2]
-        obs_md = self.obs_gen.getObservationMetaData(obsHistID=obsHistID,
-                                                     boundType='circle',
-                                                     boundLength=0.1)[0]
-        obs_md.pointingRA = ra
-        obs_md.pointingDec = dec
-        obs_md.OpsimMetaData['rotTelPos'] = rottelpos
-        obs_md.rotSkyPos = getRotSkyPos(obs_md._pointingRA, obs_md._pointingDec,
-                                        obs_md, rottelpos)*180./np.pi
-        return obs_md
+        return self.pointings.obs_md(obsHistID)
     def plot_fov(self, obsHistID, radius=2.047):
         obs_md = self.get_obs_md(obsHistID)
         ra, dec = obs_md.pointingRA, obs_md.pointingDec
@@ -104,8 +126,9 @@ def plot_ref_cat(ref_cat, label='ref cat objects'):
     dec = [np.float(x) for x in data['decJ2000']]
     plt.errorbar(ra, dec, fmt='.', label=label, alpha=0.5)
 
-def get_obsHistID(phosim_output_dir):
-    return int(os.path.basename(glob.glob(os.path.join(phosim_output_dir, 'lsst_e_*'))[0]).split('_')[2])
+def get_obsHistID(phosim_output_dir, inventory):
+    eimages = inventory.query(stream_dir=os.path.abspath(phosim_output_dir))
+    return int(eimages.visit[0])
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Plot protoDC2 sensor sims')
@@ -116,13 +139,23 @@ if __name__ == '__main__':
                         help='root directory for DC2 phosim outputs')
     parser.add_argument('--ref_cat', type=str, default=None,
                         help='reference catalog')
+    parser.add_argument('--inventory', type=str,
+                        default='eimage_inventory.sqlite',
+                        help='eimage inventory db file')
+    parser.add_argument('--pointing_cache', type=str,
+                        default='opsim_pointings.npz',
+                        help='opsim pointing cache file')
 
     args = parser.parse_args()
 
     phosim_output_dir = os.path.join(args.phosim_root_dir, args.visit_subdir)
-    obsHistID = get_obsHistID(phosim_output_dir)
+    inventory = EimageInventory(args.inventory)
+    inventory.refresh(args.phosim_root_dir,
+                      args.visit_subdir.strip(os.path.sep).split(os.path.sep)[0])
+    obsHistID = get_obsHistID(phosim_output_dir, inventory)
 
-    opsimdb_interface = OpsimdbInterface()
+    opsimdb_interface = OpsimdbInterface(cache_file=args.pointing_cache)
+    opsimdb_interface.load([obsHistID])
     chip_plotter = ChipPlotter(opsimdb_interface.get_obs_md(obsHistID))
 
     plt.figure()
@@ -130,7 +163,7 @@ if __name__ == '__main__':
         plot_ref_cat(args.ref_cat)
     plot_Run1_1p_regions()
     opsimdb_interface.plot_fov(obsHistID)
-    chip_plotter.plot_chips(phosim_output_dir)
+    chip_plotter.plot_chips(phosim_output_dir, inventory)
     plt.legend(loc=1)
     plt.title('visit %s' % obsHistID)
     plt.savefig('visit_%s.png' % obsHistID)
@@ -1,11 +1,12 @@
 #!/usr/bin/env python
-import sys
 import time
 import pickle
+import argparse
 import subprocess
 from collections import defaultdict
 import psutil
 import numpy as np
+from desc.simulation_tools.metrics_exporter import MetricsExporter
 
 class RssHistory:
     def __init__(self):
@@ -18,27 +19,57 @@ class RssHistory:
         self.uss.append(mem_full_info.uss/1024.**3)
 
 if __name__ == '__main__':
-    try:
-        process_string = sys.argv[1]
-    except IndexError:
-        process_string = 'run_sensors'
+    parser = argparse.ArgumentParser(description="Monitor the memory usage "
+                                     "of running processes.")
+    parser.add_argument('process_string', type=str, nargs='?',
+                        default='run_sensors',
+                        help='string to match in the process command lines')
+    parser.add_argument('--metrics_file', type=str, default=None,
+                        help='file to which to publish the current '
+                        'counters in Prometheus text format')
+    parser.add_argument('--metrics_socket', type=str, default=None,
+                        help='Unix domain socket on which to serve the '
+                        'current counters')
+    args = parser.parse_args()
+    process_string = args.process_string
+
+    metrics = None
+    if args.metrics_file is not None or args.metrics_socket is not None:
+        metrics = MetricsExporter(textfile=args.metrics_file,
+                                  socket_path=args.metrics_socket)
 
     process_memories = defaultdict(RssHistory)
 
     command = 'ps auxww | grep jchiang8 | grep {} | grep -v grep | grep -v process_monitor'\
         .format(process_string)
 
-    while(True):
-        try:
-            lines = subprocess.check_output(command, shell=True).decode('utf-8')
-        except subprocess.CalledProcessError as eobj:
-            break
-        lines = lines.strip().split('\n')
-        pids = sorted([int(line.split()[1]) for line in lines])
-        for pid in pids:
-            #print(pid)
-            proc = psutil.Process(pid)
-            process_memories[pid].append(time.time(),
-                                         proc.memory_full_info())
-        time.sleep(2)
-        pickle.dump(process_memories, open('process_info.pkl', 'wb'))
+    try:
+        while(True):
+            try:
+                lines = subprocess.check_output(command, shell=True)\
+                                  .decode('utf-8')
+            except subprocess.CalledProcessError as eobj:
+                break
+            lines = lines.strip().split('\n')
+            pids = sorted([int(line.split()[1]) for line in lines])
+            samples = []
+            for pid in pids:
+                #print(pid)
+                proc = psutil.Process(pid)
+                mem_full_info = proc.memory_full_info()
+                process_memories[pid].append(time.time(), mem_full_info)
+                if metrics is not None:
+                    cpu_times = proc.cpu_times()
+                    cpu_seconds = cpu_times.user + cpu_times.system
+                    samples.append((dict(pid=pid),
+                                    dict(cpu_seconds_total=cpu_seconds,
+                                         rss_bytes=mem_full_info.rss,
+                                         uss_bytes=mem_full_info.uss)))
+            if metrics is not None:
+                metrics.update(samples)
+            time.sleep(2)
+            pickle.dump(process_memories, open('process_info.pkl', 'wb'))
+    finally:
+        # Remove the metrics socket, if any, e.g., on a KeyboardInterrupt.
+        if metrics is not None:
+            metrics.close()
@@ -4,6 +4,7 @@ import subprocess
 import multiprocessing
 import sqlite3
 import pandas as pd
+from desc.simulation_tools.task_accounting import TaskAccountant
 
 class RunProcessCcd:
     """Callback function class for running processCcd.py in a subprocess
@@ -21,15 +22,16 @@ class RunProcessCcd:
         print(full_command)
         subprocess.check_call(full_command, shell=True)
 
-def run_processCcd_pool(visits, repo, rerun, processes, logging_dir, calib):
+def run_processCcd_pool(visits, repo, rerun, processes, logging_dir, calib,
+                        task_table=None):
     os.makedirs(logging_dir, exist_ok=True)
     registry = os.path.join(repo, 'registry.sqlite3')
     with sqlite3.connect(registry) as conn:
         exp_info = pd.read_sql('select visit, filter, raftName, detectorName, '
                                'detector from raw', conn)
     run_processCcd = RunProcessCcd(repo, rerun)
+    accountant = TaskAccountant()
     with multiprocessing.Pool(processes=processes) as pool:
-        results = []
         for visit in visits:
             df = exp_info.query('visit=={}'.format(visit))
             print(visit, len(df))
@@ -48,13 +50,18 @@ def run_processCcd_pool(visits, repo, rerun, processes, logging_dir, calib):
                                            visit_dir, raftName, calexp_fn)
                 print(calexp_path)
                 if not os.path.isfile(calexp_path):
-                    results.append(pool.apply_async(run_processCcd,
-                                                    (visit, filt, raftName,
-                                                     detectorName, calib_path)))
+                    accountant.apply_async(pool, run_processCcd,
+                                           (visit, filt, raftName,
+                                            detectorName, calib_path),
+                                           task_id='{}-{}_{}'.format(
+                                               visit, filt, det_name))
         pool.close()
         pool.join()
-        for res in results:
-            res.get()
+        accountant.get()
+    print(accountant.report())
+    if task_table is not None:
+        accountant.write(task_table)
+    return accountant
 
 
 if __name__ == '__main__':
@@ -71,5 +78,7 @@ if __name__ == '__main__':
     logging_dir = config['logging_dir']
     visits = [int(_.strip()) for _ in config['visits'].split(',')]
     processes = int(config['processes'])
+    task_table = config.get('task_table', None)
     print(config)
-    run_processCcd_pool(visits, repo, rerun, processes, logging_dir, calib)
+    run_processCcd_pool(visits, repo, rerun, processes, logging_dir, calib,
+                        task_table=task_table)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+"""
+Create or incrementally refresh the sqlite inventory of simulated
+eimages in the DC2 production area.
+"""
+import argparse
+from desc.simulation_tools.eimage_inventory import EimageInventory
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('--root_dir', type=str,
+                    default='/global/projecta/projectdirs/lsst/production/DC2',
+                    help='root directory of the DC2 production')
+parser.add_argument('--dataset_pattern', type=str, default='DC2-*',
+                    help='glob pattern for the dataset directories [DC2-*]')
+parser.add_argument('--inventory', type=str,
+                    default='eimage_inventory.sqlite',
+                    help='inventory db file [eimage_inventory.sqlite]')
+parser.add_argument('--processes', type=int, default=16,
+                    help='number of threads for the directory scans [16]')
+parser.add_argument('--force', action='store_true', default=False,
+                    help='rescan all directories regardless of their mtimes')
+args = parser.parse_args()
+
+inventory = EimageInventory(args.inventory)
+ndirs, nfiles = inventory.refresh(args.root_dir, args.dataset_pattern,
+                                  processes=args.processes, force=args.force)
+print("rescanned", ndirs, "stream directories with", nfiles, "eimages")
+inventory.close()
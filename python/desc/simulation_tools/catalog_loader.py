@@ -0,0 +1,265 @@
+"""
+Bulk, resumable loading of per-patch catalog data into a database table.
+A manifest table records the load status and a checksum for each
+tract/patch, so that an interrupted load can be resumed and changed
+patches reloaded.  The SQLite backend allows the whole loading path
+to be exercised and benchmarked locally.
+"""
+import re
+import hashlib
+import sqlite3
+import pandas as pd
+
+__all__ = ['split_primary_key', 'dataframe_checksum', 'DbBackend',
+           'SqliteBackend', 'PservBackend', 'CatalogLoader']
+
+def split_primary_key(ddl):
+    """
+    Remove the primary key clause from a CREATE TABLE script, such as
+    the one written by create_sql_schema, so that the index can be
+    built after the data are loaded.
+
+    Parameters
+    ----------
+    ddl: str
+        CREATE TABLE statement.
+
+    Returns
+    -------
+    (str, list): The statement without the primary key clause and the
+        list of primary key columns.
+    """
+    match = re.search(r',\s*primary key\s*\(([^)]*)\)', ddl, re.IGNORECASE)
+    if match is None:
+        return ddl, []
+    key_columns = [x.strip() for x in match.group(1).split(',')]
+    return ddl[:match.start()] + ddl[match.end():], key_columns
+
+def dataframe_checksum(df):
+    """Return a sha1 checksum of the contents of a data frame."""
+    hashes = pd.util.hash_pandas_object(df, index=False).values
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+class DbBackend:
+    """
+    Base class for the database backends.  Subclasses provide begin,
+    commit, rollback, execute, insert_dataframe, and close.
+    """
+    _if_not_exists = ''
+
+    def create_manifest(self, manifest_table):
+        self.execute("""create table if not exists {}
+                        (tract INT, patch CHAR(2), status CHAR(10),
+                        checksum CHAR(40), nrows INT,
+                        primary key (tract, patch))""".format(manifest_table))
+
+    def get_manifest(self, manifest_table, tract, patch):
+        rows = self.execute('select status, checksum from {} where tract=? '
+                            'and patch=?'.format(manifest_table),
+                            (tract, patch))
+        return tuple(rows[0]) if rows else (None, None)
+
+    def set_manifest(self, manifest_table, tract, patch, status, checksum,
+                     nrows):
+        self.execute('replace into {} values (?, ?, ?, ?, ?)'
+                     .format(manifest_table),
+                     (tract, patch, status, checksum, nrows))
+
+    def delete_patch(self, table_name, tract, patch):
+        self.execute('delete from {} where tract=? and patch=?'
+                     .format(table_name), (tract, patch))
+
+    def create_index(self, table_name, index_name, columns, unique=False):
+        self.execute('create {}index {}{} on {} ({})'
+                     .format('unique ' if unique else '', self._if_not_exists,
+                             index_name, table_name, ', '.join(columns)))
+
+class SqliteBackend(DbBackend):
+    """
+    SQLite database backend with bulk-load friendly settings.
+    """
+    _if_not_exists = 'if not exists '
+
+    def __init__(self, db_file, cache_size=512, max_variables=999):
+        """
+        Parameters
+        ----------
+        db_file: str
+            SQLite database file.
+        cache_size: int [512]
+            Page cache size in MB.
+        max_variables: int [999]
+            Maximum number of bound parameters per statement, which
+            sets the number of rows per multi-row insert.
+        """
+        self.conn = sqlite3.connect(db_file, isolation_level=None)
+        self.max_variables = max_variables
+        for pragma in ('journal_mode=WAL', 'synchronous=OFF',
+                       'temp_store=MEMORY',
+                       'cache_size=-%d' % (1024*cache_size)):
+            self.conn.execute('PRAGMA ' + pragma)
+
+    def begin(self):
+        self.conn.execute('BEGIN')
+
+    def commit(self):
+        self.conn.execute('COMMIT')
+
+    def rollback(self):
+        self.conn.execute('ROLLBACK')
+
+    def execute(self, sql, params=()):
+        return self.conn.execute(sql, params).fetchall()
+
+    def insert_dataframe(self, table_name, df, batch_size=10000):
+        """
+        Insert the rows of a data frame with multi-row insert statements,
+        converting batch_size rows at a time to Python values.
+        """
+        ncols = len(df.columns)
+        rows_per_stmt = max(1, self.max_variables//ncols)
+        row_values = '(' + ','.join(ncols*['?']) + ')'
+        template = 'insert into {} ({}) values '.format(
+            table_name, ','.join(df.columns))
+        stmt = template + ','.join(rows_per_stmt*[row_values])
+        for imin in range(0, len(df), batch_size):
+            chunk = df.iloc[imin:imin + batch_size]
+            rows = list(zip(*[chunk[col].tolist() for col in chunk.columns]))
+            nfull = len(rows)//rows_per_stmt*rows_per_stmt
+            self.conn.executemany(
+                stmt, ([x for row in rows[i:i + rows_per_stmt] for x in row]
+                       for i in range(0, nfull, rows_per_stmt)))
+            if nfull < len(rows):
+                self.conn.executemany(template + row_values, rows[nfull:])
+
+    def close(self):
+        self.conn.close()
+
+class PservBackend(DbBackend):
+    """
+    MySQL backend using a desc.pserv.DbConnection, with the data loaded
+    via csv files and LOAD DATA.  MySQL commits each LOAD DATA
+    statement, so the manifest status is set to 'loading' beforehand
+    and any rows from an interrupted load are deleted on restart.
+    """
+    def __init__(self, conn, csv_file='catalog_loader_tmp.csv'):
+        self.conn = conn
+        self.csv_file = csv_file
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def execute(self, sql, params=()):
+        """
+        Execute a statement with '?' placeholders, binding the
+        parameters through the MySQLdb driver, which uses the 'format'
+        parameter style.  numpy scalars are converted to Python values.
+        """
+        params = tuple(x.item() if hasattr(x, 'item') else x for x in params)
+        connection = self.conn._mysql_connection
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql.replace('?', '%s'), params)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        connection.commit()
+        return rows
+
+    def insert_dataframe(self, table_name, df):
+        df.to_csv(self.csv_file, index=False)
+        self.conn.load_csv(table_name, self.csv_file)
+
+    def close(self):
+        pass
+
+class CatalogLoader:
+    """
+    Resumable loader of per-patch catalog data frames, e.g., as returned
+    by load_catalog_tables.write_csv_file.
+    """
+    def __init__(self, backend, table_name, schema_script,
+                 manifest_table=None, defer_index=True):
+        """
+        Parameters
+        ----------
+        backend: SqliteBackend or PservBackend
+            Database backend.
+        table_name: str
+            Name of the table to load.
+        schema_script: str
+            CREATE TABLE script for the table written by create_sql_schema.
+        manifest_table: str [None]
+            Name of the manifest table.  If None, '<table_name>_manifest'.
+        defer_index: bool [True]
+            If True, create the table without its primary key and build
+            a unique index on the key columns in finalize().
+        """
+        self.backend = backend
+        self.table_name = table_name
+        self.manifest_table = (manifest_table if manifest_table is not None
+                               else table_name + '_manifest')
+        with open(schema_script) as fd:
+            ddl = fd.read()
+        self.key_columns = []
+        if defer_index:
+            ddl, self.key_columns = split_primary_key(ddl)
+        backend.execute(ddl)
+        backend.create_manifest(self.manifest_table)
+
+    def is_loaded(self, tract, patch, checksum=None):
+        """
+        Return True if the patch has been loaded and, if a checksum is
+        given, its contents are unchanged.
+        """
+        status, loaded_checksum \
+            = self.backend.get_manifest(self.manifest_table, tract,
+                                        patch.replace(',', ''))
+        return (status == 'done' and
+                (checksum is None or checksum == loaded_checksum))
+
+    def load(self, df, tract, patch):
+        """
+        Load the data frame for a patch, replacing any rows from a
+        previous or interrupted load of that patch.
+
+        Returns
+        -------
+        bool: True if the data were loaded, False if the patch was
+            already loaded with the same checksum.
+        """
+        patch = patch.replace(',', '')
+        checksum = dataframe_checksum(df)
+        backend = self.backend
+        status, loaded_checksum \
+            = backend.get_manifest(self.manifest_table, tract, patch)
+        if status == 'done' and checksum == loaded_checksum:
+            return False
+        backend.begin()
+        try:
+            if status is not None:
+                # Remove rows from a previous or interrupted load.
+                backend.delete_patch(self.table_name, tract, patch)
+            backend.set_manifest(self.manifest_table, tract, patch,
+                                 'loading', checksum, len(df))
+            backend.insert_dataframe(self.table_name, df)
+            backend.set_manifest(self.manifest_table, tract, patch,
+                                 'done', checksum, len(df))
+        except Exception:
+            backend.rollback()
+            raise
+        backend.commit()
+        return True
+
+    def finalize(self):
+        """Build the deferred primary key index."""
+        if self.key_columns:
+            self.backend.create_index(self.table_name,
+                                      self.table_name + '_pkey',
+                                      self.key_columns, unique=True)
@@ -0,0 +1,155 @@
+"""
+Out-of-core image stacking.  Frames are written to memory-mapped .npy
+scratch files as they are added, and the stack statistic is computed
+in blocks of rows sized so that the working set fits within a memory
+budget, regardless of the number of frames.
+"""
+import os
+import shutil
+import tempfile
+import warnings
+import numpy as np
+
+__all__ = ['clipped_mean', 'STACK_STATISTICS', 'ChunkedStacker']
+
+def clipped_mean(data, axis=0, nsigma=3., niter=3):
+    """
+    Iterative sigma-clipped mean along an axis, ignoring NaNs.  The
+    initial center and width are the median and the interquartile range
+    scaled to a Gaussian sigma, and each iteration recomputes the mean
+    and standard deviation of the unclipped values.
+
+    Parameters
+    ----------
+    data: numpy.array
+        Data array.  NaN values are treated as masked.
+    axis: int [0]
+        Axis along which to compute the statistic.
+    nsigma: float [3.]
+        Clipping threshold in units of the standard deviation.
+    niter: int [3]
+        Number of clipping iterations.
+
+    Returns
+    -------
+    numpy.array
+    """
+    q25, center, q75 = np.nanpercentile(data, (25, 50, 75), axis=axis,
+                                        keepdims=True)
+    sigma = 0.7413*(q75 - q25)
+    for _ in range(niter):
+        values = np.where(np.abs(data - center) <= nsigma*sigma, data, np.nan)
+        center = np.nanmean(values, axis=axis, keepdims=True)
+        sigma = np.nanstd(values, axis=axis, keepdims=True)
+    return np.squeeze(center, axis=axis)
+
+STACK_STATISTICS = {'mean': lambda x: np.nanmean(x, axis=0),
+                    'median': lambda x: np.nanmedian(x, axis=0),
+                    'meanclip': clipped_mean}
+
+class ChunkedStacker:
+    """
+    Stack frames of a common shape using per-frame memory-mapped
+    scratch files.
+
+    Parameters
+    ----------
+    shape: (int, int)
+        Shape of the frames.
+    scratch_dir: str [None]
+        Directory in which to create the scratch area.  If None, then
+        the system default temporary directory is used.
+    dtype: numpy.dtype [numpy.float32]
+        Data type of the scratch files.
+    """
+    def __init__(self, shape, scratch_dir=None, dtype=np.float32):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.scratch_dir = tempfile.mkdtemp(prefix='stack_', dir=scratch_dir)
+        self.frames = []
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, pixels, mask=None):
+        """
+        Write a frame to a scratch file.
+
+        Parameters
+        ----------
+        pixels: numpy.array
+            Frame pixel values.
+        mask: numpy.array [None]
+            Boolean array that is True for the pixels to exclude.
+        """
+        if pixels.shape != self.shape:
+            raise ValueError('frame shape {} does not match stack shape {}'
+                             .format(pixels.shape, self.shape))
+        outfile = os.path.join(self.scratch_dir, 'frame_%05d.npy'
+                               % len(self.frames))
+        frame = np.lib.format.open_memmap(outfile, mode='w+', dtype=self.dtype,
+                                          shape=self.shape)
+        frame[:] = pixels
+        if mask is not None:
+            frame[mask] = np.nan
+        frame.flush()
+        del frame
+        self.frames.append(outfile)
+
+    def rows_per_block(self, memory_budget):
+        """
+        Number of rows per block such that the stacked block and the
+        temporaries of the statistic computation, estimated as four
+        times the block size in float64, fit within memory_budget bytes.
+        """
+        bytes_per_row = 4*8*len(self.frames)*self.shape[1]
+        return int(max(1, min(self.shape[0], memory_budget//bytes_per_row)))
+
+    def stack(self, statistic='meanclip', memory_budget=2*1024**3):
+        """
+        Compute the stack statistic for each pixel.
+
+        Parameters
+        ----------
+        statistic: str or callable ['meanclip']
+            'mean', 'median', 'meanclip', or a function of a
+            (nframes, nrows, ncols) array with NaNs for masked pixels
+            that reduces along axis 0.
+        memory_budget: int [2*1024**3]
+            Approximate upper bound on the memory used, in bytes.
+
+        Returns
+        -------
+        (numpy.array, numpy.array): The stacked image and the number of
+            unmasked frames for each pixel.
+        """
+        func = STACK_STATISTICS.get(statistic, statistic)
+        if not self.frames:
+            raise RuntimeError('no frames to stack')
+        frames = [np.load(x, mmap_mode='r') for x in self.frames]
+        image = np.empty(self.shape, dtype=np.float64)
+        counts = np.empty(self.shape, dtype=np.int32)
+        nrows = self.rows_per_block(memory_budget)
+        block = np.empty((len(frames), nrows, self.shape[1]), dtype=np.float64)
+        for row0 in range(0, self.shape[0], nrows):
+            row1 = min(row0 + nrows, self.shape[0])
+            data = block[:, :row1 - row0]
+            for i, frame in enumerate(frames):
+                data[i] = frame[row0:row1]
+            counts[row0:row1] = np.sum(np.isfinite(data), axis=0)
+            with warnings.catch_warnings():
+                # Pixels masked in all frames give NaN without warnings.
+                warnings.simplefilter('ignore', RuntimeWarning)
+                image[row0:row1] = func(data)
+        return image, counts
+
+    def close(self):
+        """Remove the scratch files."""
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
+        self.frames = []
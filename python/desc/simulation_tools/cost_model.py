@@ -0,0 +1,265 @@
+"""
+Per-object cost model for imSim runs, fitted from the process-info
+logs written by ProcessTracker.  Each log line has the columns
+
+    cumtime  RSS_mem  id  ADU  cputime  galsimtype
+
+where cumtime is the cumulative cpu time of the process, RSS_mem is
+the resident memory in GB, and cputime is the cpu time spent drawing
+the object.
+"""
+import os
+import gzip
+from collections import namedtuple, OrderedDict
+import numpy as np
+from scipy.optimize import nnls
+
+__all__ = ['read_process_info', 'read_instcat_objects', 'fit_zero_point',
+           'CostModel', 'CostPrediction']
+
+PROCESS_INFO_COLUMNS = 'cumtime RSS_mem id ADU cputime galsimtype'.split()
+
+# Mapping of instance catalog spatial models to GalSim object types
+# as reported by imSim.
+SPATIAL_MODEL_TYPES = {'point': 'pointSource',
+                       'sersic2d': 'sersic',
+                       'knots': 'RandomWalk'}
+
+CostPrediction = namedtuple('CostPrediction',
+                            'cpu_time wall_time peak_memory processes'.split())
+
+
+def read_process_info(file_name):
+    """
+    Read a process-info log file.
+
+    Parameters
+    ----------
+    file_name: str
+        ProcessTracker output file from an imSim run.
+
+    Returns
+    -------
+    numpy.recarray: The log contents with the PROCESS_INFO_COLUMNS names.
+    """
+    data = np.genfromtxt(file_name, names=PROCESS_INFO_COLUMNS, dtype=None,
+                         encoding='ascii')
+    return np.atleast_1d(data).view(np.recarray)
+
+
+def _instcat_lines(instcat):
+    """
+    Generate the lines of an instance catalog, following includeobj
+    directives.  Included files are resolved relative to the directory
+    of the including file and may be gzipped.
+    """
+    opener = gzip.open if instcat.endswith('.gz') else open
+    with opener(instcat, 'rt') as fd:
+        for line in fd:
+            if line.startswith('includeobj'):
+                include_file = os.path.join(os.path.dirname(instcat),
+                                            line.split()[1])
+                for included_line in _instcat_lines(include_file):
+                    yield included_line
+            else:
+                yield line
+
+def read_instcat_objects(instcat):
+    """
+    Read the object ids, magNorms, and GalSim types from the object
+    lines of an instance catalog, including those in the files listed
+    in includeobj lines, as in the DC2 instance catalogs.
+
+    Parameters
+    ----------
+    instcat: str
+        Instance catalog filename.
+
+    Returns
+    -------
+    (numpy.array, numpy.array, numpy.array): The object ids, magNorm
+        values, and GalSim object types.
+    """
+    ids, mag_norms, galsimtypes = [], [], []
+    for line in _instcat_lines(instcat):
+        if not line.startswith('object'):
+            continue
+        tokens = line.split()
+        ids.append(int(tokens[1]))
+        mag_norms.append(float(tokens[4]))
+        galsimtypes.append(SPATIAL_MODEL_TYPES.get(tokens[12], tokens[12]))
+    return np.array(ids), np.array(mag_norms), np.array(galsimtypes)
+
+
+def fit_zero_point(process_info, instcat):
+    """
+    Estimate the magNorm zero point, zp, such that
+    ADU = 10**(-0.4*(magNorm - zp)), by matching the object ids in a
+    process-info log to the instance catalog used for that run.
+
+    Parameters
+    ----------
+    process_info: numpy.recarray
+        Data returned by read_process_info.
+    instcat: str
+        Instance catalog used for the run that produced the log.
+
+    Returns
+    -------
+    float: The median zero point over the matched objects.
+    """
+    ids, mag_norms, _ = read_instcat_objects(instcat)
+    _, log_index, cat_index = np.intersect1d(process_info['id'], ids,
+                                             return_indices=True)
+    adu = process_info['ADU'][log_index]
+    good = adu > 0
+    if not np.any(good):
+        raise RuntimeError('No matching objects with positive flux in %s'
+                           % instcat)
+    return float(np.median(mag_norms[cat_index][good]
+                           + 2.5*np.log10(adu[good])))
+
+
+class CostModel:
+    """
+    Linear model of the per-object cpu time as a function of flux,
+    cputime = intercept + slope*ADU, fit separately for each GalSim
+    object type, along with the per-process memory footprint.
+    """
+    def __init__(self):
+        self.pars = OrderedDict()
+        self.totals = OrderedDict()
+        self.counts = OrderedDict()
+        self.rms = OrderedDict()
+        self.rss_peak = 0
+        self.rss_base = 0
+
+    def fit(self, process_info_list):
+        """
+        Fit the model to a list of process-info data sets.
+
+        Parameters
+        ----------
+        process_info_list: list of numpy.recarray
+            Data returned by read_process_info, one entry per log file.
+        """
+        adu = np.concatenate([x['ADU'] for x in process_info_list])
+        cputime = np.concatenate([x['cputime'] for x in process_info_list])
+        galsimtypes = np.concatenate([x['galsimtype'].astype(str)
+                                      for x in process_info_list])
+        for galsimtype in np.unique(galsimtypes):
+            index = np.where(galsimtypes == galsimtype)
+            flux, cpu = adu[index], cputime[index]
+            # Negative costs are unphysical, so constrain the parameters
+            # to be non-negative.
+            if len(flux) > 1 and np.ptp(flux) > 0:
+                # Scale the flux column so that the problem is well
+                # conditioned for the active-set solver.
+                scale = np.max(np.abs(flux))
+                A = np.vstack([np.ones(len(flux)), flux/scale]).T
+                intercept, slope = nnls(A, cpu)[0]
+                slope /= scale
+            else:
+                intercept, slope = max(np.mean(cpu), 0.), 0.
+            self.pars[galsimtype] = intercept, slope
+            self.totals[galsimtype] = float(np.sum(cpu))
+            self.counts[galsimtype] = len(cpu)
+            self.rms[galsimtype] \
+                = float(np.sqrt(np.mean((cpu - intercept - slope*flux)**2)))
+        self.rss_peak \
+            = float(max(np.max(x['RSS_mem']) for x in process_info_list))
+        self.rss_base \
+            = float(np.median([x['RSS_mem'][0] for x in process_info_list]))
+        return self
+
+    def cost_classes(self):
+        """
+        Return the GalSim types ordered by their total cpu time as a list
+        of (galsimtype, total cpu time, fraction of total cpu time) tuples.
+        """
+        total = sum(self.totals.values())
+        if total == 0:
+            # No cpu time recorded, so the fractions are undefined.
+            total = np.nan
+        return [(galsimtype, cpu, cpu/total) for galsimtype, cpu in
+                sorted(self.totals.items(), key=lambda x: -x[1])]
+
+    def object_costs(self, galsimtypes, adu):
+        """
+        Predicted cpu time (s) for each object.
+
+        Parameters
+        ----------
+        galsimtypes: numpy.array
+            GalSim object types.
+        adu: numpy.array
+            Object fluxes in ADU.
+
+        Returns
+        -------
+        numpy.array: The predicted cpu time for each object.
+        """
+        galsimtypes = np.asarray(galsimtypes).astype(str)
+        adu = np.asarray(adu, dtype=float)
+        costs = np.zeros(len(adu))
+        for galsimtype in np.unique(galsimtypes):
+            if galsimtype not in self.pars:
+                raise KeyError('No cost model for GalSim type %s' % galsimtype)
+            intercept, slope = self.pars[galsimtype]
+            index = np.where(galsimtypes == galsimtype)
+            costs[index] = intercept + slope*adu[index]
+        return costs
+
+    def suggest_processes(self, memory_budget, max_processes):
+        """
+        Largest number of processes, up to max_processes, whose combined
+        peak memory fits within memory_budget (GB).
+        """
+        return int(max(1, min(max_processes, memory_budget//self.rss_peak)))
+
+    def predict(self, galsimtypes, adu, processes=1):
+        """
+        Predict the resources needed to simulate a set of objects.
+
+        Parameters
+        ----------
+        galsimtypes: numpy.array
+            GalSim object types.
+        adu: numpy.array
+            Object fluxes in ADU.
+        processes: int [1]
+            Number of parallel processes.
+
+        Returns
+        -------
+        CostPrediction: The total cpu time (s), the wall time (s),
+            assuming the work is evenly divided among the processes,
+            and the peak memory (GB) summed over the processes.
+        """
+        cpu_time = float(np.sum(self.object_costs(galsimtypes, adu)))
+        return CostPrediction(cpu_time, cpu_time/processes,
+                              processes*self.rss_peak, processes)
+
+    def predict_instcat(self, instcat, zero_point, processes=1):
+        """
+        Predict the resources needed to simulate an instance catalog,
+        where the object fluxes are estimated from the magNorm values
+        using ADU = 10**(-0.4*(magNorm - zero_point)).
+        """
+        _, mag_norms, galsimtypes = read_instcat_objects(instcat)
+        adu = 10**(-0.4*(mag_norms - zero_point))
+        return self.predict(galsimtypes, adu, processes=processes)
+
+    def report(self):
+        """Return a text summary of the fitted model."""
+        lines = ['%-12s %9s %12s %7s %12s %12s %10s'
+                 % ('galsimtype', 'nobj', 'cpu (s)', 'frac',
+                    'intercept', 'slope', 'rms')]
+        for galsimtype, cpu, frac in self.cost_classes():
+            intercept, slope = self.pars[galsimtype]
+            lines.append('%-12s %9d %12.1f %7.3f %12.4e %12.4e %10.3e'
+                         % (galsimtype, self.counts[galsimtype], cpu, frac,
+                            intercept, slope, self.rms[galsimtype]))
+        lines.append('per-process RSS: base %.2f GB, peak %.2f GB'
+                     % (self.rss_base, self.rss_peak))
+        return '\n'.join(lines)
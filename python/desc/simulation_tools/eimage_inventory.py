@@ -0,0 +1,246 @@
+"""
+SQLite inventory of the simulated eimages in the DC2 production trees,
+i.e., files like <root>/<dataset>/output/<stream>/lsst_e_<obsHistID>_f<filter
+number>_R22_S11_E000.fits.gz.  The inventory is refreshed incrementally:
+only the stream directories whose mtimes have changed since the last
+refresh are listed again, and those listings are done in parallel with
+os.scandir.
+"""
+import os
+import re
+import fnmatch
+import sqlite3
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+__all__ = ['parse_eimage_filename', 'EimageInventory']
+
+_eimage_re = re.compile(r'lsst_e_(\d+)_f(\d)_(R\d\d)_(S\d\d)_E\d+\.fits')
+
+def parse_eimage_filename(filename):
+    """
+    Parse the visit, filter, raft, and sensor from an eimage filename.
+
+    Parameters
+    ----------
+    filename: str
+        eimage filename, e.g., 'lsst_e_219976_f2_R22_S11_E000.fits.gz'.
+
+    Returns
+    -------
+    (int, str, str, str): obsHistID, filter, raft, and sensor, or None if
+        the filename does not match the eimage naming convention.
+    """
+    match = _eimage_re.match(os.path.basename(filename))
+    if match is None:
+        return None
+    visit, filter_num, raft, sensor = match.groups()
+    return int(visit), 'ugrizy'[int(filter_num)], raft, sensor
+
+def _scan_stream_dir(args):
+    """Return the eimage rows for a stream directory."""
+    dataset, stream_dir = args
+    stream = os.path.basename(stream_dir)
+    rows = []
+    try:
+        entries = list(os.scandir(stream_dir))
+    except FileNotFoundError:
+        return stream_dir, rows
+    for entry in entries:
+        info = parse_eimage_filename(entry.name)
+        if info is None or not entry.is_file():
+            continue
+        stat = entry.stat()
+        visit, filter_, raft, sensor = info
+        rows.append((visit, dataset, stream, raft, sensor, filter_,
+                     entry.path, stat.st_size, stat.st_mtime, stream_dir))
+    return stream_dir, rows
+
+def _stat_mtime(path):
+    try:
+        return path, os.stat(path).st_mtime
+    except FileNotFoundError:
+        return path, None
+
+class EimageInventory:
+    """
+    Interface to the eimages table.  The scanned_dirs table records the
+    mtime of each output and stream directory as of the last refresh.
+    Since adding or removing a file changes the mtime of its directory,
+    unchanged directories need only be stat'ed rather than listed.
+    """
+    columns = (('visit', 'INTEGER', int),
+               ('dataset', 'TEXT', 'U64'),
+               ('stream', 'TEXT', 'U64'),
+               ('raft', 'TEXT', 'U3'),
+               ('sensor', 'TEXT', 'U3'),
+               ('filter', 'TEXT', 'U1'),
+               ('path', 'TEXT PRIMARY KEY', 'U256'),
+               ('size', 'INTEGER', np.int64),
+               ('mtime', 'REAL', float),
+               ('stream_dir', 'TEXT', 'U256'))
+    indexes = (('visit',), ('dataset', 'stream'), ('raft', 'sensor'),
+               ('stream_dir',))
+
+    def __init__(self, db_file):
+        self.conn = sqlite3.connect(db_file, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        col_defs = ', '.join('{} {}'.format(name, type_)
+                             for name, type_, _ in self.columns)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS eimages ({})'
+                          .format(col_defs))
+        self.conn.execute('CREATE TABLE IF NOT EXISTS scanned_dirs '
+                          '(path TEXT PRIMARY KEY, parent TEXT, mtime REAL)')
+        for columns in self.indexes:
+            self.conn.execute('CREATE INDEX IF NOT EXISTS eimages_{} ON '
+                              'eimages ({})'.format('_'.join(columns),
+                                                    ', '.join(columns)))
+
+    def _dir_mtimes(self, parent):
+        return dict(self.conn.execute('SELECT path, mtime FROM scanned_dirs '
+                                      'WHERE parent=?', (parent,)))
+
+    def refresh(self, root_dir, dataset_pattern='DC2-*', processes=16,
+                force=False):
+        """
+        Update the inventory for the datasets in root_dir matching
+        dataset_pattern.
+
+        Parameters
+        ----------
+        root_dir: str
+            Root directory of the production, e.g.,
+            '/global/projecta/projectdirs/lsst/production/DC2'.
+        dataset_pattern: str ['DC2-*']
+            Glob pattern for the dataset subdirectories of root_dir.
+        processes: int [16]
+            Number of threads used to stat and list directories.
+        force: bool [False]
+            Flag to list all directories regardless of their mtimes.
+
+        Returns
+        -------
+        (int, int): The number of stream directories listed and the
+            number of eimages found in them.
+        """
+        root_dir = os.path.abspath(root_dir)
+        output_dirs = [(entry.name, os.path.join(entry.path, 'output'))
+                       for entry in os.scandir(root_dir)
+                       if fnmatch.fnmatch(entry.name, dataset_pattern)
+                       and entry.is_dir()]
+        old_outputs = {path: mtime for path, mtime
+                       in self._dir_mtimes(root_dir).items()
+                       if fnmatch.fnmatch(path.split(os.path.sep)[-2],
+                                          dataset_pattern)}
+        with ThreadPool(processes=processes) as pool:
+            output_mtimes = dict(pool.map(_stat_mtime,
+                                          [x[1] for x in output_dirs]))
+            # Find the stream directories, listing only those output
+            # directories that have changed.
+            stream_dirs, old_streams = [], dict()
+            for dataset, output_dir in output_dirs:
+                if output_mtimes[output_dir] is None:
+                    continue
+                old_streams.update(self._dir_mtimes(output_dir))
+                if force or old_outputs.get(output_dir) \
+                   != output_mtimes[output_dir]:
+                    stream_dirs.extend(
+                        (dataset, entry.path)
+                        for entry in os.scandir(output_dir) if entry.is_dir())
+                else:
+                    stream_dirs.extend((dataset, path) for path in
+                                       self._dir_mtimes(output_dir))
+            stream_mtimes = dict(pool.map(_stat_mtime,
+                                          [x[1] for x in stream_dirs]))
+            changed = [x for x in stream_dirs if stream_mtimes[x[1]] is not None
+                       and (force or old_streams.get(x[1])
+                            != stream_mtimes[x[1]])]
+            scans = pool.map(_scan_stream_dir, changed)
+        removed = set(old_streams).difference(x[1] for x in stream_dirs
+                                               if stream_mtimes[x[1]]
+                                               is not None)
+        removed.update(x for x in old_outputs if output_mtimes.get(x) is None)
+
+        insert = 'INSERT INTO eimages VALUES ({})'.format(
+            ','.join(len(self.columns)*['?']))
+        nfiles = 0
+        self.conn.execute('BEGIN')
+        try:
+            for path in removed:
+                self._delete_dir(path)
+            for (dataset, stream_dir), (_, rows) in zip(changed, scans):
+                self.conn.execute('DELETE FROM eimages WHERE stream_dir=?',
+                                  (stream_dir,))
+                self.conn.executemany(insert, rows)
+                nfiles += len(rows)
+                self._set_mtime(stream_dir, os.path.dirname(stream_dir),
+                                stream_mtimes[stream_dir])
+            for _, output_dir in output_dirs:
+                if output_mtimes[output_dir] is not None:
+                    self._set_mtime(output_dir, root_dir,
+                                    output_mtimes[output_dir])
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+        return len(changed), nfiles
+
+    def _set_mtime(self, path, parent, mtime):
+        self.conn.execute('INSERT OR REPLACE INTO scanned_dirs '
+                          'VALUES (?, ?, ?)', (path, parent, mtime))
+
+    def _delete_dir(self, path):
+        for child in self._dir_mtimes(path):
+            self._delete_dir(child)
+        self.conn.execute('DELETE FROM eimages WHERE stream_dir=?', (path,))
+        self.conn.execute('DELETE FROM scanned_dirs WHERE path=?', (path,))
+
+    def query(self, pattern=None, **constraints):
+        """
+        Return the eimages matching the constraints on the table
+        columns, e.g., query(visit=219976) or query(dataset='DC2-R1-2p-WFD-r'),
+        as a numpy recarray sorted by path.
+
+        Parameters
+        ----------
+        pattern: str [None]
+            Optional glob pattern for the eimage filenames, e.g.,
+            'lsst_e*R22_S11*'.
+        """
+        names = [x[0] for x in self.columns]
+        for key in constraints:
+            if key not in names:
+                raise KeyError('unknown column: {}'.format(key))
+        conditions = ['{}=?'.format(key) for key in constraints]
+        values = list(constraints.values())
+        if pattern is not None:
+            conditions.append('path GLOB ?')
+            values.append('*/' + pattern)
+        sql = 'SELECT {} FROM eimages'.format(', '.join(names))
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        rows = self.conn.execute(sql + ' ORDER BY path', values).fetchall()
+        dtype = [(name, type_) for name, _, type_ in self.columns]
+        return np.rec.fromrecords(rows, dtype=dtype) if rows \
+            else np.recarray(0, dtype=dtype)
+
+    def visit_counts(self, dataset=None):
+        """
+        Return the number of eimages for each (dataset, stream, visit),
+        as a numpy recarray sorted by dataset and stream.
+        """
+        sql = ('SELECT dataset, stream, visit, COUNT(*) FROM eimages {} '
+               'GROUP BY dataset, stream, visit ORDER BY dataset, stream')
+        if dataset is None:
+            rows = self.conn.execute(sql.format('')).fetchall()
+        else:
+            rows = self.conn.execute(sql.format('WHERE dataset=?'),
+                                     (dataset,)).fetchall()
+        dtype = [('dataset', 'U64'), ('stream', 'U64'), ('visit', int),
+                 ('num_sensors', int)]
+        return np.rec.fromrecords(rows, dtype=dtype) if rows \
+            else np.recarray(0, dtype=dtype)
+
+    def close(self):
+        self.conn.close()
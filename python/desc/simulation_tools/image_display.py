@@ -0,0 +1,100 @@
+"""
+Array helpers for displaying sensor-sized images and mask overlays
+without full-resolution floating point temporaries: percentiles from
+strided subsamples, block downsampling to screen resolution, and a
+single uint8 RGBA composite of several mask planes.
+"""
+import numpy as np
+
+__all__ = ['subsample_percentiles', 'downsample_factor', 'block_downsample',
+           'mask_rgba']
+
+def subsample_percentiles(array, percentiles, max_samples=1000000):
+    """
+    Compute percentiles of the finite values of a 2D array from a
+    strided subsample of at most about max_samples pixels.
+
+    Parameters
+    ----------
+    array: numpy.array
+        Image array.
+    percentiles: sequence of float
+        Percentiles to compute, in the range 0 to 100.
+    max_samples: int [1000000]
+        Approximate maximum number of pixels to use.
+
+    Returns
+    -------
+    numpy.array
+    """
+    stride = max(1, int(np.ceil(np.sqrt(array.size/max_samples))))
+    values = np.asarray(array[::stride, ::stride], dtype=np.float64).ravel()
+    return np.percentile(values[np.isfinite(values)], percentiles)
+
+def downsample_factor(shape, size_pixels):
+    """
+    Block size that reduces an image of the given (ny, nx) shape to
+    fit within a display area of (width, height) screen pixels.
+    """
+    width, height = size_pixels
+    return max(1, int(np.ceil(max(shape[0]/max(height, 1.),
+                                  shape[1]/max(width, 1.)))))
+
+def _blocks(array, factor):
+    ny, nx = (x//factor for x in array.shape[:2])
+    return array[:ny*factor, :nx*factor].reshape(ny, factor, nx, factor)
+
+def block_downsample(array, factor, bitmask=False):
+    """
+    Downsample a 2D array by averaging factor x factor blocks.  The
+    rows and columns that do not fill a complete block are dropped.
+
+    Parameters
+    ----------
+    array: numpy.array
+        Image or mask array.
+    factor: int
+        Block size.
+    bitmask: bool [False]
+        If True, combine the blocks with a bitwise OR, so that the mask
+        bits set in any pixel of a block are set in the output.
+
+    Returns
+    -------
+    numpy.array
+    """
+    if factor <= 1:
+        return array
+    blocks = _blocks(array, factor)
+    if bitmask:
+        return np.bitwise_or.reduce(np.bitwise_or.reduce(blocks, axis=3),
+                                    axis=1)
+    return blocks.mean(axis=(1, 3), dtype=np.float64).astype(np.float32)
+
+def mask_rgba(mask_array, plane_colors, alpha=0.4):
+    """
+    Composite mask planes into a single uint8 RGBA image.  Where more
+    than one plane is set, the color of the later plane is used, and
+    pixels with no requested planes set are fully transparent.
+
+    Parameters
+    ----------
+    mask_array: numpy.array
+        Integer mask array.
+    plane_colors: sequence of (int, (float, float, float))
+        Bit mask and RGB color, with values in the range 0 to 1, for
+        each plane.
+    alpha: float [0.4]
+        Opacity of the mask colors.
+
+    Returns
+    -------
+    numpy.array: Array of shape mask_array.shape + (4,).
+    """
+    plane_colors = list(plane_colors)
+    lookup = np.zeros((len(plane_colors) + 1, 4), dtype=np.uint8)
+    index = np.zeros(mask_array.shape, dtype=np.uint8)
+    for i, (bitmask, color) in enumerate(plane_colors, 1):
+        lookup[i] = np.round(255*np.array(tuple(color) + (alpha,)))
+        index[(mask_array & bitmask) != 0] = i
+    return lookup[index]
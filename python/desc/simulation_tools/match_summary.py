@@ -0,0 +1,46 @@
+"""
+Summary statistics of positional matches between a measured catalog
+and a truth catalog.
+"""
+import numpy as np
+
+__all__ = ['ra_offset', 'summary_stats']
+
+def ra_offset(ra1, ra2):
+    """RA differences ra1 - ra2 (radians) wrapped to [-pi, pi)."""
+    return (np.asarray(ra1) - np.asarray(ra2) + np.pi) % (2.*np.pi) - np.pi
+
+def summary_stats(matched, num_drp, num_truth):
+    """
+    Compute the number counts and the moments of the position offsets
+    (mas) and magnitude residuals of the matched pairs.
+
+    Parameters
+    ----------
+    matched: dict
+        Arrays of the matched pairs, with keys 'sep', 'dra', 'ddec',
+        and 'dmag'.
+    num_drp: int
+        Number of objects in the measured catalog.
+    num_truth: int
+        Number of objects in the truth catalog.
+
+    Returns
+    -------
+    dict: Summary statistics.
+    """
+    stats = dict(num_drp=num_drp, num_truth=num_truth,
+                 num_matched=len(matched['sep']))
+    for name in ('dra', 'ddec', 'dmag'):
+        values = matched[name]
+        mean = np.mean(values) if len(values) > 0 else np.nan
+        std = np.std(values) if len(values) > 1 else np.nan
+        skew = np.mean(((values - mean)/std)**3) if len(values) > 2 \
+               else np.nan
+        stats.update({name + '_mean': mean, name + '_std': std,
+                      name + '_skew': skew})
+    stats['dmag_median'] = np.median(matched['dmag']) \
+                           if len(matched['dmag']) > 0 else np.nan
+    stats['sep_median'] = np.median(matched['sep']) \
+                          if len(matched['sep']) > 0 else np.nan
+    return stats
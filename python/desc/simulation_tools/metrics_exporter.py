@@ -0,0 +1,131 @@
+"""
+Publish the current counters of running jobs in the Prometheus text
+exposition format, either as a node-local textfile, which is rewritten
+atomically, or served on a Unix domain socket.
+"""
+import os
+import threading
+import socketserver
+
+__all__ = ['MetricsExporter', 'format_metrics', 'per_process_path']
+
+# Metric types for the counters published by ProcessTracker and
+# process_monitor.py, which follow the Prometheus convention of a
+# _total suffix.  Anything else is reported as a gauge.
+METRIC_TYPES = {'objects_done_total': 'counter',
+                'cpu_seconds_total': 'counter'}
+
+def per_process_path(path, pid=None):
+    """
+    Make a textfile path unique to a process, e.g., for the pool workers
+    of a job, by replacing a '{pid}' field with the process id or, if
+    there is none, inserting the process id before the file extension,
+    e.g., 'imsim.prom' -> 'imsim.1234.prom'.
+    """
+    pid = os.getpid() if pid is None else pid
+    if '{pid}' in path:
+        return path.replace('{pid}', str(pid))
+    root, ext = os.path.splitext(path)
+    return '{}.{}{}'.format(root, pid, ext)
+
+def format_metrics(samples, prefix='imsim'):
+    """
+    Format metrics in the Prometheus text format.
+
+    Parameters
+    ----------
+    samples: list of (dict, dict)
+        List of (labels, metrics) pairs, where labels is a dict of
+        label names and values, e.g., {'pid': 1234}, and metrics is a
+        dict of metric values keyed by metric name.
+    prefix: str ['imsim']
+        Prefix to prepend to the metric names.
+
+    Returns
+    -------
+    str: The formatted metrics.
+    """
+    names = []
+    for _, metrics in samples:
+        names.extend(x for x in metrics if x not in names)
+    lines = []
+    for name in names:
+        full_name = '{}_{}'.format(prefix, name)
+        lines.append('# TYPE {} {}'.format(full_name,
+                                           METRIC_TYPES.get(name, 'gauge')))
+        for labels, metrics in samples:
+            if name not in metrics or metrics[name] is None:
+                continue
+            label_str = ','.join('{}="{}"'.format(key, value)
+                                 for key, value in sorted(labels.items()))
+            if label_str:
+                label_str = '{' + label_str + '}'
+            lines.append('{}{} {}'.format(full_name, label_str,
+                                          float(metrics[name])))
+    return '\n'.join(lines) + '\n'
+
+class _MetricsHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(self.server.exporter.text.encode('utf-8'))
+
+class _MetricsServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class MetricsExporter:
+    """
+    Publish metrics to a textfile and/or a Unix domain socket.  A client
+    connecting to the socket receives the current metrics text, e.g.,
+    via `socat - UNIX-CONNECT:<socket_path>`.
+    """
+    def __init__(self, textfile=None, socket_path=None, prefix='imsim'):
+        """
+        Parameters
+        ----------
+        textfile: str [None]
+            File to rewrite with the current metrics on each update.
+            Each exporter replaces the whole file, so concurrent
+            processes need separate files.  See per_process_path.
+        socket_path: str [None]
+            Path of the Unix domain socket on which to serve the metrics.
+        prefix: str ['imsim']
+            Prefix to prepend to the metric names.
+        """
+        self.textfile = textfile
+        self.socket_path = socket_path
+        self.prefix = prefix
+        self.text = ''
+        self._server = None
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self._server = _MetricsServer(socket_path, _MetricsHandler)
+            self._server.exporter = self
+            threading.Thread(target=self._server.serve_forever,
+                             daemon=True).start()
+
+    def update(self, samples):
+        """
+        Publish a new set of metrics.
+
+        Parameters
+        ----------
+        samples: list of (dict, dict)
+            List of (labels, metrics) pairs.  See format_metrics.
+        """
+        self.text = format_metrics(samples, prefix=self.prefix)
+        if self.textfile is not None:
+            # Write to a temporary file in the same directory and
+            # rename it so that readers never see a partial file.
+            tmpfile = '{}.{}.tmp'.format(self.textfile, os.getpid())
+            with open(tmpfile, 'w') as output:
+                output.write(self.text)
+            os.replace(tmpfile, self.textfile)
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
@@ -0,0 +1,185 @@
+"""
+Bulk access to the dithered pointings in an OpSim database.  The
+Summary columns for a list or range of visits are read with a single
+query into numpy arrays, which can be persisted to a compact .npz
+cache, and ObservationMetaData objects are built from the arrays only
+when needed.
+"""
+import os
+import contextlib
+import sqlite3
+import numpy as np
+
+__all__ = ['OpsimPointings']
+
+class OpsimPointings:
+    """
+    Pointing arrays for OpSim visits, sorted by obsHistID.
+
+    Parameters
+    ----------
+    opsim_db: str [None]
+        OpSim sqlite db file.  This is only needed for visits that are
+        not in the cache file.
+    cache_file: str [None]
+        .npz cache file of pointings.  If it exists, the pointings in it
+        are loaded.
+
+    Attributes
+    ----------
+    obsHistID, ra, dec, rotTelPos, mjd, filter: numpy.array
+        Pointing data.  The angles are in radians, as in the OpSim db.
+    """
+    columns = (('obsHistID', 'obsHistID', np.int64),
+               ('ra', 'descDitheredRA', float),
+               ('dec', 'descDitheredDec', float),
+               ('rotTelPos', 'descDitheredRotTelPos', float),
+               ('mjd', 'expMJD', float),
+               ('filter', 'filter', 'U1'))
+
+    def __init__(self, opsim_db=None, cache_file=None):
+        self.opsim_db = opsim_db
+        self.cache_file = cache_file
+        self._obs_mds = dict()
+        for name, _, dtype in self.columns:
+            setattr(self, name, np.zeros(0, dtype=dtype))
+        if cache_file is not None and os.path.isfile(cache_file):
+            with np.load(cache_file) as data:
+                for name, _, _ in self.columns:
+                    setattr(self, name, data[name])
+
+    def __len__(self):
+        return len(self.obsHistID)
+
+    def __contains__(self, obsHistID):
+        return bool(self._find(obsHistID)[1][0])
+
+    def _find(self, obsHistIDs):
+        """Return the array indexes of the visits and found flags."""
+        obsHistIDs = np.atleast_1d(np.asarray(obsHistIDs, dtype=np.int64))
+        index = np.searchsorted(self.obsHistID, obsHistIDs)
+        if len(self) == 0:
+            return index, np.zeros(len(obsHistIDs), dtype=bool)
+        found = self.obsHistID[np.minimum(index, len(self) - 1)] == obsHistIDs
+        return index, found
+
+    def load(self, obsHistIDs=None, id_range=None):
+        """
+        Read the pointings for a list or an inclusive range of visits
+        from the OpSim db with a single query, skipping visits that are
+        already loaded.  If neither is given, all visits are read.
+
+        Parameters
+        ----------
+        obsHistIDs: sequence of int [None]
+            Visits to read.
+        id_range: (int, int) [None]
+            Inclusive range of visits to read.
+
+        Returns
+        -------
+        int: The number of visits read.
+
+        Raises
+        ------
+        FileNotFoundError: If the OpSim db file does not exist.
+        """
+        # sqlite3.connect would silently create an empty db file.
+        if self.opsim_db is None or not os.path.isfile(self.opsim_db):
+            raise FileNotFoundError('OpSim db file not found: {}'
+                                    .format(self.opsim_db))
+        select = 'SELECT {} FROM Summary'.format(
+            ', '.join(x[1] for x in self.columns))
+        with contextlib.closing(sqlite3.connect(self.opsim_db)) as conn:
+            if obsHistIDs is not None:
+                new_ids = np.setdiff1d(np.asarray(obsHistIDs, dtype=np.int64),
+                                       self.obsHistID)
+                if len(new_ids) == 0:
+                    return 0
+                # Join against a temporary table to avoid the limit on
+                # the number of sql variables.
+                conn.execute('CREATE TEMP TABLE visit_ids '
+                             '(obsHistID INTEGER PRIMARY KEY)')
+                conn.executemany('INSERT INTO visit_ids VALUES (?)',
+                                 [(int(x),) for x in new_ids])
+                sql = select + (' JOIN visit_ids USING (obsHistID) '
+                                'GROUP BY obsHistID')
+                rows = conn.execute(sql).fetchall()
+            elif id_range is not None:
+                sql = select + (' WHERE obsHistID BETWEEN ? AND ? '
+                                'GROUP BY obsHistID')
+                rows = conn.execute(sql, tuple(int(x) for x in id_range))\
+                           .fetchall()
+            else:
+                rows = conn.execute(select + ' GROUP BY obsHistID')\
+                           .fetchall()
+        if not rows:
+            return 0
+        new_data = list(zip(*rows))
+        keep = ~self._find(new_data[0])[1]
+        if not np.any(keep):
+            return 0
+        new_data = [np.array(values)[keep] for values in new_data]
+        order = None
+        for (name, _, dtype), values in zip(self.columns, new_data):
+            merged = np.concatenate((getattr(self, name),
+                                     np.array(values, dtype=dtype)))
+            if order is None:
+                order = np.argsort(merged, kind='stable')
+            setattr(self, name, merged[order])
+        return int(np.sum(keep))
+
+    def save(self, cache_file=None):
+        """Write the pointings to an .npz cache file."""
+        cache_file = self.cache_file if cache_file is None else cache_file
+        np.savez(cache_file, **{name: getattr(self, name)
+                                for name, _, _ in self.columns})
+
+    def index(self, obsHistIDs):
+        """
+        Return the array indexes of the visits, loading any missing
+        visits from the OpSim db.
+        """
+        obsHistIDs = np.atleast_1d(np.asarray(obsHistIDs, dtype=np.int64))
+        index, found = self._find(obsHistIDs)
+        if not np.all(found) and self.opsim_db is not None:
+            self.load(obsHistIDs[~found])
+            index, found = self._find(obsHistIDs)
+        if not np.all(found):
+            raise KeyError('visits not found: {}'.format(obsHistIDs[~found]))
+        return index
+
+    def pointing(self, obsHistID):
+        """
+        Return a dict of the pointing data for a visit, with ra, dec,
+        and rotTelPos in degrees.
+        """
+        i = self.index(obsHistID)[0]
+        return dict(obsHistID=int(self.obsHistID[i]),
+                    ra=np.degrees(self.ra[i]), dec=np.degrees(self.dec[i]),
+                    rotTelPos=np.degrees(self.rotTelPos[i]),
+                    mjd=float(self.mjd[i]), filter=str(self.filter[i]))
+
+    def obs_md(self, obsHistID, boundType='circle', boundLength=0.1):
+        """
+        Return an ObservationMetaData for the dithered pointing of a
+        visit, with rotSkyPos computed from rotTelPos.  The objects are
+        built on first use and cached.
+        """
+        if obsHistID not in self._obs_mds:
+            from lsst.sims.utils import ObservationMetaData
+            from lsst.sims.utils import _getRotSkyPos as getRotSkyPos
+            i = self.index(obsHistID)[0]
+            obs_md = ObservationMetaData(pointingRA=np.degrees(self.ra[i]),
+                                         pointingDec=np.degrees(self.dec[i]),
+                                         mjd=float(self.mjd[i]),
+                                         bandpassName=str(self.filter[i]),
+                                         boundType=boundType,
+                                         boundLength=boundLength)
+            obs_md.OpsimMetaData = dict(obsHistID=int(obsHistID),
+                                        rotTelPos=float(self.rotTelPos[i]))
+            obs_md.rotSkyPos = np.degrees(
+                getRotSkyPos(obs_md._pointingRA, obs_md._pointingDec,
+                             obs_md, self.rotTelPos[i]))
+            self._obs_mds[obsHistID] = obs_md
+        return self._obs_mds[obsHistID]
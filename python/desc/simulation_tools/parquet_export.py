@@ -0,0 +1,203 @@
+"""
+Export afw SourceCatalogs from the Data Butler to a Parquet dataset
+partitioned by tract and patch, and optionally band, and read back
+selected columns.
+"""
+import os
+import warnings
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as pa_ds
+import pyarrow.parquet as pq
+
+__all__ = ['arrow_schema', 'catalog_to_table', 'patch_slug',
+           'write_patch_table', 'write_patch_catalog', 'read_catalog']
+
+# Mapping of afw field type strings to Arrow types.  Array fields are
+# exported as fixed-size lists of the element type.
+ARROW_TYPES = {'Angle': pa.float64(),
+               'B': pa.uint8(),
+               'D': pa.float64(),
+               'F': pa.float32(),
+               'Flag': pa.bool_(),
+               'I': pa.int32(),
+               'L': pa.int64(),
+               'String': pa.string(),
+               'U': pa.uint16()}
+
+# The partition keys are matched by name, so datasets without band
+# partitions can be read with the same partitioning.
+PARTITIONING = pa_ds.partitioning(pa.schema([('band', pa.string()),
+                                             ('tract', pa.int32()),
+                                             ('patch', pa.string())]),
+                                  flavor='hive')
+
+def arrow_schema(afw_schema):
+    """
+    Map an afw table schema to an Arrow schema.
+
+    Parameters
+    ----------
+    afw_schema: lsst.afw.table.Schema
+        Schema of the catalogs to export.
+
+    Returns
+    -------
+    pyarrow.Schema: Fields of unsupported types are omitted with a
+        warning.
+    """
+    fields = []
+    for item in afw_schema:
+        name, type_string = item.field.getName(), item.field.getTypeString()
+        element_type = type_string[len('Array'):]
+        if type_string.startswith('Array') and element_type in ARROW_TYPES:
+            fields.append((name, pa.list_(ARROW_TYPES[element_type],
+                                          item.field.getSize())))
+        elif type_string in ARROW_TYPES:
+            fields.append((name, ARROW_TYPES[type_string]))
+        else:
+            warnings.warn('skipping field {} of unsupported type {}'
+                          .format(name, type_string))
+    return pa.schema(fields)
+
+def _arrow_column(catalog, field):
+    if pa.types.is_string(field.type):
+        # String columns are not available as numpy arrays.
+        return pa.array([record[field.name] for record in catalog],
+                        type=field.type)
+    values = np.asarray(catalog[field.name])
+    if pa.types.is_fixed_size_list(field.type):
+        return pa.FixedSizeListArray.from_arrays(
+            pa.array(values.ravel(), type=field.type.value_type),
+            field.type.list_size)
+    return pa.array(values, type=field.type)
+
+def catalog_to_table(catalog, schema=None):
+    """
+    Convert a SourceCatalog to an Arrow table.  C-contiguous numeric
+    columns are wrapped by Arrow without copying.  The columns of an
+    afw catalog are strided views of its records, however, and Arrow
+    buffers must be contiguous, so those columns are copied once, with
+    no intermediate numpy copy.  Flag columns are always copied since
+    Arrow stores booleans as bits.
+
+    Parameters
+    ----------
+    catalog: lsst.afw.table.SourceCatalog
+        Catalog returned by the Data Butler.
+    schema: pyarrow.Schema [None]
+        Arrow schema of the catalog.  If None, then it is derived from
+        the catalog schema.  Pass a precomputed schema to avoid
+        re-deriving it for each patch.
+
+    Returns
+    -------
+    pyarrow.Table
+    """
+    if schema is None:
+        schema = arrow_schema(catalog.getSchema())
+    if not catalog.isContiguous():
+        catalog = catalog.copy(deep=True)
+    columns = [_arrow_column(catalog, field) for field in schema]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def patch_slug(patch):
+    """
+    Partition value of a patch, e.g., "1,10" -> "1_10".  Unlike
+    removing the comma, this keeps "1,10" and "11,0" distinct.
+    """
+    return patch.replace(',', '_')
+
+def write_patch_table(table, root, tract, patch, band=None,
+                      compression='snappy'):
+    """
+    Write the table for a tract and patch to the partitioned dataset,
+    i.e., to <root>/tract=<tract>/patch=<patch>/part-0.parquet, or to
+    <root>/band=<band>/tract=<tract>/patch=<patch>/part-0.parquet if a
+    band is given, with column statistics for predicate pushdown.
+
+    Parameters
+    ----------
+    table: pyarrow.Table
+        Catalog data for the patch.
+    root: str
+        Root directory of the dataset.
+    tract: int
+        ID of tract.
+    patch: str
+        ID of patch.  This will be slugified, e.g., "0,1" -> "0_1".
+    band: str [None]
+        Band for per-band catalogs.
+    compression: str ['snappy']
+        Parquet compression codec.
+
+    Returns
+    -------
+    str: The path to the Parquet file.
+    """
+    if band is not None:
+        root = os.path.join(root, 'band=%s' % band)
+    outdir = os.path.join(root, 'tract=%d' % tract,
+                          'patch=%s' % patch_slug(patch))
+    os.makedirs(outdir, exist_ok=True)
+    outfile = os.path.join(outdir, 'part-0.parquet')
+    pq.write_table(table, outfile, compression=compression,
+                   write_statistics=True)
+    return outfile
+
+def write_patch_catalog(catalog, root, tract, patch, band=None,
+                        schema=None):
+    """
+    Convert a patch catalog to an Arrow table and write it to the
+    partitioned dataset.  See catalog_to_table and write_patch_table.
+
+    Returns
+    -------
+    str: The path to the Parquet file.
+    """
+    return write_patch_table(catalog_to_table(catalog, schema=schema),
+                             root, tract, patch, band=band)
+
+def read_catalog(root, columns=None, tracts=None, patches=None, bands=None,
+                 filter_=None):
+    """
+    Read selected columns from the partitioned dataset.  Only the
+    files for the requested tracts and patches are opened, and only
+    the requested columns are read.
+
+    Parameters
+    ----------
+    root: str
+        Root directory of the dataset.
+    columns: list of str [None]
+        Columns to read.  If None, then read all columns.
+    tracts: list of int [None]
+        Tracts to read.  If None, then read all tracts.
+    patches: list of str [None]
+        Patches to read, e.g., ['0,1', '2,2'].  If None, read all patches.
+    bands: list of str [None]
+        Bands to read from a band-partitioned dataset.  If None, read
+        all bands.
+    filter_: pyarrow.dataset.Expression [None]
+        Additional row filter, e.g., pyarrow.dataset.field('id') > 0.
+        Row groups are skipped using the column statistics.
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    dataset = pa_ds.dataset(root, format='parquet', partitioning=PARTITIONING)
+    expression = filter_
+    for name, values in (('band', bands), ('tract', tracts),
+                         ('patch', None if patches is None else
+                          [patch_slug(x) for x in patches])):
+        if values is None:
+            continue
+        selection = pa_ds.field(name).isin(values)
+        expression = (selection if expression is None
+                      else expression & selection)
+    df = dataset.to_table(columns=columns, filter=expression).to_pandas()
+    if columns is None and df['band'].isnull().all():
+        # Not a band-partitioned dataset.
+        del df['band']
+    return df
@@ -0,0 +1,213 @@
+"""
+Compare the performance of sets of imSim runs, e.g., before and after
+a software upgrade, using the process-info logs written by
+ProcessTracker.
+"""
+from collections import namedtuple
+import numpy as np
+from .cost_model import read_process_info
+
+__all__ = ['load_run', 'bootstrap_ratio', 'aggregate_by_id', 'compare_runs',
+           'text_report', 'html_report', 'Comparison']
+
+Comparison = namedtuple('Comparison',
+                        ('label group quantity nobj baseline candidate '
+                         'delta ci_low ci_high regression').split())
+
+def load_run(process_info_files):
+    """
+    Read the process-info logs for a run.
+
+    Parameters
+    ----------
+    process_info_files: list of str
+        ProcessTracker output files, typically one per sensor.
+
+    Returns
+    -------
+    (numpy.recarray, numpy.array): The concatenated log contents and
+        the peak RSS memory (GB) of each log.
+    """
+    data = [read_process_info(x) for x in process_info_files]
+    peak_rss = np.array([np.max(x['RSS_mem']) for x in data])
+    return np.concatenate(data).view(np.recarray), peak_rss
+
+def bootstrap_ratio(baseline, candidate, paired=False, nboot=1000,
+                    cl=0.95, seed=None, chunk_size=100):
+    """
+    Compute the fractional change in the mean, mean(candidate)/mean(baseline)
+    - 1, with a bootstrap confidence interval.
+
+    Parameters
+    ----------
+    baseline: numpy.array
+        Baseline values.
+    candidate: numpy.array
+        Candidate values.  If paired is True, these must be aligned
+        with the baseline values.
+    paired: bool [False]
+        If True, resample the (baseline, candidate) pairs together.
+    nboot: int [1000]
+        Number of bootstrap samples.
+    cl: float [0.95]
+        Confidence level of the interval.
+    seed: int [None]
+        Random number seed.
+    chunk_size: int [100]
+        Number of bootstrap samples to generate at a time, to bound
+        the memory used for large data sets.
+
+    Returns
+    -------
+    (float, float, float): The fractional change and the lower and
+        upper bounds of the confidence interval.
+    """
+    baseline = np.asarray(baseline, dtype=float)
+    candidate = np.asarray(candidate, dtype=float)
+    rng = np.random.RandomState(seed)
+    ratios = []
+    for nsamp in [chunk_size]*(nboot//chunk_size) + [nboot % chunk_size]:
+        if nsamp == 0:
+            continue
+        index = rng.randint(len(baseline), size=(nsamp, len(baseline)))
+        base_means = baseline[index].mean(axis=1)
+        if not paired:
+            index = rng.randint(len(candidate), size=(nsamp, len(candidate)))
+        cand_means = candidate[index].mean(axis=1)
+        ratios.append(cand_means/base_means - 1.)
+    ratios = np.concatenate(ratios)
+    alpha = 100.*(1. - cl)/2.
+    ci_low, ci_high = np.percentile(ratios, (alpha, 100. - alpha))
+    return candidate.mean()/baseline.mean() - 1., ci_low, ci_high
+
+def aggregate_by_id(data):
+    """
+    Combine the log entries of objects that were drawn more than once,
+    e.g., on several sensors, into one entry per object id with the
+    summed cpu time.
+
+    Returns
+    -------
+    numpy.recarray: Entries sorted by id.
+    """
+    ids, first, inverse = np.unique(data['id'], return_index=True,
+                                    return_inverse=True)
+    if len(ids) == len(data):
+        return data[first]
+    aggregated = data[first].copy()
+    aggregated['cputime'] = np.bincount(inverse, weights=data['cputime'])
+    return aggregated
+
+def compare_runs(baseline, candidate, label='candidate', align='id',
+                 threshold=0.05, **bootstrap_kwds):
+    """
+    Compare the per-object cpu time, by GalSim object type, and the peak
+    memory of a candidate run to a baseline run.
+
+    Parameters
+    ----------
+    baseline: (numpy.recarray, numpy.array)
+        Output of load_run for the baseline logs.
+    candidate: (numpy.recarray, numpy.array)
+        Output of load_run for the candidate logs.
+    label: str ['candidate']
+        Label for the candidate run.
+    align: str ['id']
+        If 'id', then the objects are matched by id and the cpu times
+        compared pairwise, with the cpu times of objects drawn more than
+        once summed per id and the objects grouped by their galsimtype
+        in the baseline run.  If 'galsimtype', the per-type cpu time
+        distributions are compared without matching objects.
+    threshold: float [0.05]
+        A fractional increase is flagged as a regression if the lower
+        bound of its confidence interval exceeds this value.  Quantities
+        with fewer than two values on either side, e.g., the peak RSS of
+        single-log runs, have no confidence interval and are not
+        flagged.
+    bootstrap_kwds: dict
+        Keyword arguments for bootstrap_ratio.
+
+    Returns
+    -------
+    list of Comparison tuples.
+    """
+    if align not in ('id', 'galsimtype'):
+        raise ValueError("align must be 'id' or 'galsimtype'")
+    base_data, base_rss = baseline
+    cand_data, cand_rss = candidate
+    paired = align == 'id'
+    if paired:
+        base_data = aggregate_by_id(base_data)
+        cand_data = aggregate_by_id(cand_data)
+        _, base_index, cand_index \
+            = np.intersect1d(base_data['id'], cand_data['id'],
+                             return_indices=True)
+        base_data = base_data[base_index]
+        cand_data = cand_data[cand_index]
+    base_types = base_data['galsimtype'].astype(str)
+    # Paired objects are grouped by their baseline galsimtype so that
+    # the two arrays stay aligned.
+    cand_types = base_types if paired \
+                 else cand_data['galsimtype'].astype(str)
+
+    comparisons = []
+    def add_comparison(group, quantity, base_values, cand_values, paired):
+        if len(base_values) == 0 or len(cand_values) == 0:
+            return
+        if len(base_values) < 2 or len(cand_values) < 2:
+            # A single value has no sampling distribution to bootstrap.
+            delta = cand_values.mean()/base_values.mean() - 1.
+            ci_low, ci_high = np.nan, np.nan
+        else:
+            delta, ci_low, ci_high \
+                = bootstrap_ratio(base_values, cand_values, paired=paired,
+                                  **bootstrap_kwds)
+        comparisons.append(Comparison(label, group, quantity,
+                                      len(cand_values), base_values.mean(),
+                                      cand_values.mean(), delta, ci_low,
+                                      ci_high, bool(ci_low > threshold)))
+
+    add_comparison('all', 'cputime', base_data['cputime'],
+                   cand_data['cputime'], paired)
+    for galsimtype in np.unique(np.concatenate((base_types, cand_types))):
+        add_comparison(galsimtype, 'cputime',
+                       base_data['cputime'][base_types == galsimtype],
+                       cand_data['cputime'][cand_types == galsimtype],
+                       paired)
+    add_comparison('all', 'peak_RSS', base_rss, cand_rss, False)
+    return comparisons
+
+_columns = ('label', 'group', 'quantity', 'nobj', 'baseline', 'candidate',
+            'delta (%)', 'CI (%)', 'regression')
+
+def _row(comparison):
+    return (comparison.label, comparison.group, comparison.quantity,
+            '%d' % comparison.nobj, '%.4g' % comparison.baseline,
+            '%.4g' % comparison.candidate, '%+.1f' % (100*comparison.delta),
+            'n/a' if np.isnan(comparison.ci_low) else
+            '[%+.1f, %+.1f]' % (100*comparison.ci_low,
+                                100*comparison.ci_high),
+            'YES' if comparison.regression else '')
+
+def text_report(comparisons):
+    """Format a list of Comparisons as a text table."""
+    rows = [_columns] + [_row(x) for x in comparisons]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(_columns))]
+    return '\n'.join('  '.join(item.ljust(width) for item, width
+                               in zip(row, widths)).rstrip() for row in rows)
+
+def html_report(comparisons, title='imSim performance comparison'):
+    """Format a list of Comparisons as a self-contained html page."""
+    lines = ['<html><head><title>{}</title>'.format(title),
+             '<style>td, th {padding: 2px 8px; text-align: right}'
+             ' tr.regression {background-color: #f4cccc}</style>',
+             '</head><body><h2>{}</h2><table>'.format(title),
+             '<tr>' + ''.join('<th>{}</th>'.format(x) for x in _columns)
+             + '</tr>']
+    for comparison in comparisons:
+        row_class = ' class="regression"' if comparison.regression else ''
+        lines.append('<tr{}>'.format(row_class)
+                     + ''.join('<td>{}</td>'.format(x)
+                               for x in _row(comparison)) + '</tr>')
+    lines.append('</table></body></html>')
+    return '\n'.join(lines)
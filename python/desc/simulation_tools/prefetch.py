@@ -0,0 +1,43 @@
+"""
+Bounded read-ahead for I/O-bound per-item work, e.g., reading the
+input frames for a stack while the current frame is being processed.
+"""
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+__all__ = ['prefetch_map']
+
+def prefetch_map(func, items, depth=4, threads=None):
+    """
+    Generator that applies func to each item in a thread pool, reading
+    at most depth items ahead of the consumer, and yields the results
+    in the order of the items.  At most depth + 1 results, including
+    the one being consumed, are held at once, regardless of the number
+    of items.  As for AsyncResult.get, an exception raised by func is
+    re-raised when the corresponding result is reached.
+
+    Parameters
+    ----------
+    func: callable
+        Function of a single argument.
+    items: iterable
+        Arguments for func.
+    depth: int [4]
+        Number of items to read ahead.
+    threads: int [None]
+        Number of threads.  If None, then depth threads are used.
+    """
+    depth = max(1, depth)
+    items = iter(items)
+    pending = deque()
+    with ThreadPool(processes=depth if threads is None else threads) as pool:
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) == depth:
+                break
+        while pending:
+            result = pending.popleft().get()
+            for item in items:
+                pending.append(pool.apply_async(func, (item,)))
+                break
+            yield result
@@ -1,19 +1,180 @@
 import os
 import sys
+import time
+import threading
+from collections import defaultdict
 import psutil
+from .metrics_exporter import MetricsExporter, per_process_path
+
+class StackSampler:
+    """
+    Statistical profiler that periodically samples the Python stacks of
+    all threads in a background thread and accumulates them as folded
+    stacks, i.e., "frame0;frame1;...;frameN count" lines, which can be
+    given directly to flamegraph.pl or speedscope.
+    """
+    overflow_key = '[other]'
+    def __init__(self, rate=100., max_stacks=10000, max_depth=128):
+        """
+        Parameters
+        ----------
+        rate: float [100.]
+            Sampling rate in Hz.
+        max_stacks: int [10000]
+            Maximum number of distinct folded stacks to keep.  Samples
+            with new stacks beyond this number are counted in the
+            overflow_key entry, so that memory use is bounded.
+        max_depth: int [128]
+            Maximum number of frames to record per stack.  The
+            outermost frames are kept.
+        """
+        self.interval = 1./rate
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.counts = defaultdict(int)
+        self.nsamples = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='StackSampler')
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        return '{} ({}:{})'.format(code.co_name,
+                                   os.path.basename(code.co_filename),
+                                   code.co_firstlineno)
+
+    def sample(self):
+        """Record the current stacks of all threads except this one."""
+        thread_names = {x.ident: x.name for x in threading.enumerate()}
+        my_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == my_id:
+                continue
+            names = []
+            while frame is not None:
+                names.append(self._frame_name(frame))
+                frame = frame.f_back
+            names.append(thread_names.get(thread_id, str(thread_id)))
+            key = ';'.join(reversed(names[-self.max_depth:]))
+            if key not in self.counts and len(self.counts) >= self.max_stacks:
+                key = self.overflow_key
+            self.counts[key] += 1
+        self.nsamples += 1
+
+    def write(self, outfile):
+        """Write the folded stacks, most frequent first."""
+        with open(outfile, 'w') as output:
+            for key, count in sorted(self.counts.items(),
+                                     key=lambda x: -x[1]):
+                output.write('{} {}\n'.format(key, count))
 
 class ProcessTracker:
-    def __init__(self, output=None, pid=None, mode='w'):
+    def __init__(self, output=None, pid=None, mode='w', profile_rate=None,
+                 profile_file=None, metrics_file=None, metrics_socket=None,
+                 num_objects=None, metrics_interval=5.):
+        """
+        Parameters
+        ----------
+        output: str or file object [None]
+            Destination of the process info.  If None, then the
+            PROCESS_INFO_FILE environment variable is used, if set,
+            otherwise sys.stdout.
+        pid: int [None]
+            Process id to track.  If None, then the current process.
+        mode: str ['w']
+            Mode for opening the output file.
+        profile_rate: float [None]
+            If not None, sample the Python stacks of this process at
+            this rate (Hz) with a StackSampler.  If None, then the
+            PROCESS_PROFILE_RATE environment variable is used, if set.
+            The sampler can only see the stacks of the current
+            process, so a ValueError is raised if profiling is
+            requested for another pid.
+        profile_file: str [None]
+            Output file for the folded stacks.  If None, then
+            '<output>.folded' or, if output is not a filename,
+            'process_stacks_<pid>.folded'.
+        metrics_file: str [None]
+            If not None, publish the current counters in Prometheus
+            text format to this file.  If None, then the
+            PROCESS_METRICS_FILE environment variable is used, if set.
+            The path is made unique to the writing process with
+            per_process_path, so that pool workers sharing the setting
+            don't overwrite each other's files.
+        metrics_socket: str [None]
+            If not None, serve the current counters on this Unix
+            domain socket.
+        num_objects: int [None]
+            Total number of objects to be processed, used to compute
+            the ETA metric.
+        metrics_interval: float [5.]
+            Minimum time (s) between metrics updates.
+        """
         if output is None:
             output = os.environ.get('PROCESS_INFO_FILE', sys.stdout)
         if pid is None:
             pid = os.getpid()
+        if profile_rate is None and 'PROCESS_PROFILE_RATE' in os.environ:
+            profile_rate = float(os.environ['PROCESS_PROFILE_RATE'])
+        if profile_rate is not None and pid != os.getpid():
+            raise ValueError('stack profiling is only available for the '
+                             'current process, not pid {}'.format(pid))
         self.process = psutil.Process(pid)
         self.output = open(output, mode) if isinstance(output, str) else output
+        self.sampler = None
+        if profile_rate is not None:
+            if profile_file is None:
+                profile_file = (output + '.folded' if isinstance(output, str)
+                                else 'process_stacks_{}.folded'.format(pid))
+            self.profile_file = profile_file
+            self.sampler = StackSampler(rate=profile_rate)
+            self.sampler.start()
+        if metrics_file is None:
+            metrics_file = os.environ.get('PROCESS_METRICS_FILE', None)
+        self.metrics = None
+        if metrics_file is not None or metrics_socket is not None:
+            if metrics_file is not None:
+                metrics_file = per_process_path(metrics_file)
+            self.metrics = MetricsExporter(textfile=metrics_file,
+                                           socket_path=metrics_socket)
+        self.num_objects = num_objects
+        self.metrics_interval = metrics_interval
+        self.objects_done = 0
+        self._wall_start = time.time()
+        self._last_update = None
 
     def __del__(self):
-        if self.output != sys.stdout:
-            self.output.close()
+        # __init__ may have raised before all of the attributes were set.
+        self.stop_profiler()
+        if getattr(self, 'metrics', None) is not None:
+            self.update_metrics(force=True)
+            self.metrics.close()
+        output = getattr(self, 'output', sys.stdout)
+        if output != sys.stdout:
+            output.close()
+
+    def stop_profiler(self):
+        """Stop the stack sampler, if running, and write its output."""
+        if getattr(self, 'sampler', None) is not None:
+            self.sampler.stop()
+            self.sampler.write(self.profile_file)
+            self.sampler = None
 
     def start_timer(self):
         self.tstart = self.process.cpu_times().user
@@ -27,3 +188,28 @@ class ProcessTracker:
         template = '  '.join(['{}', '{}'] + len(args)*['{}']) + '\n'
         self.output.write(template.format(cputime, rss_mem, *args))
         self.output.flush()
+        self.objects_done += 1
+        if self.metrics is not None:
+            self.update_metrics()
+
+    def update_metrics(self, force=False):
+        """
+        Publish the objects done, cpu time, RSS memory, throughput,
+        and ETA, at most once per metrics_interval unless force is True.
+        """
+        now = time.time()
+        if (not force and self._last_update is not None
+                and now - self._last_update < self.metrics_interval):
+            return
+        self._last_update = now
+        cpu_times = self.process.cpu_times()
+        throughput = self.objects_done/max(now - self._wall_start, 1e-6)
+        eta = None
+        if self.num_objects is not None and throughput > 0:
+            eta = max(self.num_objects - self.objects_done, 0)/throughput
+        metrics = dict(objects_done_total=self.objects_done,
+                       cpu_seconds_total=cpu_times.user + cpu_times.system,
+                       rss_bytes=self.process.memory_info().rss,
+                       throughput=throughput,
+                       eta_seconds=eta)
+        self.metrics.update([(dict(pid=self.process.pid), metrics)])
@@ -0,0 +1,67 @@
+"""
+Survey the sky levels of simulated eimages using robust statistics on
+strided pixel subsamples.
+"""
+import os
+import numpy as np
+import astropy.io.fits as fits
+
+__all__ = ['robust_sky_level', 'sky_level', 'SensorSkyLevel']
+
+def robust_sky_level(pixels):
+    """
+    Compute a robust sky level estimate from a set of pixel values.
+
+    Parameters
+    ----------
+    pixels: numpy.array
+        Pixel values.
+
+    Returns
+    -------
+    (float, float): The median and its standard error, estimated from
+        the median absolute deviation as 1.2533*sigma/sqrt(n), with
+        sigma = 1.4826*MAD.
+    """
+    pixels = np.asarray(pixels).ravel()
+    median = np.median(pixels)
+    sigma = 1.4826*np.median(np.abs(pixels - median))
+    return float(median), float(1.2533*sigma/np.sqrt(len(pixels)))
+
+def sky_level(eimage_file, stride=8):
+    """
+    Estimate the sky level of an eimage from every stride-th pixel in
+    each direction.  The subsampling reduces the cost of the median
+    computations, but the whole image is still read and, for the
+    gzipped eimage files, decompressed.
+
+    Parameters
+    ----------
+    eimage_file: str
+        eimage filename.
+    stride: int [8]
+        Sampling stride along each image axis.
+
+    Returns
+    -------
+    (astropy.io.fits.Header, float, float): The primary header, the
+        sky level, and its standard error.
+    """
+    with fits.open(eimage_file) as hdus:
+        header = hdus[0].header
+        pixels = np.array(hdus[0].data[::stride, ::stride])
+    return (header,) + robust_sky_level(pixels)
+
+class SensorSkyLevel:
+    """
+    Callback function class returning the sky-level record of an eimage
+    for use with a multiprocessing work queue.
+    """
+    def __init__(self, stride=8):
+        self.stride = stride
+
+    def __call__(self, eimage_file):
+        header, counts, error = sky_level(eimage_file, stride=self.stride)
+        raft, sensor = header['CHIPID'].split('_')
+        return (header['FILTER'], header['OBSID'], raft, sensor, counts,
+                os.path.basename(header['BRANCH']), error)
@@ -0,0 +1,193 @@
+"""
+SQLite database of per sensor-visit sky levels and their errors, as
+written by scripts/count_sensors.py, with a streaming, idempotent
+ingester and a small query interface.
+"""
+import hashlib
+import sqlite3
+import numpy as np
+
+__all__ = ['SensorVisitDb']
+
+class SensorVisitDb:
+    """
+    Interface to the sensor_visit_info table.  Each ingested file is
+    recorded in the ingested_files table with a sha1 checksum, so
+    re-ingesting unchanged files is a no-op and changed files replace
+    their previous rows.  Rows from tables created by earlier versions
+    have no source_file, so they are replaced by any ingested rows
+    for the same visit, raft, and sensor.
+    """
+    key_columns = ('visit', 'raft', 'sensor')
+    table_name = 'sensor_visit_info'
+    columns = (('filter', 'TEXT', str),
+               ('visit', 'INTEGER', int),
+               ('raft', 'TEXT', str),
+               ('sensor', 'TEXT', str),
+               ('sky_level', 'REAL', float),
+               ('phosim_version', 'TEXT', str),
+               ('sky_level_error', 'REAL', float))
+    indexes = (('visit',), ('raft', 'sensor'), ('filter', 'visit'),
+               ('source_file',))
+
+    def __init__(self, db_file):
+        self.conn = sqlite3.connect(db_file, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        col_defs = ', '.join('{} {}'.format(name, type_)
+                             for name, type_, _ in self.columns)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS {} ({}, source_file TEXT)'
+                          .format(self.table_name, col_defs))
+        self._add_missing_columns()
+        self.conn.execute('CREATE TABLE IF NOT EXISTS ingested_files '
+                          '(path TEXT PRIMARY KEY, sha1 TEXT, nrows INTEGER)')
+        self._legacy_rows = self.conn.execute(
+            'SELECT 1 FROM {} WHERE source_file IS NULL LIMIT 1'
+            .format(self.table_name)).fetchone() is not None
+        if self._legacy_rows:
+            # The visit index is needed to find the legacy rows.
+            self.create_indexes()
+
+    def _add_missing_columns(self):
+        """
+        Migrate tables created by earlier versions, e.g., the 6-column
+        sensor_visit_info tables without sky_level_error and
+        source_file, by adding the missing columns.
+        """
+        existing = {row[1] for row in self.conn.execute(
+            'PRAGMA table_info({})'.format(self.table_name))}
+        for name, type_ in [x[:2] for x in self.columns] \
+                           + [('source_file', 'TEXT')]:
+            if name not in existing:
+                self.conn.execute('ALTER TABLE {} ADD COLUMN {} {}'
+                                  .format(self.table_name, name, type_))
+
+    @staticmethod
+    def file_checksum(path, block_size=2**20):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as fd:
+            for block in iter(lambda: fd.read(block_size), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    def _rows(self, path):
+        converters = [x[2] for x in self.columns]
+        with open(path) as fd:
+            for line in fd:
+                tokens = line.split()
+                if not tokens or tokens[0].startswith('#'):
+                    continue
+                # Files without the trailing sky_level_error column
+                # get NULL values for it.
+                values = [func(x) for func, x in zip(converters, tokens)]
+                values.extend((len(converters) - len(values))*[None])
+                yield tuple(values) + (path,)
+
+    def ingest_file(self, path, batch_size=10000):
+        """
+        Ingest a sky-level file, streaming its rows in batches within a
+        single transaction.
+
+        Returns
+        -------
+        int: The number of rows ingested, or 0 if the file was unchanged.
+        """
+        sha1 = self.file_checksum(path)
+        row = self.conn.execute('SELECT sha1 FROM ingested_files WHERE path=?',
+                                (path,)).fetchone()
+        if row is not None and row[0] == sha1:
+            return 0
+        names = [x[0] for x in self.columns] + ['source_file']
+        insert = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            self.table_name, ', '.join(names), ','.join(len(names)*['?']))
+        nrows = 0
+        delete_legacy = 'DELETE FROM {} WHERE source_file IS NULL AND {}'\
+            .format(self.table_name,
+                    ' AND '.join('{}=?'.format(x) for x in self.key_columns))
+        key_indexes = [names.index(x) for x in self.key_columns]
+        self.conn.execute('BEGIN')
+        try:
+            if row is not None:
+                self.conn.execute('DELETE FROM {} WHERE source_file=?'
+                                  .format(self.table_name), (path,))
+            batch = []
+            for values in self._rows(path):
+                batch.append(values)
+                if len(batch) == batch_size:
+                    nrows += self._insert(insert, delete_legacy,
+                                          key_indexes, batch)
+                    batch = []
+            nrows += self._insert(insert, delete_legacy, key_indexes, batch)
+            self.conn.execute('INSERT OR REPLACE INTO ingested_files '
+                              'VALUES (?, ?, ?)', (path, sha1, nrows))
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+        return nrows
+
+    def _insert(self, insert, delete_legacy, key_indexes, batch):
+        """Insert a batch of rows, replacing any matching legacy rows."""
+        if self._legacy_rows:
+            self.conn.executemany(delete_legacy,
+                                  [tuple(values[i] for i in key_indexes)
+                                   for values in batch])
+        self.conn.executemany(insert, batch)
+        return len(batch)
+
+    def ingest(self, paths, batch_size=10000):
+        """
+        Ingest a list of files and then build the query indexes.
+
+        Returns
+        -------
+        int: The total number of rows ingested.
+        """
+        nrows = sum(self.ingest_file(path, batch_size=batch_size)
+                    for path in paths)
+        self.create_indexes()
+        return nrows
+
+    def create_indexes(self):
+        for columns in self.indexes:
+            self.conn.execute('CREATE INDEX IF NOT EXISTS {}_{} ON {} ({})'
+                              .format(self.table_name, '_'.join(columns),
+                                      self.table_name, ', '.join(columns)))
+        self.conn.execute('ANALYZE')
+
+    def query(self, **constraints):
+        """
+        Return the rows matching the constraints on the table columns,
+        e.g., query(visit=219976) or query(raft='R22', sensor='S11'),
+        as a numpy recarray.
+        """
+        names = [x[0] for x in self.columns]
+        sql = 'SELECT {} FROM {}'.format(', '.join(names), self.table_name)
+        for key in constraints:
+            if key not in names:
+                raise KeyError('unknown column: {}'.format(key))
+        if constraints:
+            sql += ' WHERE ' + ' AND '.join('{}=?'.format(key)
+                                            for key in constraints)
+        rows = self.conn.execute(sql, tuple(constraints.values())).fetchall()
+        dtype = [('filter', 'U1'), ('visit', int), ('raft', 'U3'),
+                 ('sensor', 'U3'), ('sky_level', float),
+                 ('phosim_version', 'U32'), ('sky_level_error', float)]
+        return np.rec.fromrecords(rows, dtype=dtype) if rows \
+            else np.recarray(0, dtype=dtype)
+
+    def sky_levels_by_visit(self, visit):
+        """Return a dict of sky levels keyed by (raft, sensor) for a visit."""
+        return {(row.raft, row.sensor): row.sky_level
+                for row in self.query(visit=visit)}
+
+    def sky_levels_by_sensor(self, raft, sensor, filter_=None):
+        """Return a dict of sky levels keyed by visit for a sensor."""
+        constraints = dict(raft=raft, sensor=sensor)
+        if filter_ is not None:
+            constraints['filter'] = filter_
+        return {row.visit: row.sky_level
+                for row in self.query(**constraints)}
+
+    def close(self):
+        self.conn.close()
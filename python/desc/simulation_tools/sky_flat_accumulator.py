@@ -0,0 +1,263 @@
+"""
+Persistent, incremental accumulation of sky-flat frames.  For each
+pixel, the state holds the sum, sum of squares, and number of unmasked
+values of r = pixel/(frame median), along with a histogram of r and
+the numbers of values below and above the histogram range.  Mean and
+variance are exact, and medians and clipped means are estimated from
+the histograms, so frames can be folded in as new visits are
+simulated and a flat can be emitted at any time without re-reading the
+old frames.  The frames included are recorded so that a frame can be
+removed again.
+"""
+import os
+import json
+import numpy as np
+from .chunked_stacker import clipped_mean
+
+__all__ = ['SkyFlatAccumulator']
+
+class SkyFlatAccumulator:
+    """
+    Accumulator state stored in a directory as memory-mapped .npy files
+    plus a provenance.json file with the frame medians and metadata.
+
+    Parameters
+    ----------
+    state_dir: str
+        Directory of the accumulator state.  If it does not contain a
+        state, then a new one is created, and shape must be given.
+    shape: (int, int) [None]
+        Shape of the frames for a new state.
+    nbins: int [64]
+        Number of histogram bins for a new state.
+    r_range: (float, float) [(0.5, 1.5)]
+        Range of r covered by the histogram bins for a new state.
+        Values outside the range are not binned but are counted in the
+        below and above arrays.  For pixels with most of their values
+        out of range, the median and clipped mean fall back to the
+        mean.
+    rows_per_block: int [256]
+        Number of rows to process at a time, which bounds the size of
+        the temporary arrays.
+    """
+    arrays = (('sums', np.float64), ('sumsq', np.float64),
+              ('counts', np.int32), ('below', np.int32), ('above', np.int32))
+
+    def __init__(self, state_dir, shape=None, nbins=64, r_range=(0.5, 1.5),
+                 rows_per_block=256):
+        self.state_dir = state_dir
+        self.rows_per_block = rows_per_block
+        provenance_file = os.path.join(state_dir, 'provenance.json')
+        if os.path.isfile(provenance_file):
+            with open(provenance_file) as fd:
+                self.provenance = json.load(fd)
+            mode = 'r+'
+        else:
+            if shape is None:
+                raise ValueError('shape is needed to create a new '
+                                 'accumulator state')
+            os.makedirs(state_dir, exist_ok=True)
+            self.provenance = dict(shape=list(shape), nbins=nbins,
+                                   r_range=list(r_range), frames=dict())
+            mode = 'w+'
+        shape = tuple(self.provenance['shape'])
+        for name, dtype in self.arrays:
+            # States written before the out-of-range counts were added
+            # lack those arrays, so create them as needed.
+            array_mode = mode if os.path.isfile(self._path(name)) else 'w+'
+            setattr(self, name, np.lib.format.open_memmap(
+                self._path(name), mode=array_mode, dtype=dtype, shape=shape))
+        self.hist = np.lib.format.open_memmap(
+            self._path('hist'), mode=mode, dtype=np.uint16,
+            shape=(self.provenance['nbins'],) + shape)
+        if mode == 'w+':
+            self.save()
+
+    def _path(self, name):
+        return os.path.join(self.state_dir, name + '.npy')
+
+    @property
+    def shape(self):
+        return tuple(self.provenance['shape'])
+
+    @property
+    def frame_ids(self):
+        return sorted(self.provenance['frames'])
+
+    def bin_edges(self):
+        return np.linspace(*self.provenance['r_range'],
+                           self.provenance['nbins'] + 1)
+
+    def __contains__(self, frame_id):
+        return frame_id in self.provenance['frames']
+
+    def _update(self, pixels, median, mask, sign):
+        if pixels.shape != self.shape:
+            raise ValueError('frame shape {} does not match state shape {}'
+                             .format(pixels.shape, self.shape))
+        r_min, r_max = self.provenance['r_range']
+        nbins = self.provenance['nbins']
+        for row0 in range(0, self.shape[0], self.rows_per_block):
+            rows = slice(row0, row0 + self.rows_per_block)
+            r = np.asarray(pixels[rows], dtype=np.float64)/median
+            good = np.isfinite(r)
+            if mask is not None:
+                good &= ~np.asarray(mask[rows], dtype=bool)
+            r = np.where(good, r, 0)
+            self.sums[rows] += sign*r
+            self.sumsq[rows] += sign*r**2
+            self.counts[rows] += sign*good
+            ibin = np.floor((r - r_min)/(r_max - r_min)*nbins).astype(int)
+            self.below[rows] += sign*(good & (ibin < 0))
+            self.above[rows] += sign*(good & (ibin >= nbins))
+            # Each pixel gets at most one histogram entry per frame, so
+            # the fancy-indexed update has no repeated indexes.
+            iy, ix = np.where(good & (ibin >= 0) & (ibin < nbins))
+            hist = self.hist[:, rows]
+            if sign > 0:
+                hist[ibin[iy, ix], iy, ix] += 1
+            else:
+                hist[ibin[iy, ix], iy, ix] -= 1
+
+    def add_frame(self, frame_id, pixels, median, mask=None, **metadata):
+        """
+        Fold a frame into the state.
+
+        Parameters
+        ----------
+        frame_id: str
+            Unique identifier of the frame, e.g., the visit number.
+        pixels: numpy.array
+            Frame pixel values.
+        median: float
+            Median sky level of the frame.
+        mask: numpy.array [None]
+            Boolean array that is True for the pixels to exclude.
+        metadata: dict
+            Additional provenance information, e.g., the input filename.
+        """
+        if frame_id in self:
+            raise KeyError('frame {} is already included'.format(frame_id))
+        self._update(pixels, median, mask, 1)
+        self.provenance['frames'][frame_id] = dict(median=float(median),
+                                                   **metadata)
+
+    def remove_frame(self, frame_id, pixels, mask=None):
+        """
+        Remove a previously added frame.  The same pixel values and mask
+        that were added must be provided.
+        """
+        if frame_id not in self:
+            raise KeyError('frame {} is not included'.format(frame_id))
+        median = self.provenance['frames'][frame_id]['median']
+        self._update(pixels, median, mask, -1)
+        del self.provenance['frames'][frame_id]
+
+    def save(self):
+        """Flush the arrays and write the provenance."""
+        for name in [x[0] for x in self.arrays] + ['hist']:
+            getattr(self, name).flush()
+        outfile = os.path.join(self.state_dir, 'provenance.json')
+        with open(outfile + '.tmp', 'w') as output:
+            json.dump(self.provenance, output, indent=2)
+        os.replace(outfile + '.tmp', outfile)
+
+    def _hist_quantile(self, hist, cumulative, q, total):
+        """
+        Quantile of r for each pixel, interpolated within bins.  The
+        cumulative counts start from the number of values below the
+        histogram range, and quantiles that fall outside the range are
+        clipped to it.
+        """
+        edges = self.bin_edges()
+        target = q*total
+        ibin = np.minimum(np.sum(cumulative < target, axis=0),
+                          len(edges) - 2)
+        below_bin = np.take_along_axis(cumulative, ibin[None], axis=0)[0] \
+                    - np.take_along_axis(hist, ibin[None], axis=0)[0]
+        in_bin = np.take_along_axis(hist, ibin[None], axis=0)[0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.clip((target - below_bin)/in_bin, 0, 1)
+        return edges[ibin] + frac*(edges[1] - edges[0])
+
+    def _block_stat(self, rows, statistic, nsigma, niter):
+        counts = np.asarray(self.counts[rows])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.sums[rows]/counts
+        if statistic == 'mean':
+            return mean
+        hist = np.asarray(self.hist[:, rows], dtype=np.float64)
+        below = np.asarray(self.below[rows], dtype=np.float64)
+        cumulative = below + np.cumsum(hist, axis=0)
+        # Pixels with at most half of their values in the histogram
+        # range use the exact mean.
+        use_mean = (below + self.above[rows] >= counts/2.) | (counts == 0)
+        def quantile(q):
+            return self._hist_quantile(hist, cumulative, q, counts)
+        median = quantile(0.5)
+        if statistic == 'median':
+            return np.where(use_mean, mean, median)
+        # Clipped mean: start from the median and the IQR-based sigma
+        # and iterate using the histogram bin centers.
+        edges = self.bin_edges()
+        centers = ((edges[1:] + edges[:-1])/2.)[:, None, None]
+        center = median
+        sigma = 0.7413*(quantile(0.75) - quantile(0.25))
+        sigma = np.maximum(sigma, (edges[1] - edges[0])/2.)
+        for _ in range(niter):
+            weights = hist*(np.abs(centers - center) <= nsigma*sigma)
+            norm = np.sum(weights, axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                center = np.sum(weights*centers, axis=0)/norm
+                sigma = np.sqrt(np.sum(weights*(centers - center)**2, axis=0)
+                                /norm)
+            sigma = np.maximum(sigma, (edges[1] - edges[0])/2.)
+        return np.where(use_mean, mean, center)
+
+    def sky_level(self, statistic='meanclip'):
+        """Apply the statistic to the frame medians."""
+        medians = np.array([x['median'] for x in
+                            self.provenance['frames'].values()])
+        if statistic == 'mean':
+            return np.mean(medians)
+        if statistic == 'median':
+            return np.median(medians)
+        return float(clipped_mean(medians))
+
+    def flat(self, statistic='meanclip', nsigma=3., niter=3):
+        """
+        Emit a sky flat from the current state.
+
+        Parameters
+        ----------
+        statistic: str ['meanclip']
+            'mean', 'median', or 'meanclip'.
+        nsigma: float [3.]
+            Clipping threshold for 'meanclip'.
+        niter: int [3]
+            Number of clipping iterations for 'meanclip'.
+
+        Returns
+        -------
+        (numpy.array, numpy.array): The sky flat, i.e., the sky level
+            times the statistic of r for each pixel, and the number of
+            unmasked frames for each pixel.
+        """
+        if not self.provenance['frames']:
+            raise RuntimeError('no frames in the accumulator state')
+        flat = np.empty(self.shape, dtype=np.float64)
+        for row0 in range(0, self.shape[0], self.rows_per_block):
+            rows = slice(row0, row0 + self.rows_per_block)
+            flat[rows] = self._block_stat(rows, statistic, nsigma, niter)
+        return self.sky_level(statistic)*flat, np.array(self.counts)
+
+    def out_of_range(self):
+        """Per-pixel number of values outside the histogram range."""
+        return np.asarray(self.below) + np.asarray(self.above)
+
+    def variance(self):
+        """Per-pixel variance of r."""
+        counts = np.asarray(self.counts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.sums/counts
+            return self.sumsq/counts - mean**2
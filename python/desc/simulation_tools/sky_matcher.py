@@ -0,0 +1,200 @@
+"""
+Positional matching of sky catalogs using KD-trees of 3-D unit vectors.
+Chord lengths between unit vectors are monotonic in angular separation,
+so the Euclidean queries of scipy's cKDTree give exact spherical
+matches with no RA wrap-around or pole issues.  Queries are done in
+chunks to bound the memory use, and the chunks are dispatched to a
+thread pool since cKDTree releases the GIL.
+"""
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from scipy.spatial import cKDTree
+
+__all__ = ['SkyMatches', 'unit_vectors', 'chord_length', 'chord_to_angle',
+           'SkyMatcher']
+
+SkyMatches = namedtuple('SkyMatches', 'src_index ref_index separation'.split())
+
+def unit_vectors(ra, dec, degrees=False):
+    """
+    Convert sky coordinates to an (n, 3) array of unit vectors.
+
+    Parameters
+    ----------
+    ra: numpy.array
+        Right ascension values.
+    dec: numpy.array
+        Declination values.
+    degrees: bool [False]
+        Flag to indicate that the coordinates are in degrees rather
+        than radians.
+    """
+    ra, dec = np.atleast_1d(ra, dec)
+    if degrees:
+        ra, dec = np.radians(ra), np.radians(dec)
+    cos_dec = np.cos(dec)
+    return np.column_stack((cos_dec*np.cos(ra), cos_dec*np.sin(ra),
+                            np.sin(dec)))
+
+def chord_length(angle):
+    """Chord length between unit vectors separated by angle (radians)."""
+    return 2.*np.sin(np.asarray(angle)/2.)
+
+def chord_to_angle(chord):
+    """Angular separation (radians) corresponding to a chord length."""
+    return 2.*np.arcsin(np.clip(np.asarray(chord)/2., 0, 1))
+
+class SkyMatcher:
+    """
+    Match source positions to a reference catalog.  The matches are
+    returned as a SkyMatches tuple of numpy arrays of source indexes,
+    reference indexes, and separations (in the units of the input
+    coordinates).
+
+    Parameters
+    ----------
+    ra: numpy.array
+        Right ascension values of the reference catalog.
+    dec: numpy.array
+        Declination values of the reference catalog.
+    mags: numpy.array [None]
+        Reference catalog magnitudes for magnitude-difference
+        constraints.
+    degrees: bool [False]
+        Flag to indicate that the coordinates and separations are in
+        degrees rather than radians.
+    chunk_size: int [100000]
+        Number of source positions per query.
+    processes: int [1]
+        Number of threads to run the chunked queries.
+    """
+    def __init__(self, ra, dec, mags=None, degrees=False, chunk_size=100000,
+                 processes=1):
+        self.degrees = degrees
+        self.tree = cKDTree(unit_vectors(ra, dec, degrees=degrees))
+        self.mags = None if mags is None else np.asarray(mags)
+        self.chunk_size = chunk_size
+        self.processes = processes
+
+    def __len__(self):
+        return self.tree.n
+
+    def _chord(self, separation):
+        if separation is None:
+            return np.inf
+        return chord_length(np.radians(separation) if self.degrees
+                            else separation)
+
+    def _angle(self, chord):
+        angle = chord_to_angle(chord)
+        return np.degrees(angle) if self.degrees else angle
+
+    def _run(self, func, ra, dec, mags, max_dmag):
+        """Apply func to chunks of the source positions and concatenate."""
+        xyz = unit_vectors(ra, dec, degrees=self.degrees)
+        mags = None if mags is None else np.asarray(mags)
+        if max_dmag is not None and (mags is None or self.mags is None):
+            raise ValueError('magnitude constraints need both source and '
+                             'reference magnitudes')
+        starts = range(0, len(xyz), self.chunk_size)
+        args = [(start, xyz[start:start + self.chunk_size],
+                 None if mags is None else mags[start:start + self.chunk_size])
+                for start in starts]
+        if self.processes > 1 and len(args) > 1:
+            with ThreadPool(processes=self.processes) as pool:
+                results = pool.map(func, args)
+        else:
+            results = [func(x) for x in args]
+        if not results:
+            return SkyMatches(np.zeros(0, dtype=int), np.zeros(0, dtype=int),
+                              np.zeros(0))
+        return SkyMatches(*[np.concatenate(x) for x in zip(*results)])
+
+    def nearest(self, ra, dec, max_sep=None, mags=None, max_dmag=None,
+                num_candidates=8):
+        """
+        Find the nearest reference object for each source.
+
+        Parameters
+        ----------
+        ra: numpy.array
+            Right ascension values of the sources.
+        dec: numpy.array
+            Declination values of the sources.
+        max_sep: float [None]
+            Maximum separation.  If None, every source is matched.
+        mags: numpy.array [None]
+            Source magnitudes.
+        max_dmag: float [None]
+            Maximum absolute magnitude difference.  If given, the match
+            is the nearest of the num_candidates nearest reference
+            objects that satisfies the constraint.
+        num_candidates: int [8]
+            Number of nearest neighbors considered for magnitude
+            constraints.
+
+        Returns
+        -------
+        SkyMatches: Sources without a match are omitted.
+        """
+        chord = self._chord(max_sep)
+        k = 1 if max_dmag is None else min(num_candidates, len(self))
+
+        def query(args):
+            start, xyz, src_mags = args
+            dist, index = self.tree.query(xyz, k=k, distance_upper_bound=chord)
+            dist, index = dist.reshape(len(xyz), k), index.reshape(len(xyz), k)
+            valid = np.isfinite(dist)
+            if max_dmag is not None:
+                ref_mags = np.full(index.shape, np.nan)
+                ref_mags[valid] = self.mags[index[valid]]
+                valid &= np.abs(ref_mags - src_mags[:, None]) < max_dmag
+            # Column of the first (i.e., nearest) valid candidate.
+            column = np.argmax(valid, axis=1)
+            rows = np.where(valid[np.arange(len(xyz)), column])[0]
+            column = column[rows]
+            return (rows + start, index[rows, column],
+                    self._angle(dist[rows, column]))
+
+        return self._run(query, ra, dec, mags, max_dmag)
+
+    def within(self, ra, dec, radius, mags=None, max_dmag=None):
+        """
+        Find all reference objects within radius of each source.
+
+        Parameters
+        ----------
+        ra: numpy.array
+            Right ascension values of the sources.
+        dec: numpy.array
+            Declination values of the sources.
+        radius: float
+            Match radius.
+        mags: numpy.array [None]
+            Source magnitudes.
+        max_dmag: float [None]
+            Maximum absolute magnitude difference.
+
+        Returns
+        -------
+        SkyMatches: The matched pairs sorted by source index and then by
+            separation.
+        """
+        chord = self._chord(radius)
+
+        def query(args):
+            start, xyz, src_mags = args
+            pairs = cKDTree(xyz).sparse_distance_matrix(
+                self.tree, chord, output_type='ndarray')
+            src_index, ref_index, dist = pairs['i'], pairs['j'], pairs['v']
+            if max_dmag is not None:
+                keep = np.abs(self.mags[ref_index]
+                              - src_mags[src_index]) < max_dmag
+                src_index, ref_index, dist \
+                    = src_index[keep], ref_index[keep], dist[keep]
+            order = np.lexsort((dist, src_index))
+            return (src_index[order] + start, ref_index[order],
+                    self._angle(dist[order]))
+
+        return self._run(query, ra, dec, mags, max_dmag)
@@ -0,0 +1,278 @@
+"""
+Persisted index of the tract and patch footprints of a skymap, so that
+spatial queries of tracts and patches can be done without loading the
+skymap from the Data Butler or doing any WCS transformations.
+"""
+import numpy as np
+
+__all__ = ['pixel_to_sky', 'patch_corners', 'SkyMapIndex']
+
+def pixel_to_sky(wcs, x, y):
+    """
+    Convert arrays of pixel coordinates to sky coordinates in degrees
+    with a single call to the WCS, if it provides pixelToSkyArray,
+    otherwise point by point.
+
+    Returns
+    -------
+    (numpy.array, numpy.array): RA and Dec values in degrees.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if hasattr(wcs, 'pixelToSkyArray'):
+        ra, dec = wcs.pixelToSkyArray(x.ravel(), y.ravel(), degrees=True)
+        return np.reshape(ra, x.shape), np.reshape(dec, x.shape)
+    import lsst.afw.geom as afw_geom
+    ra, dec = np.empty(x.shape), np.empty(x.shape)
+    for i, (xx, yy) in enumerate(zip(x.flat, y.flat)):
+        coord = wcs.pixelToSky(afw_geom.Point2D(xx, yy))
+        ra.flat[i] = coord.getRa().asDegrees()
+        dec.flat[i] = coord.getDec().asDegrees()
+    return ra, dec
+
+def patch_corners(tractInfo, outer=True):
+    """
+    Compute the sky coordinates of the corners of all of the patches
+    in a tract, converting all of the corners with one WCS call.
+
+    Parameters
+    ----------
+    tractInfo: lsst.skymap.TractInfo
+        The tract.
+    outer: bool [True]
+        If True, use the outer patch bounding boxes, which include the
+        overlap regions with adjacent patches, otherwise use the inner
+        bounding boxes.
+
+    Returns
+    -------
+    (list, numpy.array, numpy.array): The (x, y) patch indexes and the
+        RA and Dec values in degrees of the four corners of each patch,
+        with shapes (npatches, 4).
+    """
+    import lsst.afw.geom as afw_geom
+    xNum, yNum = tractInfo.getNumPatches()
+    indexes, x, y = [], [], []
+    for ix in range(xNum):
+        for iy in range(yNum):
+            patchInfo = tractInfo.getPatchInfo([ix, iy])
+            bbox = patchInfo.getOuterBBox() if outer \
+                   else patchInfo.getInnerBBox()
+            for corner in afw_geom.Box2D(bbox).getCorners():
+                x.append(corner.getX())
+                y.append(corner.getY())
+            indexes.append((ix, iy))
+    ra, dec = pixel_to_sky(tractInfo.getWcs(), x, y)
+    return indexes, ra.reshape(-1, 4), dec.reshape(-1, 4)
+
+def _unwrap(ra, ra_ref):
+    """Shift RA values (deg) to within 180 degrees of ra_ref."""
+    return ra_ref + (np.asarray(ra) - ra_ref + 180.) % 360. - 180.
+
+class SkyMapIndex:
+    """
+    Index of the tract/patch sky polygons and bounding boxes.  Each
+    patch is represented by the quadrilateral formed by its four
+    corners, with the RA values unwrapped relative to the first corner,
+    which is adequate for patch-sized regions away from the poles.
+    """
+    def __init__(self, tract, patch_x, patch_y, ra_corners, dec_corners,
+                 ra_inner, dec_inner):
+        """
+        Parameters
+        ----------
+        tract, patch_x, patch_y: numpy.array
+            Tract ID and patch indexes for each patch.
+        ra_corners, dec_corners: numpy.array
+            Corners of the outer patch boundaries in degrees, with
+            shapes (npatches, 4).
+        ra_inner, dec_inner: numpy.array
+            Corners of the inner patch boundaries in degrees.
+        """
+        self.tract = np.asarray(tract)
+        self.patch_x = np.asarray(patch_x)
+        self.patch_y = np.asarray(patch_y)
+        self.ra_corners = _unwrap(ra_corners, np.asarray(ra_corners)[:, :1])
+        self.dec_corners = np.asarray(dec_corners)
+        self.ra_inner = _unwrap(ra_inner, self.ra_corners[:, :1])
+        self.dec_inner = np.asarray(dec_inner)
+        self.ra_min = self.ra_corners.min(axis=1)
+        self.ra_max = self.ra_corners.max(axis=1)
+        self.dec_min = self.dec_corners.min(axis=1)
+        self.dec_max = self.dec_corners.max(axis=1)
+
+    @staticmethod
+    def build(skymap, tracts=None):
+        """
+        Build the index from a skymap.
+
+        Parameters
+        ----------
+        skymap: lsst.skymap.BaseSkyMap
+            The skymap, e.g., butler.get('deepCoadd_skyMap').
+        tracts: list of int [None]
+            Tracts to include.  If None, include all tracts.
+        """
+        if tracts is None:
+            tracts = [tractInfo.getId() for tractInfo in skymap]
+        columns = dict(tract=[], patch_x=[], patch_y=[], ra_corners=[],
+                       dec_corners=[], ra_inner=[], dec_inner=[])
+        for tract in tracts:
+            tractInfo = skymap[tract]
+            indexes, ra, dec = patch_corners(tractInfo, outer=True)
+            _, ra_inner, dec_inner = patch_corners(tractInfo, outer=False)
+            columns['tract'].extend(len(indexes)*[tract])
+            columns['patch_x'].extend(x[0] for x in indexes)
+            columns['patch_y'].extend(x[1] for x in indexes)
+            columns['ra_corners'].append(ra)
+            columns['dec_corners'].append(dec)
+            columns['ra_inner'].append(ra_inner)
+            columns['dec_inner'].append(dec_inner)
+        for key in ('ra_corners', 'dec_corners', 'ra_inner', 'dec_inner'):
+            columns[key] = np.concatenate(columns[key])
+        return SkyMapIndex(**columns)
+
+    def write(self, outfile):
+        """Write the index to a numpy .npz file."""
+        np.savez_compressed(outfile, tract=self.tract, patch_x=self.patch_x,
+                            patch_y=self.patch_y, ra_corners=self.ra_corners,
+                            dec_corners=self.dec_corners,
+                            ra_inner=self.ra_inner, dec_inner=self.dec_inner)
+
+    @staticmethod
+    def read(infile):
+        """Read an index written by SkyMapIndex.write."""
+        with np.load(infile) as data:
+            return SkyMapIndex(**{key: data[key] for key in data.files})
+
+    def __len__(self):
+        return len(self.tract)
+
+    def tract_ids(self):
+        """Return the sorted list of tract IDs."""
+        return sorted(int(x) for x in np.unique(self.tract))
+
+    def patch_id(self, index):
+        """Return the (tract, 'x,y') patch ID for the index-th patch."""
+        return (int(self.tract[index]),
+                '%i,%i' % (self.patch_x[index], self.patch_y[index]))
+
+    def patch_ids(self):
+        """
+        Return a dictionary of patch IDs, keyed by tract ID, in the same
+        format as load_catalog_tables.get_patch_ids.
+        """
+        patch_ids = dict()
+        for i in range(len(self)):
+            tract, patch = self.patch_id(i)
+            patch_ids.setdefault(tract, []).append(patch)
+        return patch_ids
+
+    def find(self, tract, patch):
+        """Return the index of a patch, e.g., find(4638, '2,2')."""
+        x, y = (int(_) for _ in patch.split(','))
+        index = np.where((self.tract == tract) & (self.patch_x == x)
+                         & (self.patch_y == y))[0]
+        if len(index) == 0:
+            raise KeyError('tract {}, patch {} not in index'
+                           .format(tract, patch))
+        return index[0]
+
+    def bbox(self, tract, patch):
+        """Return the ((ra_min, ra_max), (dec_min, dec_max)) of a patch."""
+        i = self.find(tract, patch)
+        return ((self.ra_min[i], self.ra_max[i]),
+                (self.dec_min[i], self.dec_max[i]))
+
+    def overlapping(self, ra_range, dec_range):
+        """
+        Return the indexes of the patches whose bounding boxes overlap
+        an RA/Dec box.
+
+        Parameters
+        ----------
+        ra_range: (float, float)
+            Minimum and maximum RA in degrees.
+        dec_range: (float, float)
+            Minimum and maximum Dec in degrees.
+
+        Returns
+        -------
+        numpy.array: Indexes of the overlapping patches.
+        """
+        ra_center = (ra_range[0] + ra_range[1])/2.
+        half_width = (ra_range[1] - ra_range[0])/2.
+        # Compare with the patch RA values unwrapped around the box center.
+        offset = _unwrap(ra_center, (self.ra_min + self.ra_max)/2.) - ra_center
+        return np.where((self.ra_min - offset < ra_center + half_width)
+                        & (self.ra_max - offset > ra_center - half_width)
+                        & (self.dec_min < dec_range[1])
+                        & (self.dec_max > dec_range[0]))[0]
+
+    def _dec_candidates(self, dec, order, dec_min, max_height):
+        """
+        Return the (point, patch) index pairs with the point Dec values
+        within the patch Dec ranges.  Only the patches with dec_min in
+        [dec - max_height, dec] are considered, found by binary search
+        in the dec_min values sorted by order, so that a dense
+        (npoints, npatches) array is not needed.
+        """
+        lower = np.searchsorted(dec_min, dec - max_height, side='left')
+        upper = np.searchsorted(dec_min, dec, side='right')
+        counts = upper - lower
+        ipt = np.repeat(np.arange(len(dec)), counts)
+        offsets = np.arange(len(ipt)) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+        ipatch = order[lower[ipt] + offsets]
+        keep = dec[ipt] <= self.dec_max[ipatch]
+        return ipt[keep], ipatch[keep]
+
+    def containing(self, ra, dec, inner=False, chunk_size=10000):
+        """
+        Find the patches containing each of a set of points.
+
+        Parameters
+        ----------
+        ra, dec: numpy.array
+            Coordinates of the points in degrees.
+        inner: bool [False]
+            If True, test against the inner patch boundaries, so that
+            each point is assigned to at most one patch per tract.
+        chunk_size: int [10000]
+            Number of points to process at a time.
+
+        Returns
+        -------
+        (numpy.array, numpy.array): Indexes of the points and of the
+            patches containing them.  A point may be contained in more
+            than one patch.
+        """
+        ra = np.atleast_1d(np.asarray(ra, dtype=float))
+        dec = np.atleast_1d(np.asarray(dec, dtype=float))
+        ra_poly = self.ra_inner if inner else self.ra_corners
+        dec_poly = self.dec_inner if inner else self.dec_corners
+        # Orient the quadrilaterals counterclockwise in (ra, dec).
+        x0, x1 = ra_poly, np.roll(ra_poly, -1, axis=1)
+        y0, y1 = dec_poly, np.roll(dec_poly, -1, axis=1)
+        area = np.sum(x0*y1 - x1*y0, axis=1)
+        sign = np.where(area < 0, -1., 1.)
+        order = np.argsort(self.dec_min, kind='stable')
+        dec_min = self.dec_min[order]
+        max_height = np.max(self.dec_max - self.dec_min, initial=0)
+        point_indexes, patch_indexes = [], []
+        for imin in range(0, len(ra), chunk_size):
+            pra = ra[imin:imin + chunk_size]
+            pdec = dec[imin:imin + chunk_size]
+            ipt, ipatch = self._dec_candidates(pdec, order, dec_min,
+                                               max_height)
+            x = _unwrap(pra[ipt], self.ra_corners[ipatch, 0])
+            in_bbox = (x >= self.ra_min[ipatch]) & (x <= self.ra_max[ipatch])
+            ipt, ipatch, x = ipt[in_bbox], ipatch[in_bbox], x[in_bbox]
+            y = pdec[ipt]
+            cross = ((x1[ipatch] - x0[ipatch])*(y[:, None] - y0[ipatch])
+                     - (y1[ipatch] - y0[ipatch])*(x[:, None] - x0[ipatch]))
+            inside = np.all(sign[ipatch][:, None]*cross >= 0, axis=1)
+            point_indexes.append(ipt[inside] + imin)
+            patch_indexes.append(ipatch[inside])
+        return (np.concatenate(point_indexes).astype(int),
+                np.concatenate(patch_indexes).astype(int))
@@ -0,0 +1,234 @@
+"""
+Per-task resource accounting for work dispatched to multiprocessing
+pools with apply_async or imap_unordered.
+"""
+import os
+import time
+import resource
+import threading
+from collections import namedtuple
+import numpy as np
+import psutil
+
+__all__ = ['TaskStats', 'AccountedTask', 'TaskAccountant']
+
+TaskStats = namedtuple('TaskStats', ('task_id pid tstart tend wall cpu '
+                                     'peak_rss bytes_read bytes_written')
+                       .split())
+
+def _io_counters(process):
+    try:
+        io = process.io_counters()
+    except (AttributeError, psutil.Error):
+        # io_counters is not available on all platforms.
+        return 0, 0
+    return io.read_bytes, io.write_bytes
+
+def _tree_rss(process):
+    """Total RSS (bytes) of a process and all of its descendants."""
+    rss = 0
+    for proc in [process] + process.children(recursive=True):
+        try:
+            rss += proc.memory_info().rss
+        except psutil.Error:
+            # The process exited after it was listed.
+            pass
+    return rss
+
+class _TreeSampler(threading.Thread):
+    """
+    Thread that samples the total RSS of a process tree at a fixed
+    interval and records the maximum.
+    """
+    def __init__(self, process, interval):
+        super().__init__(daemon=True)
+        self.process = process
+        self.interval = interval
+        self.peak_rss = _tree_rss(process)
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, _tree_rss(self.process))
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.peak_rss = max(self.peak_rss, _tree_rss(self.process))
+        return self.peak_rss
+
+class AccountedTask:
+    """
+    Callback function class that runs a task function and returns its
+    result along with a TaskStats tuple of its wall time, cpu time,
+    peak RSS, and bytes read and written.
+
+    The cpu time includes any subprocesses that the task waited for.
+    The peak RSS (bytes) is the maximum total RSS of the worker process
+    and its descendants, e.g., a processCcd.py shell subprocess, sampled
+    every sample_interval seconds while the task runs, so unlike the
+    ru_maxrss lifetime high-water mark it is specific to the task.  The
+    byte counts are those of the worker process, which on Linux include
+    the I/O of the subprocesses that the task waited for.
+    """
+    def __init__(self, func, sample_interval=0.5):
+        self.func = func
+        self.sample_interval = sample_interval
+
+    def __call__(self, task_id, *args, **kwds):
+        process = psutil.Process()
+        read0, written0 = _io_counters(process)
+        cpu0 = process.cpu_times()
+        children0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        sampler = _TreeSampler(process, self.sample_interval)
+        sampler.start()
+        tstart = time.time()
+        try:
+            result = self.func(*args, **kwds)
+        finally:
+            peak_rss = sampler.stop()
+        tend = time.time()
+        cpu1 = process.cpu_times()
+        children1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        read1, written1 = _io_counters(process)
+        cpu = (cpu1.user - cpu0.user + cpu1.system - cpu0.system
+               + children1.ru_utime - children0.ru_utime
+               + children1.ru_stime - children0.ru_stime)
+        return result, TaskStats(task_id, os.getpid(), tstart, tend,
+                                 tend - tstart, cpu, peak_rss,
+                                 read1 - read0, written1 - written0)
+
+    def call_packed(self, packed):
+        """Call with a (task_id, arg) tuple, for use with Pool.imap."""
+        return self(*packed)
+
+class TaskAccountant:
+    """
+    Dispatch tasks to a multiprocessing pool and aggregate their
+    TaskStats into a per-task table in the parent process.
+    """
+    def __init__(self):
+        self.async_results = []
+        self.stats = []
+
+    def apply_async(self, pool, func, args=(), kwds=None, task_id=None):
+        """
+        Submit func(*args, **kwds) to the pool, wrapped by AccountedTask.
+        """
+        if task_id is None:
+            task_id = str(len(self.async_results))
+        kwds = {} if kwds is None else kwds
+        self.async_results.append(pool.apply_async(AccountedTask(func),
+                                                   (task_id,) + tuple(args),
+                                                   kwds))
+
+    def imap_unordered(self, pool, func, items, task_ids=None, chunksize=1):
+        """
+        Apply func to each item via pool.imap_unordered, so that the
+        pool workers pull tasks from a shared queue, and yield the
+        (task_id, result) pairs as they complete.
+
+        Parameters
+        ----------
+        pool: multiprocessing.Pool
+            The process pool.
+        func: callable
+            Picklable function of a single argument.
+        items: iterable
+            Arguments for each task.
+        task_ids: iterable [None]
+            Task ids.  If None, then str(item) is used.
+        chunksize: int [1]
+            Number of tasks sent to a worker at a time.
+        """
+        items = list(items)
+        if task_ids is None:
+            task_ids = [str(item) for item in items]
+        for result, stats in pool.imap_unordered(
+                AccountedTask(func).call_packed, zip(task_ids, items),
+                chunksize=chunksize):
+            self.stats.append(stats)
+            yield stats.task_id, result
+
+    def get(self):
+        """
+        Wait for the submitted tasks, collect their TaskStats, and
+        return their results in submission order.  As for
+        AsyncResult.get, an exception raised by a task is re-raised.
+        """
+        results = []
+        for async_result in self.async_results:
+            result, stats = async_result.get()
+            results.append(result)
+            self.stats.append(stats)
+        self.async_results = []
+        return results
+
+    def table(self):
+        """Return the per-task stats as a numpy recarray."""
+        dtype = [('task_id', 'U64'), ('pid', int), ('tstart', float),
+                 ('tend', float), ('wall', float), ('cpu', float),
+                 ('peak_rss', np.int64), ('bytes_read', np.int64),
+                 ('bytes_written', np.int64)]
+        return np.rec.fromrecords([tuple(x) for x in self.stats], dtype=dtype)
+
+    def outliers(self, column='wall', nsigma=5.):
+        """
+        Return the tasks for which the column value exceeds the median
+        by more than nsigma robust (MAD-based) standard deviations.
+        """
+        data = self.table()
+        values = data[column]
+        median = np.median(values)
+        sigma = 1.4826*np.median(np.abs(values - median))
+        if sigma == 0:
+            # More than half of the values are equal to the median, so
+            # fall back to the mean absolute deviation, scaled to a
+            # Gaussian sigma, which is zero only if all of the values
+            # are equal.
+            sigma = 1.2533*np.mean(np.abs(values - median))
+            if sigma == 0:
+                return data[:0]
+        return data[(values - median)/sigma > nsigma]
+
+    def stragglers(self, tail_fraction=0.1):
+        """
+        Return the tasks still running during the last tail_fraction of
+        the batch makespan that ran longer than the median task, i.e.,
+        the tasks that set the wall time of the batch.
+        """
+        data = self.table()
+        t0, t1 = np.min(data['tstart']), np.max(data['tend'])
+        tail_start = t1 - tail_fraction*(t1 - t0)
+        return data[(data['tend'] > tail_start)
+                    & (data['wall'] > np.median(data['wall']))]
+
+    def write(self, outfile):
+        """Write the per-task table as a text file."""
+        data = self.table()
+        with open(outfile, 'w') as output:
+            output.write('# ' + '  '.join(data.dtype.names) + '\n')
+            for row in data:
+                output.write('  '.join(str(x) for x in row) + '\n')
+
+    def report(self):
+        """Return a text summary of the batch with stragglers and outliers."""
+        data = self.table()
+        if len(data) == 0:
+            return 'no tasks'
+        makespan = np.max(data['tend']) - np.min(data['tstart'])
+        lines = ['%d tasks, makespan %.1f s, total wall %.1f s, total cpu '
+                 '%.1f s, max peak RSS %.2f GB'
+                 % (len(data), makespan, np.sum(data['wall']),
+                    np.sum(data['cpu']), np.max(data['peak_rss'])/1024.**3)]
+        for title, tasks in (('stragglers', self.stragglers()),
+                             ('wall time outliers', self.outliers('wall')),
+                             ('peak RSS outliers', self.outliers('peak_rss'))):
+            if len(tasks) == 0:
+                continue
+            lines.append(title + ':')
+            for task in tasks:
+                lines.append('  %s  wall %.1f s  cpu %.1f s  peak RSS %.2f GB'
+                             % (task['task_id'], task['wall'], task['cpu'],
+                                task['peak_rss']/1024.**3))
+        return '\n'.join(lines)
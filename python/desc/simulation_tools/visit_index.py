@@ -0,0 +1,146 @@
+"""
+Spatial index over the dithered OpSim pointings.  The pointing
+directions are stored as 3-D unit vectors in a KD-tree, so that cone
+searches, nearest-pointing queries, and per-position visit counts are
+answered with vectorized chord-length computations and no RA
+wrap-around or pole issues.
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+from .sky_matcher import unit_vectors, chord_length, chord_to_angle
+
+__all__ = ['VisitIndex']
+
+class VisitIndex:
+    """
+    KD-tree index of the pointings held by an OpsimPointings object.
+
+    Parameters
+    ----------
+    pointings: OpsimPointings
+        Pointings to index.  Visits loaded after the index is created
+        are not included.
+    degrees: bool [False]
+        Flag to indicate that the query coordinates, radii, and returned
+        separations are in degrees rather than radians.
+    """
+    def __init__(self, pointings, degrees=False):
+        self.degrees = degrees
+        self.obsHistID = np.array(pointings.obsHistID)
+        self.ra = np.array(pointings.ra)
+        self.dec = np.array(pointings.dec)
+        self.xyz = unit_vectors(self.ra, self.dec)
+        self.tree = cKDTree(self.xyz)
+
+    def __len__(self):
+        return len(self.obsHistID)
+
+    def _chord(self, angle):
+        return chord_length(np.radians(angle) if self.degrees else angle)
+
+    def _angle(self, chord):
+        angle = chord_to_angle(chord)
+        return np.degrees(angle) if self.degrees else angle
+
+    def _index(self, obsHistIDs):
+        obsHistIDs = np.atleast_1d(np.asarray(obsHistIDs, dtype=np.int64))
+        index = np.searchsorted(self.obsHistID, obsHistIDs)
+        found = index < len(self)
+        found[found] = self.obsHistID[index[found]] == obsHistIDs[found]
+        if not np.all(found):
+            raise KeyError('visits not indexed: {}'.format(obsHistIDs[~found]))
+        return index
+
+    def separations(self, ra, dec, obsHistIDs=None):
+        """
+        Angular separations of a position from the visit pointings.
+
+        Parameters
+        ----------
+        ra: float
+            Right ascension of the position.
+        dec: float
+            Declination of the position.
+        obsHistIDs: sequence of int [None]
+            Visits for which to compute the separations.  If None, then
+            all indexed visits are used.
+
+        Returns
+        -------
+        numpy.array
+        """
+        xyz = self.xyz if obsHistIDs is None \
+              else self.xyz[self._index(obsHistIDs)]
+        center = unit_vectors(ra, dec, degrees=self.degrees)[0]
+        return self._angle(np.sqrt(np.sum((xyz - center)**2, axis=1)))
+
+    def cone(self, ra, dec, radius):
+        """
+        Find the visits with pointings within radius of a position.
+
+        Returns
+        -------
+        (numpy.array, numpy.array): The obsHistIDs and separations,
+            sorted by separation.
+        """
+        center = unit_vectors(ra, dec, degrees=self.degrees)[0]
+        index = np.array(self.tree.query_ball_point(center,
+                                                    self._chord(radius)),
+                         dtype=int)
+        seps = self._angle(np.sqrt(np.sum((self.xyz[index] - center)**2,
+                                          axis=1)))
+        order = np.argsort(seps, kind='stable')
+        return self.obsHistID[index[order]], seps[order]
+
+    def nearest(self, ra, dec, k=1):
+        """
+        Find the k visits with pointings nearest to a position.
+
+        Returns
+        -------
+        (numpy.array, numpy.array): The obsHistIDs and separations,
+            sorted by separation.
+        """
+        k = min(k, len(self))
+        dist, index = self.tree.query(
+            unit_vectors(ra, dec, degrees=self.degrees)[0], k=k)
+        dist, index = np.atleast_1d(dist), np.atleast_1d(index)
+        return self.obsHistID[index], self._angle(dist)
+
+    def box(self, ra_min, ra_max, dec_min, dec_max):
+        """
+        Find the visits with pointings in an RA, Dec box.  If
+        ra_min > ra_max, then the box wraps around RA=0.
+
+        Returns
+        -------
+        numpy.array: The obsHistIDs, sorted.
+        """
+        full_circle = 360. if self.degrees else 2.*np.pi
+        ra, dec = self.ra, self.dec
+        if self.degrees:
+            ra, dec = np.degrees(ra), np.degrees(dec)
+        ra = ra % full_circle
+        full_ra = ra_max - ra_min >= full_circle
+        ra_min, ra_max = ra_min % full_circle, ra_max % full_circle
+        if full_ra:
+            in_ra = np.ones(len(ra), dtype=bool)
+        elif ra_min <= ra_max:
+            in_ra = (ra >= ra_min) & (ra <= ra_max)
+        else:
+            in_ra = (ra >= ra_min) | (ra <= ra_max)
+        return self.obsHistID[in_ra & (dec >= dec_min) & (dec <= dec_max)]
+
+    def counts(self, ra, dec, radius):
+        """
+        Count the visits with pointings within radius of each of a set
+        of positions, e.g., the number of visits covering each position
+        for radius equal to the field-of-view radius.
+
+        Returns
+        -------
+        numpy.array: Number of visits for each position.
+        """
+        xyz = unit_vectors(ra, dec, degrees=self.degrees)
+        return np.asarray(self.tree.query_ball_point(
+            xyz, self._chord(radius), return_length=True), dtype=int)
@@ -1,13 +1,82 @@
+import gzip
 import numpy as np
 
 __all__ = ["write_region_file"]
 
-def write_region_file(sourceCatalog, outfile):
-    with open(outfile, 'w') as output:
-        output.write("""# Region file format: DS9 version 4.1
+_header = """# Region file format: DS9 version 4.1
 global color=green dashlist=8 3 width=1 font="helvetica 10 normal roman" select=1 highlite=1 dash=0 fixed=0 edit=1 move=1 delete=1 include=1 source=1
 fk5
-""")
-        for ra, dec in zip(np.degrees(sourceCatalog['coord_ra']),
-                           np.degrees(sourceCatalog['coord_dec'])):
-            output.write("point({},{}) # point=circle\n".format(ra, dec))
+"""
+
+def _radec_degrees(sourceCatalog):
+    """
+    Return the source coordinates in degrees from an afw SourceCatalog
+    or a numpy structured array or dict with 'coord_ra' and 'coord_dec'
+    columns in radians, or from an (ra, dec) tuple of arrays in degrees.
+    """
+    if isinstance(sourceCatalog, tuple):
+        ra, dec = sourceCatalog
+        return np.asarray(ra, dtype=float), np.asarray(dec, dtype=float)
+    return (np.degrees(sourceCatalog['coord_ra']),
+            np.degrees(sourceCatalog['coord_dec']))
+
+def _template_field(value, fmt, columns):
+    """
+    Return the template field for a region property.  Scalar values are
+    formatted into the template directly, while per-source arrays are
+    appended to columns and given a placeholder.
+    """
+    if np.ndim(value) == 0:
+        return (fmt % value).replace('%', '%%')
+    columns.append(np.asarray(value))
+    return fmt
+
+def write_region_file(sourceCatalog, outfile, shape='circle', size=None,
+                      color=None, chunk_size=100000, compress=None):
+    """
+    Write a DS9 region file with a point region for each source.  The
+    sources are written in chunks of chunk_size, and each chunk is
+    formatted with a single string formatting operation, so large
+    catalogs are streamed to the output without a per-source loop.
+
+    Parameters
+    ----------
+    sourceCatalog: lsst.afw.table.SourceCatalog, numpy structured array,
+        dict, or tuple
+        Catalog with 'coord_ra' and 'coord_dec' columns in radians, or
+        an (ra, dec) tuple of arrays in degrees.
+    outfile: str
+        Output filename.
+    shape: str or array of str ['circle']
+        DS9 point shape(s), e.g., 'circle', 'box', 'diamond', 'cross',
+        'x', 'arrow', or 'boxcircle'.
+    size: int or array of int [None]
+        Point size(s) in screen pixels.  If None, use the DS9 default.
+    color: str or array of str [None]
+        Region color(s).  If None, use the global color, green.
+    chunk_size: int [100000]
+        Number of sources to format at a time.
+    compress: bool [None]
+        If True, write gzip-compressed output.  If None, compress if
+        outfile ends with '.gz'.
+    """
+    ra, dec = _radec_degrees(sourceCatalog)
+    columns = [ra, dec]
+    template = 'point(%.8f,%.8f) # point=' \
+        + _template_field(shape, '%s', columns)
+    if size is not None:
+        template += _template_field(size, ' %d', columns)
+    if color is not None:
+        template += _template_field(color, ' color=%s', columns)
+    template += '\n'
+    if compress is None:
+        compress = outfile.endswith('.gz')
+    opener = gzip.open if compress else open
+    with opener(outfile, 'wt') as output:
+        output.write(_header)
+        for imin in range(0, len(ra), chunk_size):
+            nsrc = len(ra[imin:imin + chunk_size])
+            values = np.empty((nsrc, len(columns)), dtype=object)
+            for i, column in enumerate(columns):
+                values[:, i] = column[imin:imin + chunk_size]
+            output.write((template*nsrc) % tuple(values.ravel().tolist()))
@@ -6,6 +6,7 @@ import argparse
 import subprocess
 import multiprocessing
 import desc.imsim
+from desc.simulation_tools.task_accounting import TaskAccountant
 
 class WriteAmpFile:
     def __init__(self, opsim_db=None):
@@ -34,6 +35,8 @@ if __name__ == '__main__':
                         help="Number of parallel processes to use.")
     parser.add_argument('--outdir', type=str, default='.',
                         help='output directory for raw files')
+    parser.add_argument('--task_table', type=str, default=None,
+                        help='output file for the per-task resource table')
     args = parser.parse_args()
 
     opsim_db = args.opsim_db if args.opsim_db is not None else \
@@ -43,7 +46,7 @@ if __name__ == '__main__':
         os.makedirs(args.outdir)
 
     write_amp_file = WriteAmpFile(opsim_db=opsim_db)
-    results = []
+    accountant = TaskAccountant()
     with multiprocessing.Pool(processes=args.processes, maxtasksperchild=1) \
          as pool:
         for item in args.eimage_files:
@@ -52,10 +55,13 @@ if __name__ == '__main__':
                 continue
             print("processing", os.path.basename(item))
             sys.stdout.flush()
-            results.append(pool.apply_async(write_amp_file, (item,),
-                                            dict(outdir=args.outdir)))
+            accountant.apply_async(pool, write_amp_file, (item,),
+                                   dict(outdir=args.outdir),
+                                   task_id=os.path.basename(item))
 
         pool.close()
         pool.join()
-        for res in results:
-            res.get()
+        accountant.get()
+    print(accountant.report())
+    if args.task_table is not None:
+        accountant.write(args.task_table)
@@ -1,41 +1,52 @@
-import os
-import glob
-import sqlite3
+import argparse
 import multiprocessing
-import numpy as np
-import astropy.io.fits as fits
-
-def process_dataset(dataset, outfile):
-    print("processing", dataset)
-    root_dir = '/global/projecta/projectdirs/lsst/production/DC2'
-    eimage_dir = os.path.join(root_dir, dataset, 'output')
-    stream_dirs = sorted(glob.glob(os.path.join(eimage_dir, '0*')))
-    with open(outfile, 'w') as output:
-        for stream_dir in stream_dirs:
-            eimage_files \
-                = sorted(glob.glob(os.path.join(stream_dir, 'lsst_e*R22_S11*')))
-            nfiles = len(eimage_files)
-            for eimage_file in eimage_files:
-                eimage = fits.open(eimage_file)
-                hdr = eimage[0].header
-                raft, sensor = hdr['CHIPID'].split('_')
-                counts = float(np.median(eimage[0].data.ravel()))
-                version = os.path.basename(hdr['BRANCH'])
-                line = '  '.join(6*['{}']) + '\n'
-                output.write(line.format(hdr['FILTER'], hdr['OBSID'], raft,
-                                         sensor, counts, version))
-                output.flush()
+from desc.simulation_tools.eimage_inventory import EimageInventory
+from desc.simulation_tools.sensor_sky_levels import SensorSkyLevel
+from desc.simulation_tools.task_accounting import TaskAccountant
 
 datasets = (['DC2-R1-2p-WFD-{}'.format(band) for band in 'ugrizy'] +
             ['DC2-R1-2p-uDDF-{}'.format(band) for band in 'ugrizy'])
 
-processes = 4
-pool = multiprocessing.Pool(processes=processes)
-results = []
-for dataset in datasets:
-    outfile = dataset + '.txt'
-    results.append(pool.apply_async(process_dataset, (dataset, outfile)))
-pool.close()
-pool.join()
-for res in results:
-    res.get()
+parser = argparse.ArgumentParser(description="Survey the sky levels of "
+                                 "simulated eimages.")
+parser.add_argument('--root_dir', type=str,
+                    default='/global/projecta/projectdirs/lsst/production/DC2',
+                    help='root directory of the DC2 production')
+parser.add_argument('--datasets', type=str, nargs='+', default=datasets,
+                    help='datasets to survey')
+parser.add_argument('--pattern', type=str, default='lsst_e*',
+                    help="eimage filename pattern, e.g., 'lsst_e*R22_S11*'")
+parser.add_argument('--inventory', type=str,
+                    default='eimage_inventory.sqlite',
+                    help='eimage inventory db file [eimage_inventory.sqlite]')
+parser.add_argument('--stride', type=int, default=8,
+                    help='pixel sampling stride along each axis [8]')
+parser.add_argument('--processes', type=int, default=4,
+                    help='number of parallel processes [4]')
+args = parser.parse_args()
+
+# Queue up the files from all of the datasets, so that the work is
+# balanced across the processes at the file level.
+inventory = EimageInventory(args.inventory)
+eimage_files, outfiles = [], dict()
+for dataset in args.datasets:
+    inventory.refresh(args.root_dir, dataset)
+    for eimage_file in inventory.query(pattern=args.pattern,
+                                       dataset=dataset).path:
+        eimage_files.append(eimage_file)
+        outfiles[eimage_file] = dataset + '.txt'
+
+outputs = {outfile: open(outfile, 'w') for outfile in set(outfiles.values())}
+accountant = TaskAccountant()
+line = '  '.join(7*['{}']) + '\n'
+with multiprocessing.Pool(processes=args.processes) as pool:
+    for eimage_file, record in accountant.imap_unordered(
+            pool, SensorSkyLevel(stride=args.stride), eimage_files,
+            task_ids=eimage_files, chunksize=4):
+        output = outputs[outfiles[eimage_file]]
+        output.write(line.format(*record))
+        output.flush()
+for output in outputs.values():
+    output.close()
+print(accountant.report())
+accountant.write('count_sensors_tasks.txt')
@@ -1,20 +1,19 @@
-import os
 import glob
-import sqlite3
+import argparse
+from desc.simulation_tools.sensor_visit_db import SensorVisitDb
 
-conn = sqlite3.connect('run1.2p_sensor_visit_info.sqlite')
-curs = conn.cursor()
-table_name = 'sensor_visit_info'
-curs.execute("""CREATE TABLE IF NOT EXISTS {}
-             (filter text, visit integer, raft text, sensor text,
-             sky_level real, phosim_version text)""".format(table_name))
-conn.commit()
+parser = argparse.ArgumentParser(description="Ingest sensor-visit sky "
+                                 "levels into an sqlite db.")
+parser.add_argument('txt_files', type=str, nargs='*',
+                    help='sky level files [DC2-R1-2p-*.txt]')
+parser.add_argument('--db_file', type=str,
+                    default='run1.2p_sensor_visit_info.sqlite',
+                    help='sqlite db file')
+args = parser.parse_args()
 
-txt_files = sorted(glob.glob('DC2-R1-2p-*.txt'))
-for txt_file in txt_files:
-    with open(txt_file, 'r') as fd:
-        rows = [line.strip().split() for line in fd]
-    curs.executemany('INSERT INTO {} VALUES (?,?,?,?,?,?)'.format(table_name),
-                     rows)
-    conn.commit()
-conn.close()
+txt_files = args.txt_files if args.txt_files \
+            else sorted(glob.glob('DC2-R1-2p-*.txt'))
+
+db = SensorVisitDb(args.db_file)
+print("ingested", db.ingest(txt_files), "rows")
+db.close()
@@ -1,52 +1,71 @@
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
-import scipy
 import astropy.visualization as viz
-from astropy.coordinates import SkyCoord
 from astropy.visualization.mpl_normalize import ImageNormalize
 import lsst.daf.persistence as dp
 import lsst.afw.display as afw_display
 import lsst.afw.image as afw_image
 import lsst.afw.geom as afw_geom
 from lsst.meas.algorithms import LoadIndexedReferenceObjectsTask
+from desc.simulation_tools.image_display import subsample_percentiles, \
+    downsample_factor, block_downsample, mask_rgba
+from desc.simulation_tools.sky_matcher import SkyMatcher
 
 plt.ion()
 
 default_colors = {'CR': 'red', 'DETECTED': 'blue'}
 
-def image_norm(image_array, percentiles=(0, 99.9), stretch=viz.AsinhStretch):
+def image_norm(image_array, percentiles=(0, 99.9), stretch=viz.AsinhStretch,
+               max_samples=1000000):
     """
     Create the ImageNormalize object based on the desired stretch and
-    pixel value range.
+    pixel value range, with the percentiles computed from a strided
+    subsample of at most about max_samples pixels.
     See http://docs.astropy.org/en/stable/visualization/normalization.html
     """
-    vmin, vmax = scipy.percentile(image_array.ravel(), percentiles)
+    vmin, vmax = subsample_percentiles(image_array, percentiles,
+                                       max_samples=max_samples)
     norm = ImageNormalize(vmin=vmin, vmax=vmax, stretch=stretch())
     return norm
 
-def display_calexp(calexp, colors=default_colors, alpha=0.40, cmap=plt.cm.gray, percentiles=(0, 99.9), **kwds):
+def display_calexp(calexp, colors=default_colors, alpha=0.40, cmap=plt.cm.gray, percentiles=(0, 99.9), downsample=None, **kwds):
+    """
+    Display a calexp with the requested mask planes composited into a
+    single RGBA overlay.  If downsample is None, the image and mask are
+    block-downsampled to the screen resolution of the current axes;
+    downsample=1 displays them at full resolution.
+    """
     image = calexp.getImage()
+    mask = calexp.getMask()
+    if downsample is None:
+        bbox = plt.gca().get_window_extent()
+        downsample = downsample_factor(image.array.shape,
+                                       (bbox.width, bbox.height))
+    image_array = block_downsample(image.array, downsample)
     box = afw_geom.Box2D(image.getBBox())
-    extent = (box.getMinX(), box.getMaxX(), box.getMinY(), box.getMaxY())
+    extent = (box.getMinX(), box.getMinX() + downsample*image_array.shape[1],
+              box.getMinY(), box.getMinY() + downsample*image_array.shape[0])
     kwds.setdefault("extent", extent)
     kwds.setdefault("origin", "lower")
     kwds.setdefault("interpolation", "nearest")
     kwds.setdefault("cmap", cmap)
-    disp = plt.imshow(image.array, **kwds)
+    disp = plt.imshow(image_array, **kwds)
+    # Compute the stretch from the full-resolution pixels, so that it
+    # does not depend on the downsampling.
     norm = image_norm(image.array, percentiles=percentiles)
     disp.set_norm(norm)
     kwds.pop("vmin", None)
     kwds.pop("vmax", None)
     kwds.pop("norm", None)
     kwds.pop("cmap", None)
-    mask = calexp.getMask()
-    for plane, color in colors.items():
-        array = np.zeros(mask.array.shape + (4,), dtype=float)
-        rgba = np.array(matplotlib.colors.hex2color(matplotlib.colors.cnames[color]) + (alpha, ),
-                        dtype=float)
-        np.multiply.outer((mask.array & mask.getPlaneBitMask(plane)).astype(bool), rgba, out=array)
-        matplotlib.pyplot.imshow(array, **kwds)
+    if not colors:
+        return
+    plane_colors = [(mask.getPlaneBitMask(plane),
+                     matplotlib.colors.to_rgb(color))
+                    for plane, color in colors.items()]
+    mask_array = block_downsample(mask.array, downsample, bitmask=True)
+    plt.imshow(mask_rgba(mask_array, plane_colors, alpha=alpha), **kwds)
 
 def overlay_sources(src, calexp, ref_pix_coords=None,
                     mag_cut=22.):
@@ -60,17 +79,13 @@ def overlay_sources(src, calexp, ref_pix_coords=None,
              "base_SdssCentroid_flag_resetToPeak",
              "base_SdssShape_flag", "base_ClassificationExtendedness_flag"]
     calib = calexp.getCalib()
-    xvals, yvals = [], []
     selection = src['base_ClassificationExtendedness_value'] == 0
     for flag in Flags:
         selection &= src[flag]==False
     my_src = src[selection].copy(deep=True)
-    for s in my_src:
-        mag = calib.getMagnitude(s['slot_ModelFlux_instFlux'])
-        if mag > mag_cut:
-            continue
-        xvals.append(s.getX())
-        yvals.append(s.getY())
+    mags = calib.getMagnitude(my_src['slot_ModelFlux_instFlux'])
+    mag_sel = ~(mags > mag_cut)
+    xvals, yvals = my_src.getX()[mag_sel], my_src.getY()[mag_sel]
     plt.errorbar(xvals, yvals, fmt='+', color='red', alpha=0.8,
                  fillstyle='none')
     if ref_pix_coords is not None:
@@ -78,41 +93,61 @@ def overlay_sources(src, calexp, ref_pix_coords=None,
                      fillstyle='none')
     return xvals, yvals, my_src
 
+def sky_to_pixel(wcs, ref_cat):
+    """
+    Compute the pixel coordinates of the reference catalog objects
+    with a single call to the WCS, if it provides skyToPixelArray,
+    otherwise row by row.
+    """
+    if hasattr(wcs, 'skyToPixelArray'):
+        return wcs.skyToPixelArray(ref_cat['coord_ra'], ref_cat['coord_dec'])
+    points = [wcs.skyToPixel(row.getCoord()) for row in ref_cat]
+    return (np.array([point.getX() for point in points]),
+            np.array([point.getY() for point in points]))
+
 class RefCat:
+    """
+    Interface to the indexed reference catalog.  The reference objects
+    loaded for each sensor footprint are cached, along with the
+    footprint's WCS, so that repeated calls for the same sensor-visit
+    do not reload the shards or the calexp.
+    """
     def __init__(self, butler):
         self.butler = butler
         refConfig = LoadIndexedReferenceObjectsTask.ConfigClass()
         self.refTask = LoadIndexedReferenceObjectsTask(self.butler,
                                                        config=refConfig)
-    def get_pixel_coords(self, dataId, mag_cut=22.):
-        calexp = self.butler.get('calexp', dataId)
-        wcs = calexp.getWcs()
-        dim = calexp.getDimensions()
-        centerPixel = afw_geom.Point2D(dim.getX()/2., dim.getY()/2.)
-        centerCoord = wcs.pixelToSky(centerPixel)
-        radius = afw_geom.Angle(0.17, afw_geom.degrees)
-        ref_cat \
-            = self.refTask.loadSkyCircle(centerCoord, radius,
-                                         calexp.getFilter().getName()).refCat
-        xref, yref = [], []
+        self._cache = dict()
+    def load(self, dataId, calexp=None):
+        """Return the reference catalog and WCS for a sensor-visit."""
+        key = tuple(sorted(dataId.items()))
+        if key not in self._cache:
+            if calexp is None:
+                calexp = self.butler.get('calexp', dataId)
+            wcs = calexp.getWcs()
+            dim = calexp.getDimensions()
+            centerPixel = afw_geom.Point2D(dim.getX()/2., dim.getY()/2.)
+            centerCoord = wcs.pixelToSky(centerPixel)
+            radius = afw_geom.Angle(0.17, afw_geom.degrees)
+            ref_cat = self.refTask.loadSkyCircle(
+                centerCoord, radius, calexp.getFilter().getName()).refCat
+            self._cache[key] = (ref_cat.copy(deep=True), wcs)
+        return self._cache[key]
+    def get_pixel_coords(self, dataId, mag_cut=22., calexp=None):
+        ref_cat, wcs = self.load(dataId, calexp=calexp)
         mags = -2.5*np.log10(ref_cat['u_flux']/3631.)
-        for i, row in enumerate(ref_cat):
-            if mags[i] > mag_cut:
-                continue
-            point = wcs.skyToPixel(row.getCoord())
-            xref.append(point.getX())
-            yref.append(point.getY())
+        selected = ref_cat[~(mags > mag_cut)].copy(deep=True)
+        xref, yref = sky_to_pixel(wcs, selected)
         return xref, yref, ref_cat
 
 def get_seps(src_cat, calexp, ref_cat, mag_cut=22):
     src_mags \
         = calexp.getCalib().getMagnitude(src_cat['slot_ModelFlux_instFlux'])
     mag_sel = np.where(src_mags < mag_cut)
-    src = SkyCoord(ra=src_cat['coord_ra'][mag_sel],
-                   dec=src_cat['coord_dec'][mag_sel], unit='rad')
-    ref = SkyCoord(ra=ref_cat['coord_ra'], dec=ref_cat['coord_dec'], unit='rad')
-    _, dist, _ = src.match_to_catalog_sky(ref)
-    return dist.milliarcsecond
+    matcher = SkyMatcher(ref_cat['coord_ra'], ref_cat['coord_dec'])
+    _, _, dist = matcher.nearest(src_cat['coord_ra'][mag_sel],
+                                 src_cat['coord_dec'][mag_sel])
+    return np.degrees(dist)*3600.*1000.
 
 if __name__ == '__main__':
     import sys
@@ -122,7 +157,7 @@ if __name__ == '__main__':
     dataId = dict(visit=int(visit), raftName=raft, detectorName=sensor)
     calexp = butler.get('calexp', dataId=dataId)
     src = butler.get('src', dataId=dataId)
-    xref, yref, my_ref_cat = ref_cat.get_pixel_coords(dataId)
+    xref, yref, my_ref_cat = ref_cat.get_pixel_coords(dataId, calexp=calexp)
 
     show_mask = False
     show_mask = True
@@ -0,0 +1,104 @@
+"""
+Unit tests for the resumable catalog loader.
+"""
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from desc.simulation_tools.catalog_loader import split_primary_key, \
+    SqliteBackend, PservBackend, CatalogLoader
+
+class RecordingConnection:
+    """Stand-in for a MySQLdb connection that records the statements."""
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+    def cursor(self):
+        return self
+    def execute(self, sql, params):
+        self.statements.append((sql, params))
+    def fetchall(self):
+        return ()
+    def close(self):
+        pass
+    def commit(self):
+        self.commits += 1
+
+class StandInDbConnection:
+    """Stand-in for a desc.pserv.DbConnection."""
+    def __init__(self):
+        self._mysql_connection = RecordingConnection()
+
+class CatalogLoaderTestCase(unittest.TestCase):
+    "Test case class for CatalogLoader class."
+    def setUp(self):
+        self.db_file = tempfile.mkstemp(suffix='.db')[1]
+        self.schema_script = tempfile.mkstemp(suffix='.sql')[1]
+        with open(self.schema_script, 'w') as output:
+            output.write("create table if not exists CoaddObject (\n")
+            output.write("       id BIGINT,\n")
+            output.write("       flux DOUBLE,\n")
+            output.write("       flag TINYINT(1),\n")
+            output.write("       tract INT,\n")
+            output.write("       patch CHAR(2),\n")
+            output.write("       primary key (id, tract, patch)\n")
+            output.write("       )\n")
+
+    def tearDown(self):
+        for item in (self.db_file, self.schema_script):
+            os.remove(item)
+
+    @staticmethod
+    def make_df(tract, patch, nrows, offset=0.):
+        return pd.DataFrame(dict(id=np.arange(nrows, dtype=np.int64),
+                                 flux=np.arange(nrows) + offset,
+                                 flag=np.arange(nrows) % 2,
+                                 tract=tract,
+                                 patch=patch.replace(',', '')))
+
+    def test_split_primary_key(self):
+        with open(self.schema_script) as fd:
+            ddl, key_columns = split_primary_key(fd.read())
+        self.assertEqual(key_columns, ['id', 'tract', 'patch'])
+        self.assertNotIn('primary key', ddl)
+
+    def test_load(self):
+        backend = SqliteBackend(self.db_file, max_variables=20)
+        loader = CatalogLoader(backend, 'CoaddObject', self.schema_script)
+        self.assertTrue(loader.load(self.make_df(4638, '0,1', 1003),
+                                    4638, '0,1'))
+        self.assertTrue(loader.load(self.make_df(4638, '2,2', 10), 4638, '2,2'))
+        self.assertTrue(loader.is_loaded(4638, '0,1'))
+        self.assertFalse(loader.is_loaded(4638, '1,1'))
+
+        # Unchanged data are skipped; changed data replace the old rows.
+        self.assertFalse(loader.load(self.make_df(4638, '2,2', 10),
+                                     4638, '2,2'))
+        self.assertTrue(loader.load(self.make_df(4638, '2,2', 5, offset=1),
+                                    4638, '2,2'))
+        loader.finalize()
+        self.assertEqual(backend.execute('select count(*) from CoaddObject')[0][0],
+                         1008)
+        self.assertEqual(backend.execute("select sum(flux) from CoaddObject "
+                                         "where patch='22'")[0][0], 15)
+        indexes = backend.execute("select name from sqlite_master where "
+                                  "type='index' and tbl_name='CoaddObject'")
+        self.assertIn(('CoaddObject_pkey',), indexes)
+        backend.close()
+
+    def test_pserv_parameters(self):
+        conn = StandInDbConnection()
+        backend = PservBackend(conn)
+        backend.set_manifest('CoaddObject_manifest', np.int64(4638),
+                             "0'1", 'done', 'abc', np.int32(10))
+        sql, params = conn._mysql_connection.statements[0]
+        self.assertEqual(sql, 'replace into CoaddObject_manifest '
+                         'values (%s, %s, %s, %s, %s)')
+        # The values are passed to the driver, not formatted into the sql.
+        self.assertEqual(params, (4638, "0'1", 'done', 'abc', 10))
+        self.assertIs(type(params[0]), int)
+        self.assertEqual(conn._mysql_connection.commits, 1)
+
+if __name__ == '__main__':
+    unittest.main()
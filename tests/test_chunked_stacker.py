@@ -0,0 +1,46 @@
+"""
+Unit tests for out-of-core image stacking.
+"""
+import os
+import unittest
+import numpy as np
+from desc.simulation_tools.chunked_stacker import ChunkedStacker, clipped_mean
+
+class ChunkedStackerTestCase(unittest.TestCase):
+    "Test case class for ChunkedStacker class."
+    def setUp(self):
+        np.random.seed(42)
+        self.frames = np.random.normal(100., 5., size=(9, 37, 20))
+        # Add outliers and masked pixels.
+        self.frames[0, 3, 4] = 1e4
+        self.mask = np.zeros(self.frames.shape, dtype=bool)
+        self.mask[:, 5, 6] = True
+        self.mask[1:4, 7, 8] = True
+
+    def test_stack(self):
+        with ChunkedStacker(self.frames.shape[1:]) as stacker:
+            for frame, mask in zip(self.frames, self.mask):
+                stacker.add(frame, mask=mask)
+            self.assertEqual(len(stacker), 9)
+            scratch_dir = stacker.scratch_dir
+            expected = np.where(self.mask, np.nan, self.frames)
+            # A budget of a few rows forces multiple row blocks.
+            budget = 3*stacker.rows_per_block(1)*4*8*9*20
+            self.assertEqual(stacker.rows_per_block(budget), 3)
+            median, counts = stacker.stack('median', memory_budget=budget)
+            np.testing.assert_allclose(median[:5],
+                                       np.nanmedian(expected, axis=0)[:5],
+                                       rtol=1e-6)
+            self.assertTrue(np.isnan(median[5, 6]))
+            self.assertEqual(counts[5, 6], 0)
+            self.assertEqual(counts[7, 8], 6)
+            meanclip, _ = stacker.stack('meanclip', memory_budget=budget)
+            self.assertLess(abs(meanclip[3, 4] - 100.), 10.)
+        self.assertFalse(os.path.exists(scratch_dir))
+
+    def test_clipped_mean(self):
+        data = np.array([1., 2., 3., 2., 1000., np.nan])
+        self.assertAlmostEqual(clipped_mean(data), 2.)
+
+if __name__ == '__main__':
+    unittest.main()
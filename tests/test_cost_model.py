@@ -0,0 +1,125 @@
+"""
+Unit tests for the imSim cost model.
+"""
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from desc.simulation_tools.cost_model import read_process_info, \
+    read_instcat_objects, fit_zero_point, CostModel
+
+class CostModelTestCase(unittest.TestCase):
+    "Test case class for CostModel class."
+    def setUp(self):
+        self.log_file = tempfile.mkstemp(suffix='.txt')[1]
+        np.random.seed(1001)
+        adu = np.random.uniform(1e2, 1e5, size=200)
+        galsimtypes = np.where(np.arange(200) % 4 == 0, 'sersic',
+                               'pointSource')
+        cputime = np.where(galsimtypes == 'sersic', 0.5 + 1e-4*adu,
+                           0.01 + 1e-5*adu)
+        cumtime = np.cumsum(cputime)
+        rss = np.linspace(1, 2, len(adu))
+        with open(self.log_file, 'w') as output:
+            for i in range(len(adu)):
+                output.write('%s  %s  %d  %s  %s  %s\n'
+                             % (cumtime[i], rss[i], i, adu[i], cputime[i],
+                                galsimtypes[i]))
+        self.adu = adu
+        self.galsimtypes = galsimtypes
+        self.cputime = cputime
+
+    def tearDown(self):
+        os.remove(self.log_file)
+
+    def test_fit(self):
+        process_info = read_process_info(self.log_file)
+        cost_model = CostModel().fit([process_info])
+        intercept, slope = cost_model.pars['sersic']
+        self.assertAlmostEqual(intercept, 0.5)
+        self.assertAlmostEqual(slope, 1e-4)
+        self.assertEqual(cost_model.cost_classes()[0][0], 'sersic')
+        self.assertAlmostEqual(cost_model.rss_peak, 2)
+
+        prediction = cost_model.predict(self.galsimtypes, self.adu,
+                                        processes=4)
+        self.assertAlmostEqual(prediction.cpu_time, sum(self.cputime))
+        self.assertAlmostEqual(prediction.wall_time, sum(self.cputime)/4.)
+        self.assertAlmostEqual(prediction.peak_memory, 8)
+        self.assertEqual(cost_model.suggest_processes(9, 68), 4)
+        self.assertRaises(KeyError, cost_model.predict, ['RandomWalk'], [1.])
+
+    def test_instcat(self):
+        instcat = os.path.join(os.path.dirname(__file__), 'tiny_instcat.txt')
+        ids, mag_norms, galsimtypes = read_instcat_objects(instcat)
+        self.assertEqual(len(ids), len(mag_norms))
+        self.assertEqual(galsimtypes[0], 'pointSource')
+
+        # Make a log with ADU values that follow a known zero point.
+        zero_point = 31.5
+        with open(self.log_file, 'w') as output:
+            for id_, mag_norm in zip(ids, mag_norms):
+                output.write('1  1  %d  %s  0.1  pointSource\n'
+                             % (id_, 10**(-0.4*(mag_norm - zero_point))))
+        process_info = read_process_info(self.log_file)
+        self.assertAlmostEqual(fit_zero_point(process_info, instcat),
+                               zero_point)
+
+    def test_includeobj(self):
+        instcat = os.path.join(os.path.dirname(__file__), 'tiny_instcat.txt')
+        with open(instcat) as fd:
+            lines = fd.readlines()
+        header = [x for x in lines if not x.startswith('object')]
+        objects = [x for x in lines if x.startswith('object')]
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # DC2-style catalog with the objects split over a plain and
+            # a gzipped include file.
+            os.mkdir(os.path.join(tmpdir, 'sub'))
+            with open(os.path.join(tmpdir, 'sub', 'stars.txt'), 'w') as fd:
+                fd.writelines(objects[:10])
+            with gzip.open(os.path.join(tmpdir, 'gals.txt.gz'), 'wt') as fd:
+                fd.writelines(objects[10:])
+            top = os.path.join(tmpdir, 'phosim_cat.txt')
+            with open(top, 'w') as fd:
+                fd.writelines(header)
+                fd.write('includeobj sub/stars.txt\n')
+                fd.write('includeobj gals.txt.gz\n')
+            expected = read_instcat_objects(instcat)
+            for values, expected_values in zip(read_instcat_objects(top),
+                                               expected):
+                np.testing.assert_array_equal(values, expected_values)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_non_negative_fit(self):
+        adu = np.linspace(2e4, 1e5, 50)
+        # The unconstrained fits have a negative slope and a negative
+        # intercept, respectively.
+        cputimes = {'sersic': 1.5 - 1e-5*adu, 'pointSource': 1e-5*adu - 0.1}
+        process_info = np.rec.fromarrays(
+            [np.concatenate((adu, adu)),
+             np.concatenate(list(cputimes.values())),
+             np.repeat(list(cputimes.keys()), len(adu)),
+             np.ones(2*len(adu))], names='ADU,cputime,galsimtype,RSS_mem')
+        cost_model = CostModel().fit([process_info])
+        # The constrained least-squares solutions.
+        intercept, slope = cost_model.pars['sersic']
+        self.assertAlmostEqual(intercept, np.mean(cputimes['sersic']))
+        self.assertEqual(slope, 0)
+        intercept, slope = cost_model.pars['pointSource']
+        self.assertEqual(intercept, 0)
+        cpu = cputimes['pointSource']
+        self.assertAlmostEqual(slope, np.sum(adu*cpu)/np.sum(adu**2))
+
+    def test_zero_cpu(self):
+        cost_model = CostModel()
+        cost_model.totals['sersic'] = 0.
+        galsimtype, cpu, fraction = cost_model.cost_classes()[0]
+        self.assertEqual(cpu, 0)
+        self.assertTrue(np.isnan(fraction))
+
+if __name__ == '__main__':
+    unittest.main()
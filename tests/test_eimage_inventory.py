@@ -0,0 +1,68 @@
+"""
+Unit tests for the eimage inventory.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from desc.simulation_tools.eimage_inventory import \
+    EimageInventory, parse_eimage_filename
+
+class EimageInventoryTestCase(unittest.TestCase):
+    "Test case class for EimageInventory class."
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.root_dir, 'inventory.sqlite')
+        for sensor in ('S11', 'S12'):
+            self.touch('DC2-R1-2p-WFD-r', '00', 219976, 2, sensor)
+        self.touch('DC2-R1-2p-WFD-i', '00', 219980, 3, 'S11')
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def touch(self, dataset, stream, visit, filter_num, sensor):
+        stream_dir = os.path.join(self.root_dir, dataset, 'output', stream)
+        os.makedirs(stream_dir, exist_ok=True)
+        filename = 'lsst_e_{}_f{}_R22_{}_E000.fits.gz'.format(visit, filter_num,
+                                                             sensor)
+        with open(os.path.join(stream_dir, filename), 'w') as output:
+            output.write('eimage')
+        # Make sure the directory mtime changes on coarse-grained
+        # filesystems.
+        os.utime(stream_dir, (0, os.stat(stream_dir).st_mtime + 1))
+
+    def test_parse_eimage_filename(self):
+        self.assertEqual(
+            parse_eimage_filename('/a/lsst_e_219976_f2_R22_S11_E000.fits.gz'),
+            (219976, 'r', 'R22', 'S11'))
+        self.assertIsNone(parse_eimage_filename('centroid_219976_R22_S11.txt'))
+
+    def test_refresh(self):
+        inventory = EimageInventory(self.db_file)
+        self.assertEqual(inventory.refresh(self.root_dir), (2, 3))
+        data = inventory.query(visit=219976)
+        self.assertEqual(list(data.sensor), ['S11', 'S12'])
+        self.assertEqual(set(data.filter), {'r'})
+        self.assertEqual(data['size'][0], 6)
+        self.assertEqual(len(inventory.query(pattern='lsst_e*S11*')), 2)
+
+        # Only the changed stream directory is rescanned.
+        self.assertEqual(inventory.refresh(self.root_dir), (0, 0))
+        self.touch('DC2-R1-2p-WFD-i', '00', 219980, 3, 'S12')
+        self.assertEqual(inventory.refresh(self.root_dir), (1, 2))
+        counts = inventory.visit_counts(dataset='DC2-R1-2p-WFD-i')
+        self.assertEqual(list(counts.num_sensors), [2])
+
+        # Refreshing a subset of the datasets leaves the others intact.
+        inventory.refresh(self.root_dir, 'DC2-R1-2p-WFD-i', force=True)
+        self.assertEqual(len(inventory.query()), 4)
+
+        # Removed directories are dropped from the inventory.
+        shutil.rmtree(os.path.join(self.root_dir, 'DC2-R1-2p-WFD-r'))
+        inventory.refresh(self.root_dir)
+        self.assertEqual(set(inventory.query().dataset), {'DC2-R1-2p-WFD-i'})
+        self.assertRaises(KeyError, inventory.query, exposure=1)
+        inventory.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+"""
+Unit tests for the image display helpers.
+"""
+import unittest
+import numpy as np
+from desc.simulation_tools.image_display import subsample_percentiles, \
+    downsample_factor, block_downsample, mask_rgba
+
+class ImageDisplayTestCase(unittest.TestCase):
+    "Test case class for image_display functions."
+    def test_subsample_percentiles(self):
+        np.random.seed(3003)
+        image = np.random.normal(100, 10, (2000, 2000)).astype(np.float32)
+        image[0, 0] = np.nan
+        vmin, vmed = subsample_percentiles(image, (0.1, 50),
+                                           max_samples=100000)
+        self.assertAlmostEqual(vmed, 100, delta=0.5)
+        self.assertAlmostEqual(vmin, 100 - 3.09*10, delta=2)
+
+    def test_block_downsample(self):
+        self.assertEqual(downsample_factor((4000, 4072), (800, 600)), 7)
+        self.assertEqual(downsample_factor((100, 100), (800, 600)), 1)
+        image = np.arange(42.).reshape(6, 7)
+        binned = block_downsample(image, 3)
+        self.assertEqual(binned.shape, (2, 2))
+        self.assertEqual(binned[0, 0], np.mean(image[:3, :3]))
+        mask = np.zeros((6, 7), dtype=np.int32)
+        mask[1, 1] = 1
+        mask[4, 5] = 4
+        binned = block_downsample(mask, 3, bitmask=True)
+        np.testing.assert_array_equal(binned, [[1, 0], [0, 4]])
+        self.assertIs(block_downsample(mask, 1), mask)
+
+    def test_mask_rgba(self):
+        mask = np.array([[0, 1], [2, 3]], dtype=np.int32)
+        rgba = mask_rgba(mask, [(1, (1, 0, 0)), (2, (0, 0, 1))], alpha=0.4)
+        self.assertEqual(rgba.dtype, np.uint8)
+        self.assertEqual(rgba.shape, (2, 2, 4))
+        np.testing.assert_array_equal(rgba[0, 0], [0, 0, 0, 0])
+        np.testing.assert_array_equal(rgba[0, 1], [255, 0, 0, 102])
+        np.testing.assert_array_equal(rgba[1, 0], [0, 0, 255, 102])
+        # The later plane takes precedence.
+        np.testing.assert_array_equal(rgba[1, 1], [0, 0, 255, 102])
+
+if __name__ == '__main__':
+    unittest.main()
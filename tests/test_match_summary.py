@@ -0,0 +1,46 @@
+"""
+Unit tests for the catalog match summary statistics.
+"""
+import unittest
+import numpy as np
+from desc.simulation_tools.match_summary import ra_offset, summary_stats
+
+class MatchSummaryTestCase(unittest.TestCase):
+    "Test case class for match_summary functions."
+    def test_ra_offset(self):
+        np.testing.assert_allclose(
+            ra_offset(np.radians([0.001, 359.999, 10.]),
+                      np.radians([359.999, 0.001, 9.])),
+            np.radians([0.002, -0.002, 1.]), atol=1e-12)
+
+    def test_summary_stats(self):
+        np.random.seed(6006)
+        nmatch = 1000
+        matched = dict(sep=np.random.uniform(0, 50, nmatch),
+                       dra=np.random.normal(5, 10, nmatch),
+                       ddec=np.random.normal(-3, 10, nmatch),
+                       dmag=np.random.exponential(0.1, nmatch))
+        stats = summary_stats(matched, 1200, 1500)
+        self.assertEqual((stats['num_drp'], stats['num_truth'],
+                          stats['num_matched']), (1200, 1500, nmatch))
+        self.assertAlmostEqual(stats['dra_mean'], 5, delta=1)
+        self.assertAlmostEqual(stats['ddec_std'], 10, delta=1)
+        self.assertAlmostEqual(stats['dra_skew'], 0, delta=0.3)
+        # Exponential distributions have skewness 2.
+        self.assertAlmostEqual(stats['dmag_skew'], 2, delta=0.5)
+        self.assertAlmostEqual(stats['dmag_median'], 0.1*np.log(2),
+                               delta=0.01)
+        self.assertEqual(stats['sep_median'], np.median(matched['sep']))
+
+        # Too few matches for the higher moments.
+        stats = summary_stats({key: values[:1] for key, values
+                               in matched.items()}, 10, 10)
+        self.assertEqual(stats['num_matched'], 1)
+        self.assertTrue(np.isnan(stats['dra_std']))
+        self.assertTrue(np.isnan(stats['dra_skew']))
+        stats = summary_stats({key: values[:0] for key, values
+                               in matched.items()}, 10, 10)
+        self.assertTrue(np.isnan(stats['dmag_median']))
+
+if __name__ == '__main__':
+    unittest.main()
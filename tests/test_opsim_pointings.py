@@ -0,0 +1,68 @@
+"""
+Unit tests for the bulk OpSim pointing interface.
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+import numpy as np
+from desc.simulation_tools.opsim_pointings import OpsimPointings
+
+class OpsimPointingsTestCase(unittest.TestCase):
+    "Test case class for OpsimPointings class."
+    def setUp(self):
+        self.opsim_db = tempfile.mkstemp(suffix='.db')[1]
+        self.cache_file = tempfile.mkstemp(suffix='.npz')[1]
+        os.remove(self.cache_file)
+        with sqlite3.connect(self.opsim_db) as conn:
+            conn.execute('CREATE TABLE Summary (obsHistID INTEGER, '
+                         'descDitheredRA REAL, descDitheredDec REAL, '
+                         'descDitheredRotTelPos REAL, expMJD REAL, '
+                         'filter TEXT, propID INTEGER)')
+            rows = [(i, 0.01*i, -0.5, 0.1, 59580. + i, 'ugrizy'[i % 6], 54)
+                    for i in range(1, 2001)]
+            # Visits shared by proposals have duplicate rows.
+            rows.append((10, 0.1, -0.5, 0.1, 59590., 'z', 55))
+            conn.executemany('INSERT INTO Summary VALUES (?,?,?,?,?,?,?)',
+                             rows)
+
+    def tearDown(self):
+        for item in (self.opsim_db, self.cache_file):
+            if os.path.isfile(item):
+                os.remove(item)
+
+    def test_load(self):
+        pointings = OpsimPointings(self.opsim_db, cache_file=self.cache_file)
+        # Lists longer than the sql variable limit are read in one query.
+        self.assertEqual(pointings.load(range(1500, 0, -1)), 1500)
+        self.assertEqual(pointings.load(id_range=(1400, 1600)), 100)
+        self.assertEqual(len(pointings), 1600)
+        self.assertTrue(np.all(np.diff(pointings.obsHistID) > 0))
+        self.assertIn(10, pointings)
+        self.assertNotIn(1700, pointings)
+
+        pointing = pointings.pointing(10)
+        self.assertAlmostEqual(pointing['ra'], np.degrees(0.1))
+        self.assertEqual(pointing['filter'], 'z')
+
+        # Missing visits are loaded on demand.
+        index = pointings.index([1700, 5])
+        self.assertEqual(list(pointings.obsHistID[index]), [1700, 5])
+        self.assertRaises(KeyError, pointings.index, 3000)
+
+        pointings.save()
+        cached = OpsimPointings(cache_file=self.cache_file)
+        self.assertEqual(len(cached), 1601)
+        np.testing.assert_array_equal(cached.mjd, pointings.mjd)
+        self.assertRaises(KeyError, cached.index, 1800)
+
+    def test_missing_db(self):
+        opsim_db = self.opsim_db + '_missing'
+        pointings = OpsimPointings(opsim_db)
+        self.assertRaises(FileNotFoundError, pointings.load, [1])
+        self.assertRaises(FileNotFoundError, pointings.index, [1])
+        self.assertFalse(os.path.exists(opsim_db))
+        self.assertRaises(FileNotFoundError, OpsimPointings().load)
+
+if __name__ == '__main__':
+    unittest.main()
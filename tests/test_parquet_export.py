@@ -0,0 +1,115 @@
+"""
+Unit tests for the Parquet export of patch catalogs.
+"""
+import shutil
+import tempfile
+import unittest
+import warnings
+from collections import namedtuple
+import numpy as np
+import pyarrow as pa
+from desc.simulation_tools.parquet_export import arrow_schema, \
+    catalog_to_table, write_patch_table, write_patch_catalog, read_catalog
+
+class StandInField:
+    """Minimal stand-in for lsst.afw.table.Field."""
+    def __init__(self, name, type_string, size=1):
+        self.name, self.type_string, self.size = name, type_string, size
+    def getName(self):
+        return self.name
+    def getTypeString(self):
+        return self.type_string
+    def getSize(self):
+        return self.size
+
+SchemaItem = namedtuple('SchemaItem', ['field'])
+
+class StandInCatalog:
+    """Dict-based stand-in for an afw SourceCatalog."""
+    def __init__(self, columns, schema):
+        self.columns = columns
+        self.schema = schema
+    def getSchema(self):
+        return self.schema
+    def isContiguous(self):
+        return True
+    def __getitem__(self, name):
+        return self.columns[name]
+    def __iter__(self):
+        nrows = len(next(iter(self.columns.values())))
+        for i in range(nrows):
+            yield {key: values[i] for key, values in self.columns.items()}
+
+class ParquetExportTestCase(unittest.TestCase):
+    "Test case class for parquet_export functions."
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_catalog_to_table(self):
+        schema = [SchemaItem(StandInField('id', 'L')),
+                  SchemaItem(StandInField('flux', 'D')),
+                  SchemaItem(StandInField('nchild', 'U')),
+                  SchemaItem(StandInField('name', 'String')),
+                  SchemaItem(StandInField('shape', 'ArrayF', 3)),
+                  SchemaItem(StandInField('cov', 'CovarianceF'))]
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            arrow = arrow_schema(schema)
+        self.assertEqual(len(caught), 1)
+        self.assertEqual(arrow.names, ['id', 'flux', 'nchild', 'name',
+                                       'shape'])
+        self.assertEqual(arrow.field('shape').type, pa.list_(pa.float32(), 3))
+        catalog = StandInCatalog(
+            dict(id=np.arange(2, dtype=np.int64), flux=np.array([1., 2.]),
+                 nchild=np.array([0, 3], dtype=np.uint16),
+                 name=['a', 'b'],
+                 shape=np.arange(6, dtype=np.float32).reshape(2, 3)), schema)
+        table = catalog_to_table(catalog)
+        self.assertEqual(table.column('name').to_pylist(), ['a', 'b'])
+        self.assertEqual(table.column('shape').to_pylist(),
+                         [[0, 1, 2], [3, 4, 5]])
+        # Contiguous numeric columns are not copied.
+        self.assertEqual(table.column('flux').chunk(0).buffers()[1].address,
+                         catalog['flux'].ctypes.data)
+
+    def test_round_trip(self):
+        # Patches that map to the same partition if the comma is dropped.
+        patches = ('1,10', '11,0', '2,2')
+        for i, patch in enumerate(patches):
+            table = pa.Table.from_pydict(dict(id=np.arange(3) + 10*i,
+                                              flux=np.ones(3)*i))
+            write_patch_table(table, self.root, 4638, patch)
+        df = read_catalog(self.root)
+        self.assertEqual(len(df), 9)
+        self.assertNotIn('band', df.columns)
+        df = read_catalog(self.root, columns=['id'], patches=['1,10'])
+        self.assertEqual(list(df['id']), [0, 1, 2])
+        df = read_catalog(self.root, tracts=[4638], patches=['11,0'])
+        self.assertEqual(list(df['flux']), [1, 1, 1])
+
+    def test_band_partitions(self):
+        for band in 'gr':
+            table = pa.Table.from_pydict(dict(mag=[20., 21.]))
+            write_patch_table(table, self.root, 4638, '1,10', band=band)
+        df = read_catalog(self.root, bands=['r'], patches=['1,10'])
+        self.assertEqual(list(df['band']), ['r', 'r'])
+        self.assertEqual(len(read_catalog(self.root)), 4)
+
+    def test_export_bands(self):
+        schema = [SchemaItem(StandInField('id', 'L')),
+                  SchemaItem(StandInField('mag', 'D'))]
+        for i, band in enumerate('gr'):
+            catalog = StandInCatalog(
+                dict(id=np.arange(3, dtype=np.int64),
+                     mag=np.full(3, 20. + i)), schema)
+            write_patch_catalog(catalog, self.root, 4638, '1,10', band=band)
+        df = read_catalog(self.root)
+        self.assertEqual(len(df), 6)
+        for i, band in enumerate('gr'):
+            self.assertEqual(list(df['mag'][df['band'] == band]), 3*[20. + i])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Unit tests for the imSim performance comparisons.
+"""
+import os
+import tempfile
+import unittest
+import numpy as np
+from desc.simulation_tools.perf_compare import load_run, bootstrap_ratio, \
+    aggregate_by_id, compare_runs, text_report
+
+class PerfCompareTestCase(unittest.TestCase):
+    "Test case class for perf_compare functions."
+    def setUp(self):
+        self.log_files = []
+
+    def tearDown(self):
+        for item in self.log_files:
+            os.remove(item)
+
+    def write_log(self, ids, cputime, galsimtypes, peak_rss=1.):
+        log_file = tempfile.mkstemp(suffix='.txt')[1]
+        self.log_files.append(log_file)
+        rss = np.linspace(0.5, peak_rss, len(ids))
+        with open(log_file, 'w') as output:
+            for i, (obj_id, cpu, galsimtype) \
+                    in enumerate(zip(ids, cputime, galsimtypes)):
+                output.write('%s  %s  %d  %s  %s  %s\n'
+                             % (np.sum(cputime[:i + 1]), rss[i], obj_id,
+                                1e3, cpu, galsimtype))
+        return log_file
+
+    def test_bootstrap_ratio(self):
+        np.random.seed(4004)
+        baseline = np.random.uniform(1, 2, 500)
+        delta, ci_low, ci_high = bootstrap_ratio(baseline, 1.2*baseline,
+                                                 paired=True, seed=1)
+        self.assertAlmostEqual(delta, 0.2)
+        self.assertAlmostEqual(ci_low, 0.2)
+        self.assertAlmostEqual(ci_high, 0.2)
+        delta, ci_low, ci_high \
+            = bootstrap_ratio(baseline, np.random.uniform(1, 2, 400),
+                              nboot=250, seed=1)
+        self.assertLess(ci_low, delta)
+        self.assertLess(delta, ci_high)
+        # The 95% interval width is about 4 times the standard error of
+        # the ratio of the means, ~0.013.
+        self.assertAlmostEqual(ci_high - ci_low, 0.05, delta=0.015)
+
+    def test_compare_runs(self):
+        np.random.seed(5005)
+        nobj = 200
+        ids = np.arange(nobj)
+        galsimtypes = np.where(ids % 2 == 0, 'sersic', 'pointSource')
+        cputime = np.random.uniform(0.1, 0.2, nobj)
+        baseline = load_run([self.write_log(ids, cputime, galsimtypes)])
+        # Sersic objects are 30% slower in the candidate run.
+        slower = np.where(galsimtypes == 'sersic', 1.3, 1.)*cputime
+        candidate = load_run([self.write_log(ids[::-1], slower[::-1],
+                                             galsimtypes[::-1], peak_rss=2.)])
+        comparisons = {(x.group, x.quantity): x for x in
+                       compare_runs(baseline, candidate, nboot=200, seed=1)}
+        self.assertTrue(comparisons[('sersic', 'cputime')].regression)
+        self.assertAlmostEqual(comparisons[('sersic', 'cputime')].delta, 0.3)
+        self.assertFalse(comparisons[('pointSource', 'cputime')].regression)
+        # A single log per run gives no peak RSS confidence interval.
+        rss = comparisons[('all', 'peak_RSS')]
+        self.assertAlmostEqual(rss.delta, 1.)
+        self.assertTrue(np.isnan(rss.ci_low))
+        self.assertFalse(rss.regression)
+        self.assertIn('n/a', text_report(list(comparisons.values())))
+
+    def test_duplicate_ids(self):
+        # Objects 0-9 were drawn on two sensors in both runs.
+        ids = np.concatenate((np.arange(50), np.arange(10)))
+        galsimtypes = np.array(60*['sersic'])
+        cputime = np.ones(60)
+        data = load_run([self.write_log(ids, cputime, galsimtypes)])[0]
+        aggregated = aggregate_by_id(data)
+        self.assertEqual(len(aggregated), 50)
+        self.assertEqual(list(aggregated['cputime'][:11]), 10*[2.] + [1.])
+
+        baseline = load_run([self.write_log(ids, cputime, galsimtypes),
+                             self.write_log(ids, cputime, galsimtypes)])
+        candidate = load_run([self.write_log(ids, 2*cputime, galsimtypes),
+                              self.write_log(ids, 2*cputime, galsimtypes)])
+        comparison = compare_runs(baseline, candidate, nboot=100, seed=1)[0]
+        self.assertEqual(comparison.nobj, 50)
+        self.assertAlmostEqual(comparison.delta, 1.)
+        self.assertAlmostEqual(comparison.baseline, 2.*60/50)
+
+    def test_changed_galsimtype(self):
+        # Some objects have a different galsimtype in the candidate run.
+        ids = np.arange(40)
+        base_types = np.where(ids < 20, 'sersic', 'pointSource')
+        cand_types = np.where(ids < 25, 'sersic', 'pointSource')
+        cputime = np.linspace(1, 2, 40)
+        baseline = load_run([self.write_log(ids, cputime, base_types)])
+        candidate = load_run([self.write_log(ids[::-1], 2*cputime[::-1],
+                                             cand_types[::-1])])
+        comparisons = {x.group: x for x in
+                       compare_runs(baseline, candidate, nboot=100, seed=1)
+                       if x.quantity == 'cputime'}
+        self.assertEqual(comparisons['sersic'].nobj, 20)
+        self.assertEqual(comparisons['pointSource'].nobj, 20)
+        for comparison in comparisons.values():
+            self.assertAlmostEqual(comparison.delta, 1.)
+            self.assertAlmostEqual(comparison.ci_low, 1.)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+"""
+Unit tests for bounded prefetching.
+"""
+import time
+import threading
+import unittest
+from desc.simulation_tools.prefetch import prefetch_map
+
+class PrefetchMapTestCase(unittest.TestCase):
+    "Test case class for prefetch_map function."
+    def test_prefetch_map(self):
+        lock = threading.Lock()
+        started = []
+
+        def load(x):
+            with lock:
+                started.append(x)
+            time.sleep(0.01)
+            return x*x
+
+        results = []
+        for i, result in enumerate(prefetch_map(load, range(10), depth=3)):
+            # No more than depth items are loaded ahead of the consumer.
+            self.assertLessEqual(len(started), i + 1 + 3)
+            results.append(result)
+        self.assertEqual(results, [x*x for x in range(10)])
+
+    def test_exception(self):
+        def load(x):
+            if x == 2:
+                raise ValueError(x)
+            return x
+        results = prefetch_map(load, range(5), depth=2)
+        self.assertEqual(next(results), 0)
+        self.assertEqual(next(results), 1)
+        self.assertRaises(ValueError, next, results)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+Unit tests for ProcessTracker, its stack sampler, and metrics exporter.
+"""
+import os
+import time
+import socket
+import tempfile
+import unittest
+from desc.simulation_tools.process_tracker import ProcessTracker, StackSampler
+from desc.simulation_tools.metrics_exporter import MetricsExporter, \
+    per_process_path
+
+def busy_wait(dt):
+    tstart = time.time()
+    while time.time() - tstart < dt:
+        pass
+
+class ProcessTrackerTestCase(unittest.TestCase):
+    "Test case class for ProcessTracker class."
+    def setUp(self):
+        self.outfile = tempfile.mkstemp(suffix='.txt')[1]
+
+    def tearDown(self):
+        for item in (self.outfile, self.outfile + '.folded',
+                     per_process_path(self.outfile + '.prom')):
+            if os.path.isfile(item):
+                os.remove(item)
+
+    def test_write(self):
+        tracker = ProcessTracker(self.outfile)
+        tracker.write(1, 'pointSource')
+        del tracker
+        with open(self.outfile) as fd:
+            tokens = fd.readline().split()
+        self.assertEqual(len(tokens), 4)
+        self.assertEqual(tokens[-1], 'pointSource')
+
+    def test_profiler(self):
+        tracker = ProcessTracker(self.outfile, profile_rate=500)
+        busy_wait(0.2)
+        tracker.stop_profiler()
+        with open(self.outfile + '.folded') as fd:
+            lines = fd.readlines()
+        self.assertTrue(any('busy_wait' in line for line in lines))
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(stack.startswith('MainThread;'))
+            self.assertGreater(int(count), 0)
+
+    def test_profiler_pid(self):
+        # The stacks of other processes can't be sampled.
+        self.assertRaises(ValueError, ProcessTracker, self.outfile,
+                          pid=os.getppid(), profile_rate=100)
+        tracker = ProcessTracker(self.outfile, pid=os.getppid())
+        tracker.write(1, 'pointSource')
+        del tracker
+
+    def test_bounded_stacks(self):
+        sampler = StackSampler(rate=500, max_stacks=1)
+        sampler.counts['a;b'] = 1
+        sampler.start()
+        busy_wait(0.1)
+        sampler.stop()
+        self.assertEqual(len(sampler.counts), 2)
+        self.assertGreater(sampler.nsamples, 0)
+        self.assertIn(StackSampler.overflow_key, sampler.counts)
+
+    def test_metrics_file(self):
+        metrics_file = self.outfile + '.prom'
+        tracker = ProcessTracker(self.outfile, metrics_file=metrics_file,
+                                 num_objects=4, metrics_interval=0)
+        for i in range(2):
+            tracker.write(i, 'pointSource')
+        # Each process writes to its own file.
+        self.assertFalse(os.path.exists(metrics_file))
+        with open(per_process_path(metrics_file)) as fd:
+            lines = fd.readlines()
+        self.assertIn('# TYPE imsim_objects_done_total counter\n', lines)
+        self.assertIn('# TYPE imsim_cpu_seconds_total counter\n', lines)
+        values = dict(line.split() for line in lines
+                      if not line.startswith('#'))
+        key = 'imsim_objects_done_total{pid="%d"}' % os.getpid()
+        self.assertEqual(float(values[key]), 2)
+        self.assertIn('imsim_eta_seconds{pid="%d"}' % os.getpid(), values)
+
+    def test_per_process_path(self):
+        self.assertEqual(per_process_path('/tmp/imsim.prom', 12),
+                         '/tmp/imsim.12.prom')
+        self.assertEqual(per_process_path('/tmp/imsim_{pid}.prom', 12),
+                         '/tmp/imsim_12.prom')
+        self.assertEqual(per_process_path('imsim.prom'),
+                         'imsim.%d.prom' % os.getpid())
+
+    def test_metrics_socket(self):
+        socket_path = tempfile.mktemp(suffix='.sock')
+        exporter = MetricsExporter(socket_path=socket_path)
+        exporter.update([(dict(pid=1), dict(rss_bytes=10))])
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(socket_path)
+        text = client.makefile().read()
+        client.close()
+        exporter.close()
+        self.assertIn('imsim_rss_bytes{pid="1"} 10.0', text)
+        self.assertFalse(os.path.exists(socket_path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""
+Unit tests for the eimage sky-level survey.
+"""
+import os
+import tempfile
+import unittest
+import numpy as np
+import astropy.io.fits as fits
+from desc.simulation_tools.sensor_sky_levels import robust_sky_level, \
+    sky_level, SensorSkyLevel
+
+class SensorSkyLevelsTestCase(unittest.TestCase):
+    "Test case class for sensor_sky_levels functions."
+    def setUp(self):
+        np.random.seed(8008)
+        self.eimage_file = tempfile.mkstemp(suffix='.fits.gz')[1]
+        pixels = np.random.normal(1000., 30., (400, 408)).astype(np.float32)
+        # Bright sources that a mean would be biased by.
+        pixels[::50, ::50] += 1e5
+        hdu = fits.PrimaryHDU(pixels)
+        hdu.header['CHIPID'] = 'R22_S11'
+        hdu.header['FILTER'] = 2
+        hdu.header['OBSID'] = 219976
+        hdu.header['BRANCH'] = '/phosim/v3.7.9'
+        hdu.writeto(self.eimage_file, overwrite=True)
+
+    def tearDown(self):
+        os.remove(self.eimage_file)
+
+    def test_robust_sky_level(self):
+        pixels = np.random.normal(500., 20., 10000)
+        pixels[:100] = 1e6
+        median, error = robust_sky_level(pixels)
+        self.assertAlmostEqual(median, 500., delta=1.)
+        self.assertAlmostEqual(error, 1.2533*20./100., delta=0.03)
+
+    def test_sky_level(self):
+        header, level, error = sky_level(self.eimage_file, stride=4)
+        self.assertEqual(header['OBSID'], 219976)
+        self.assertAlmostEqual(level, 1000., delta=3*error)
+        # 100 x 102 sampled pixels.
+        self.assertAlmostEqual(error, 1.2533*30./np.sqrt(100*102),
+                               delta=0.05)
+        record = SensorSkyLevel(stride=4)(self.eimage_file)
+        self.assertEqual(record[:4], (2, 219976, 'R22', 'S11'))
+        self.assertEqual(record[5], 'v3.7.9')
+        self.assertEqual(record[4], level)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Unit tests for the sensor-visit sky level db.
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+from desc.simulation_tools.sensor_visit_db import SensorVisitDb
+
+class SensorVisitDbTestCase(unittest.TestCase):
+    "Test case class for SensorVisitDb class."
+    def setUp(self):
+        self.db_file = tempfile.mkstemp(suffix='.sqlite')[1]
+        self.txt_file = tempfile.mkstemp(suffix='.txt')[1]
+        self.write_txt_file([('r', 219976, 'R22', 'S11', 1510.5),
+                             ('r', 219976, 'R22', 'S12', 1520.),
+                             ('i', 219980, 'R22', 'S11', 2100.)])
+
+    def tearDown(self):
+        for item in (self.db_file, self.txt_file):
+            os.remove(item)
+
+    def write_txt_file(self, rows):
+        with open(self.txt_file, 'w') as output:
+            for row in rows:
+                output.write('  '.join(str(x) for x in row) + '  v3.7.9\n')
+
+    def test_ingest(self):
+        db = SensorVisitDb(self.db_file)
+        self.assertEqual(db.ingest([self.txt_file]), 3)
+        self.assertEqual(db.sky_levels_by_visit(219976),
+                         {('R22', 'S11'): 1510.5, ('R22', 'S12'): 1520.})
+        self.assertEqual(db.sky_levels_by_sensor('R22', 'S11', filter_='i'),
+                         {219980: 2100.})
+
+        # Re-ingesting an unchanged file is a no-op.
+        self.assertEqual(db.ingest([self.txt_file]), 0)
+        self.assertEqual(len(db.query()), 3)
+
+        # A changed file replaces its previous rows.
+        self.write_txt_file([('r', 219976, 'R22', 'S11', 1500.)])
+        self.assertEqual(db.ingest([self.txt_file]), 1)
+        data = db.query()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data.sky_level[0], 1500.)
+        self.assertRaises(KeyError, db.query, exposure=1)
+        db.close()
+
+    def test_migrate(self):
+        # Table written by the original 6-column ingest script from the
+        # same file, plus a row from another file.
+        with sqlite3.connect(self.db_file) as conn:
+            conn.execute('CREATE TABLE sensor_visit_info (filter TEXT, '
+                         'visit INTEGER, raft TEXT, sensor TEXT, '
+                         'sky_level REAL, phosim_version TEXT)')
+            with open(self.txt_file) as fd:
+                rows = [line.split() for line in fd]
+            rows.append(['r', 100, 'R01', 'S00', 1000., 'v3.7.9'])
+            conn.executemany('INSERT INTO sensor_visit_info '
+                             'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        db = SensorVisitDb(self.db_file)
+        self.assertEqual(len(db.query()), 4)
+        # Re-ingesting the file replaces the legacy rows from it.
+        self.assertEqual(db.ingest([self.txt_file]), 3)
+        self.assertEqual(len(db.query()), 4)
+        self.assertEqual(db.ingest([self.txt_file]), 0)
+        self.assertEqual(db.sky_levels_by_visit(219976),
+                         {('R22', 'S11'): 1510.5, ('R22', 'S12'): 1520.})
+        db.close()
+
+        db = SensorVisitDb(self.db_file)
+        self.write_txt_file([('r', 219976, 'R22', 'S11', 1500.)])
+        self.assertEqual(db.ingest([self.txt_file]), 1)
+        self.assertEqual(db.sky_levels_by_visit(100), {('R01', 'S00'): 1000.})
+        self.assertEqual(len(db.query()), 2)
+        db.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Unit tests for incremental sky-flat accumulation.
+"""
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from desc.simulation_tools.sky_flat_accumulator import SkyFlatAccumulator
+
+class SkyFlatAccumulatorTestCase(unittest.TestCase):
+    "Test case class for SkyFlatAccumulator class."
+    def setUp(self):
+        np.random.seed(7)
+        self.state_dir = tempfile.mkdtemp()
+        self.shape = (30, 20)
+        # Vignetting-like flat with per-frame sky levels.
+        y, x = np.mgrid[:self.shape[0], :self.shape[1]]
+        self.flat = 1. - 0.05*((x - 10.)**2 + (y - 15.)**2)/325.
+        self.frames = []
+        for sky in np.random.uniform(900, 1100, 12):
+            pixels = sky*self.flat + np.random.normal(0, 3., self.shape)
+            self.frames.append((pixels, np.median(pixels)))
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def test_accumulate(self):
+        accumulator = SkyFlatAccumulator(self.state_dir, shape=self.shape,
+                                         rows_per_block=7)
+        mask = np.zeros(self.shape, dtype=bool)
+        mask[2, 3] = True
+        for i, (pixels, median) in enumerate(self.frames[:8]):
+            accumulator.add_frame(str(i), pixels, median, mask=mask)
+        accumulator.save()
+        self.assertRaises(KeyError, accumulator.add_frame, '0',
+                          *self.frames[0])
+
+        # Reopen the state and fold in the remaining frames.
+        accumulator = SkyFlatAccumulator(self.state_dir, rows_per_block=7)
+        self.assertEqual(len(accumulator.frame_ids), 8)
+        for i, (pixels, median) in enumerate(self.frames[8:], 8):
+            accumulator.add_frame(str(i), pixels, median)
+        medians = np.array([x[1] for x in self.frames])
+        ratios = np.array([x[0]/x[1] for x in self.frames])
+
+        flat, counts = accumulator.flat('mean')
+        self.assertEqual(counts[2, 3], 4)
+        self.assertEqual(counts[0, 0], 12)
+        np.testing.assert_allclose(flat[0], np.mean(medians)
+                                   *np.mean(ratios[:, 0], axis=0))
+
+        # Histogram-based estimates agree to within the bin resolution.
+        edges = accumulator.bin_edges()
+        for statistic in ('median', 'meanclip'):
+            flat, _ = accumulator.flat(statistic)
+            expected = accumulator.sky_level(statistic)*np.median(ratios,
+                                                                   axis=0)
+            self.assertLess(np.max(np.abs(flat - expected)/expected),
+                            edges[1] - edges[0])
+
+        # Removing a frame restores the previous state.
+        sums = np.array(accumulator.sums)
+        hist = np.array(accumulator.hist)
+        accumulator.add_frame('extra', *self.frames[0])
+        accumulator.remove_frame('extra', self.frames[0][0])
+        np.testing.assert_allclose(accumulator.sums, sums)
+        np.testing.assert_array_equal(accumulator.hist, hist)
+        self.assertNotIn('extra', accumulator)
+
+    def test_out_of_range(self):
+        accumulator = SkyFlatAccumulator(self.state_dir, shape=self.shape,
+                                         nbins=20, r_range=(0.9, 1.1))
+        # Strongly vignetted column, with r ~ 0.6.
+        ratios = []
+        for i, (pixels, median) in enumerate(self.frames):
+            pixels = pixels.copy()
+            pixels[:, 0] *= 0.6
+            ratios.append(pixels/median)
+            accumulator.add_frame(str(i), pixels, median)
+        ratios = np.array(ratios)
+        self.assertTrue(np.all(accumulator.out_of_range()[:, 0] == 12))
+        self.assertTrue(np.all(accumulator.out_of_range()[:, 1:] == 0))
+        for statistic in ('median', 'meanclip'):
+            flat, _ = accumulator.flat(statistic)
+            expected = accumulator.sky_level(statistic)*np.median(ratios,
+                                                                   axis=0)
+            # Not clamped to the histogram range.
+            self.assertLess(np.max(np.abs(flat - expected)/expected), 0.01)
+
+        # A minority of out-of-range values does not bias the median.
+        pixels, median = self.frames[0]
+        pixels = pixels.copy()
+        pixels[:, 1] = 0
+        accumulator.add_frame('low', pixels, median)
+        self.assertTrue(np.all(accumulator.below[:, 1] == 1))
+        flat, _ = accumulator.flat('median')
+        expected = accumulator.sky_level('median')*np.median(
+            np.vstack((ratios, [pixels/median])), axis=0)
+        self.assertLess(np.max(np.abs(flat[:, 1] - expected[:, 1])
+                               /expected[:, 1]), 0.01)
+
+if __name__ == '__main__':
+    unittest.main()
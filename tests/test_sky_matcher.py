@@ -0,0 +1,76 @@
+"""
+Unit tests for the KD-tree sky matcher.
+"""
+import unittest
+import numpy as np
+from desc.simulation_tools.sky_matcher import SkyMatcher, unit_vectors
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """Haversine separation of coordinates in degrees."""
+    ra1, dec1, ra2, dec2 = [np.radians(x) for x in (ra1, dec1, ra2, dec2)]
+    hav = (np.sin((dec2 - dec1)/2.)**2
+           + np.cos(dec1)*np.cos(dec2)*np.sin((ra2 - ra1)/2.)**2)
+    return np.degrees(2.*np.arcsin(np.sqrt(hav)))
+
+class SkyMatcherTestCase(unittest.TestCase):
+    "Test case class for SkyMatcher class."
+    def setUp(self):
+        np.random.seed(1001)
+        # Reference objects straddling ra=0.
+        nref = 2000
+        self.ref_ra = np.random.uniform(-1, 1, nref) % 360.
+        self.ref_dec = np.random.uniform(-30, -28, nref)
+        self.ref_mags = np.random.uniform(18, 25, nref)
+        # Sources offset by up to ~0.5 arcsec from the first 500 objects.
+        nsrc = 500
+        self.src_ra = self.ref_ra[:nsrc] + np.random.normal(0, 1e-4, nsrc)
+        self.src_dec = self.ref_dec[:nsrc] + np.random.normal(0, 1e-4, nsrc)
+        self.src_mags = self.ref_mags[:nsrc] + 0.01
+
+    def test_unit_vectors(self):
+        xyz = unit_vectors([0, 90], [0, 0], degrees=True)
+        np.testing.assert_allclose(xyz, [[1, 0, 0], [0, 1, 0]], atol=1e-15)
+
+    def test_nearest(self):
+        matcher = SkyMatcher(self.ref_ra, self.ref_dec, mags=self.ref_mags,
+                             degrees=True, chunk_size=100, processes=3)
+        matches = matcher.nearest(self.src_ra, self.src_dec, max_sep=1./3600.)
+        # Brute force comparison.
+        for i, j, sep in zip(*matches):
+            seps = angular_separation(self.src_ra[i], self.src_dec[i],
+                                      self.ref_ra, self.ref_dec)
+            self.assertEqual(np.argmin(seps), j)
+            self.assertAlmostEqual(seps[j], sep, places=10)
+        self.assertGreater(len(matches.src_index), 490)
+
+        # The magnitude constraint excludes the true counterparts.
+        matches = matcher.nearest(self.src_ra, self.src_dec,
+                                  max_sep=1./3600., mags=self.src_mags + 1,
+                                  max_dmag=0.5)
+        self.assertTrue(all(matches.ref_index != matches.src_index))
+        self.assertRaises(ValueError, matcher.nearest, self.src_ra,
+                          self.src_dec, max_dmag=0.5)
+
+    def test_within(self):
+        matcher = SkyMatcher(self.ref_ra, self.ref_dec, mags=self.ref_mags,
+                             degrees=True, chunk_size=128, processes=2)
+        radius = 0.05
+        matches = matcher.within(self.src_ra, self.src_dec, radius)
+        for i in (0, 10, 499):
+            seps = angular_separation(self.src_ra[i], self.src_dec[i],
+                                      self.ref_ra, self.ref_dec)
+            expected = set(np.where(seps < radius)[0])
+            self.assertEqual(set(matches.ref_index[matches.src_index == i]),
+                             expected)
+        sel = matches.src_index == 0
+        self.assertTrue(all(np.diff(matches.separation[sel]) >= 0))
+
+        constrained = matcher.within(self.src_ra, self.src_dec, radius,
+                                     mags=self.src_mags, max_dmag=0.1)
+        self.assertTrue(all(np.abs(self.ref_mags[constrained.ref_index]
+                                   - self.src_mags[constrained.src_index])
+                            < 0.1))
+        self.assertLess(len(constrained.src_index), len(matches.src_index))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Unit tests for the skymap footprint index.
+"""
+import os
+import tempfile
+import unittest
+import numpy as np
+from desc.simulation_tools.skymap_index import SkyMapIndex, pixel_to_sky
+
+class ArrayWcs:
+    """Linear stand-in for a SkyWcs with pixelToSkyArray."""
+    def __init__(self):
+        self.ncalls = 0
+    def pixelToSkyArray(self, x, y, degrees=False):
+        self.ncalls += 1
+        return 50. + x/3600., -30. + y/3600.
+
+class SkyMapIndexTestCase(unittest.TestCase):
+    "Test case class for SkyMapIndex class."
+    def setUp(self):
+        # Two tracts of 2x2 patches of 1x1 deg, one straddling RA=0,
+        # with 0.1 deg overlaps between the outer patch boundaries.
+        columns = dict(tract=[], patch_x=[], patch_y=[], ra_corners=[],
+                       dec_corners=[], ra_inner=[], dec_inner=[])
+        for tract, ra0 in ((0, 359.), (1, 50.)):
+            for x in range(2):
+                for y in range(2):
+                    ra = (ra0 + x + np.array([0, 1, 1, 0])) % 360.
+                    dec = -30. + y + np.array([0, 0, 1, 1])
+                    columns['tract'].append(tract)
+                    columns['patch_x'].append(x)
+                    columns['patch_y'].append(y)
+                    columns['ra_inner'].append(ra)
+                    columns['dec_inner'].append(dec)
+                    columns['ra_corners'].append(
+                        (ra + 0.1*np.array([-1, 1, 1, -1])) % 360.)
+                    columns['dec_corners'].append(
+                        dec + 0.1*np.array([-1, -1, 1, 1]))
+        self.index = SkyMapIndex(**{key: np.array(value) for key, value
+                                    in columns.items()})
+        self.outfile = tempfile.mkstemp(suffix='.npz')[1]
+
+    def tearDown(self):
+        os.remove(self.outfile)
+
+    def test_persistence(self):
+        self.index.write(self.outfile)
+        index = SkyMapIndex.read(self.outfile)
+        self.assertEqual(index.tract_ids(), [0, 1])
+        self.assertEqual(index.patch_ids()[1], ['0,0', '0,1', '1,0', '1,1'])
+        np.testing.assert_array_equal(index.ra_corners, self.index.ra_corners)
+
+    def test_overlapping(self):
+        indexes = self.index.overlapping((50.2, 50.4), (-29.5, -29.4))
+        self.assertEqual([self.index.patch_id(i) for i in indexes],
+                         [(1, '0,0')])
+        indexes = self.index.overlapping((359.5, 360.5), (-29.95, -28.05))
+        self.assertEqual(sorted(self.index.patch_id(i) for i in indexes),
+                         [(0, '0,0'), (0, '0,1'), (0, '1,0'), (0, '1,1')])
+
+    def test_containing(self):
+        ra = np.array([359.5, 0.5, 50.95, 120.])
+        dec = np.array([-29.5, -28.5, -29.5, -29.5])
+        ipt, ipatch = self.index.containing(ra, dec, chunk_size=3)
+        found = sorted((i, self.index.patch_id(j)) for i, j in zip(ipt, ipatch))
+        self.assertEqual(found, [(0, (0, '0,0')), (1, (0, '1,1')),
+                                 (2, (1, '0,0')), (2, (1, '1,0'))])
+        ipt, ipatch = self.index.containing(ra, dec, inner=True)
+        self.assertEqual(list(ipt), [0, 1, 2])
+
+    def test_dec_candidates(self):
+        # A 40 x 30 grid of 0.5 deg patches with uneven heights.
+        np.random.seed(6006)
+        ra0, dec0 = np.meshgrid(np.arange(40)*0.5, np.arange(30)*0.5 - 40.)
+        ra0, dec0 = ra0.ravel(), dec0.ravel()
+        height = np.random.uniform(0.4, 0.7, len(ra0))
+        ra = (ra0[:, None] + 0.55*np.array([0, 1, 1, 0])) % 360.
+        dec = dec0[:, None] + height[:, None]*np.array([0, 0, 1, 1])
+        index = SkyMapIndex(np.zeros(len(ra0)), np.arange(len(ra0)),
+                            np.zeros(len(ra0)), ra, dec, ra, dec)
+        pra = np.random.uniform(0, 20, 2000)
+        pdec = np.random.uniform(-40, -25, 2000)
+        ipt, ipatch = index.containing(pra, pdec, chunk_size=700)
+        in_dec = ((pdec[:, None] >= index.dec_min)
+                  & (pdec[:, None] <= index.dec_max))
+        in_ra = ((pra[:, None] >= index.ra_min)
+                 & (pra[:, None] <= index.ra_max))
+        expected = sorted(zip(*np.where(in_dec & in_ra)))
+        self.assertEqual(sorted(zip(ipt, ipatch)), expected)
+
+    def test_pixel_to_sky(self):
+        wcs = ArrayWcs()
+        x = np.arange(8.).reshape(2, 4)*3600.
+        ra, dec = pixel_to_sky(wcs, x, 2*x)
+        self.assertEqual(wcs.ncalls, 1)
+        self.assertEqual(ra.shape, (2, 4))
+        np.testing.assert_allclose(ra[1], [54., 55., 56., 57.])
+        np.testing.assert_allclose(dec[0], [-30., -28., -26., -24.])
+
+if __name__ == '__main__':
+    unittest.main()
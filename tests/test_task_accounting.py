@@ -0,0 +1,69 @@
+"""
+Unit tests for per-task resource accounting in multiprocessing pools.
+"""
+import time
+import unittest
+import multiprocessing
+import numpy as np
+from desc.simulation_tools.task_accounting import TaskStats, AccountedTask, \
+    TaskAccountant
+
+def sleepy_square(x, dt=0.01):
+    time.sleep(dt)
+    return x*x
+
+def allocate(nbytes, dt=0.2):
+    data = np.ones(nbytes//8)
+    time.sleep(dt)
+    return len(data)
+
+class TaskAccountantTestCase(unittest.TestCase):
+    "Test case class for TaskAccountant class."
+    def test_pool(self):
+        accountant = TaskAccountant()
+        with multiprocessing.Pool(processes=2) as pool:
+            for x in range(6):
+                dt = 0.5 if x == 5 else 0.01
+                accountant.apply_async(pool, sleepy_square, (x,),
+                                       dict(dt=dt), task_id='task%d' % x)
+            pool.close()
+            pool.join()
+            results = accountant.get()
+        self.assertEqual(results, [x*x for x in range(6)])
+        table = accountant.table()
+        self.assertEqual(list(table['task_id']),
+                         ['task%d' % x for x in range(6)])
+        self.assertTrue(all(table['peak_rss'] > 0))
+        self.assertGreaterEqual(table['wall'][5], 0.5)
+        self.assertIn('task5', accountant.stragglers()['task_id'])
+        self.assertIn('task5', accountant.outliers('wall')['task_id'])
+        self.assertIn('stragglers', accountant.report())
+
+    def test_imap_unordered(self):
+        accountant = TaskAccountant()
+        with multiprocessing.Pool(processes=2) as pool:
+            results = dict(accountant.imap_unordered(pool, sleepy_square,
+                                                     range(5)))
+        self.assertEqual(results, {str(x): x*x for x in range(5)})
+        self.assertEqual(len(accountant.table()), 5)
+
+    def test_peak_rss(self):
+        # The peak RSS of a task is not inherited by later tasks run in
+        # the same process.
+        task = AccountedTask(allocate, sample_interval=0.02)
+        _, big = task('big', 400*1024**2)
+        _, small = task('small', 1024)
+        self.assertGreater(big.peak_rss - small.peak_rss, 300*1024**2)
+
+    def test_outliers(self):
+        accountant = TaskAccountant()
+        walls = [1., 1., 1., 1., 1., 1.1, 1.2, 30.]
+        accountant.stats = [TaskStats('task%d' % i, 0, 0, wall, wall, wall,
+                                      1, 0, 0) for i, wall in enumerate(walls)]
+        # The MAD is zero, but only the real outlier is flagged.
+        self.assertEqual(list(accountant.outliers('wall')['task_id']),
+                         ['task7'])
+        self.assertEqual(len(accountant.outliers('peak_rss')), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Unit tests for the KD-tree index of OpSim pointings.
+"""
+import unittest
+import numpy as np
+from desc.simulation_tools.opsim_pointings import OpsimPointings
+from desc.simulation_tools.visit_index import VisitIndex
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """Haversine separation of coordinates in degrees."""
+    ra1, dec1, ra2, dec2 = [np.radians(x) for x in (ra1, dec1, ra2, dec2)]
+    hav = (np.sin((dec2 - dec1)/2.)**2
+           + np.cos(dec1)*np.cos(dec2)*np.sin((ra2 - ra1)/2.)**2)
+    return np.degrees(2.*np.arcsin(np.sqrt(hav)))
+
+class VisitIndexTestCase(unittest.TestCase):
+    "Test case class for VisitIndex class."
+    def setUp(self):
+        np.random.seed(2002)
+        # Pointings straddling ra=0.
+        nvisits = 3000
+        self.ra = np.random.uniform(-10, 10, nvisits) % 360.
+        self.dec = np.random.uniform(-40, -20, nvisits)
+        pointings = OpsimPointings()
+        pointings.obsHistID = np.arange(1, nvisits + 1) * 2
+        pointings.ra = np.radians(self.ra)
+        pointings.dec = np.radians(self.dec)
+        self.index = VisitIndex(pointings, degrees=True)
+
+    def test_cone_and_nearest(self):
+        ra0, dec0, radius = 359., -30., 2.1
+        seps = angular_separation(ra0, dec0, self.ra, self.dec)
+        obsHistIDs, cone_seps = self.index.cone(ra0, dec0, radius)
+        self.assertEqual(set(obsHistIDs),
+                         set(self.index.obsHistID[seps < radius]))
+        self.assertTrue(np.all(np.diff(cone_seps) >= 0))
+        np.testing.assert_allclose(
+            cone_seps, self.index.separations(ra0, dec0, obsHistIDs))
+        np.testing.assert_allclose(self.index.separations(ra0, dec0), seps,
+                                   atol=1e-10)
+
+        nearest, nearest_seps = self.index.nearest(ra0, dec0, k=5)
+        np.testing.assert_array_equal(nearest, obsHistIDs[:5])
+        np.testing.assert_allclose(nearest_seps, np.sort(seps)[:5])
+        self.assertRaises(KeyError, self.index.separations, ra0, dec0, [3])
+
+    def test_box_and_counts(self):
+        obsHistIDs = self.index.box(358., 2., -25., -22.)
+        in_box = (((self.ra >= 358.) | (self.ra <= 2.))
+                  & (self.dec >= -25.) & (self.dec <= -22.))
+        np.testing.assert_array_equal(obsHistIDs,
+                                      self.index.obsHistID[in_box])
+
+        ra, dec = [0., 5., 30.], [-30., -21., -30.]
+        counts = self.index.counts(ra, dec, 2.1)
+        expected = [np.sum(angular_separation(x, y, self.ra, self.dec) < 2.1)
+                    for x, y in zip(ra, dec)]
+        np.testing.assert_array_equal(counts, expected)
+        self.assertEqual(counts[-1], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+Unit tests for the DS9 region file writer.
+"""
+import os
+import gzip
+import tempfile
+import unittest
+import numpy as np
+from desc.simulation_tools import write_region_file
+
+class WriteRegionFileTestCase(unittest.TestCase):
+    "Test case class for write_region_file."
+    def setUp(self):
+        self.outfile = tempfile.mkstemp(suffix='.reg')[1]
+        self.ra = np.array([10., 10.5, 11.])
+        self.dec = np.array([-30., -30.25, -30.5])
+
+    def tearDown(self):
+        for item in (self.outfile, self.outfile + '.gz'):
+            if os.path.isfile(item):
+                os.remove(item)
+
+    def _read_regions(self, outfile, opener=open):
+        with opener(outfile, 'rt') as fd:
+            lines = fd.readlines()
+        self.assertEqual(lines[2], 'fk5\n')
+        return lines[3:]
+
+    def test_structured_array(self):
+        catalog = np.zeros(3, dtype=[('coord_ra', float),
+                                     ('coord_dec', float)])
+        catalog['coord_ra'] = np.radians(self.ra)
+        catalog['coord_dec'] = np.radians(self.dec)
+        write_region_file(catalog, self.outfile, chunk_size=2)
+        regions = self._read_regions(self.outfile)
+        self.assertEqual(len(regions), 3)
+        self.assertEqual(regions[1],
+                         'point(10.50000000,-30.25000000) # point=circle\n')
+
+    def test_columns_and_compression(self):
+        outfile = self.outfile + '.gz'
+        write_region_file((self.ra, self.dec), outfile,
+                          shape=np.array(['box', 'x', 'diamond']),
+                          size=np.array([3, 5, 7]), color='red')
+        regions = self._read_regions(outfile, opener=gzip.open)
+        self.assertEqual(regions[2],
+                         'point(11.00000000,-30.50000000) # point=diamond 7 '
+                         'color=red\n')
+
+if __name__ == '__main__':
+    unittest.main()